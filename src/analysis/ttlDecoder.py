@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Splits a recorded TTL channel into protocols, epochs and frames using the
+saved experiment.
+
+Record the TTL output (or the photodiode over the sync patch) on a digital or
+analog channel of the acquisition system, then:
+
+    from analysis.ttlDecoder import loadExperiment, decodeTTL
+    experiment = loadExperiment('myExperiment.json')
+    protocols = decodeTTL(trace, sampleRate, experiment)
+
+Edges are detected in bulk with numpy, in chunks so that long recordings
+don't need several copies of the trace in memory. An hour at 30 kHz takes a
+few seconds.
+
+Sustained and photodiode recordings are split at the TTL bookmarks (binary or
+legacy) when they were used, and otherwise by counting the edges that each
+protocol logged in _timesTTLFlipped. Pulse recordings are split at the burst
+of 20 + 20 pulses that starts every protocol (see protocol.burstTTL), followed
+by the number of pulses the protocol logged in _timesTTLFlipped. Epochs are
+then found in the same way for every mode (see splitEpochs).
+
+"""
+import json
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from experiments.bookmarks import decodeBookmarks, findLegacyBookmarks, MAX_DATA_BITS
+
+BURST_PULSES = 20 #pulses in each half of protocol.burstTTL
+BURST_PAUSE = 0.2 #seconds between the two halves of protocol.burstTTL
+
+
+def loadExperiment(fileName):
+    '''
+    Load the .json file that Bassoon saves alongside every .experiment file
+
+    returns: dictionary of the experiment's saved attributes
+    '''
+    with open(fileName) as f:
+        return json.load(f)
+
+
+def findEdges(trace, threshold = None, invert = False, chunkSize = 10_000_000):
+    '''
+    Find every transition of a recorded TTL channel
+
+    Inputs:
+        - trace: 1D numpy array of the recorded channel (bool, digital words or analog voltages)
+        - threshold: samples above this value are ON. Default is halfway between the smallest and largest value. Ignored for bool traces
+        - invert: set to True if ON is recorded as the low level
+        - chunkSize: number of samples processed at a time
+
+    returns: (edgeSamples, edgeIsRising)
+        - edgeSamples: index of the first sample after every transition
+        - edgeIsRising: True where the channel turned ON
+    '''
+    trace = np.asarray(trace)
+    if trace.dtype != bool and threshold is None:
+        threshold = (float(trace.min()) + float(trace.max()))/2
+
+    edgeSamples = []
+    previous = None
+    for start in range(0, len(trace), chunkSize):
+        chunk = trace[start:start + chunkSize]
+        state = chunk if chunk.dtype == bool else chunk > threshold
+        if invert:
+            state = ~state
+
+        change = np.flatnonzero(state[1:] != state[:-1]) + 1
+        if previous is not None and state[0] != previous:
+            change = np.concatenate([[0], change])
+        edgeSamples.append(change + start)
+        previous = state[-1]
+
+    if not edgeSamples:
+        return np.array([], dtype = np.int64), np.array([], dtype = bool)
+
+    edgeSamples = np.concatenate(edgeSamples).astype(np.int64)
+    initialState = trace[0] if trace.dtype == bool else trace[0] > threshold
+    initialState = bool(initialState) != invert
+    #edges alternate, so the first edge is rising if the channel starts OFF
+    edgeIsRising = (np.arange(len(edgeSamples)) % 2 == 0) != initialState
+    return edgeSamples, edgeIsRising
+
+
+def groupPulses(edgeSamples, sampleRate, maxGap = 0.001):
+    '''
+    In pulse mode every TTL is a short burst of serial activity with several edges. Groups edges that are closer than maxGap (seconds) together
+
+    returns: sample index of the first edge of every pulse
+    '''
+    if len(edgeSamples) == 0:
+        return edgeSamples
+    newPulse = np.concatenate([[True], np.diff(edgeSamples) > maxGap*sampleRate])
+    return edgeSamples[newPulse]
+
+
+def findBursts(pulseSamples, sampleRate, frameRate, tolerance = 0.3):
+    '''
+    Find the stereotyped burst of BURST_PULSES pulses at frame rate, a BURST_PAUSE second pause and BURST_PULSES more pulses that starts every protocol in pulse mode
+
+    returns: index (into pulseSamples) of the first pulse of every burst
+    '''
+    numIntervals = 2*BURST_PULSES - 1
+    if len(pulseSamples) < numIntervals + 1:
+        return np.array([], dtype = int)
+
+    intervals = np.diff(pulseSamples)*frameRate/sampleRate #in frames
+    pauseFrames = 1 + BURST_PAUSE*frameRate #the pause comes after the flip of the last pulse of the first half
+    expected = np.ones(numIntervals)
+    expected[BURST_PULSES - 1] = pauseFrames
+    windows = sliding_window_view(intervals, numIntervals)
+    allowed = np.full(numIntervals, tolerance)
+    allowed[BURST_PULSES - 1] = max(tolerance, 0.05*pauseFrames) #core.wait is less exact than the frame clock
+    matches = np.flatnonzero((np.abs(windows - expected) <= allowed).all(axis = 1))
+
+    #don't report overlapping matches more than once
+    keep = np.concatenate([[True], np.diff(matches) > numIntervals]) if len(matches) else matches.astype(bool)
+    return matches[keep]
+
+
+def splitEpochs(edges, epochTTLs = None, numEpochs = 0):
+    '''
+    Split a protocol's edges into epochs. Every epoch starts with a TTL and ends with a TTL, and the TTLs in between mark frames
+
+    Inputs:
+        - edges: sample index of every edge of the protocol (bookmarks not included)
+        - epochTTLs: the protocol's _epochTTLLog, which gives the number of TTLs sent before every epoch started and ended, so epochs can have any number of edges (e.g. frames skipped in time-based mode)
+        - numEpochs: the protocol's _numberOfEpochsCompleted. For experiments saved before _epochTTLLog existed, every epoch is assumed to have the same number of edges, and a single extra edge at the end is the TTL being turned off after the protocol
+
+    returns: (epochStarts, epochEnds, frames, warning) - sample index of the first and last edge of every completed epoch, an array of the edges in between for every completed epoch, and a description of anything that didn't match the log (otherwise None)
+    '''
+    empty = np.array([], dtype = np.int64)
+    if epochTTLs is None:
+        if numEpochs <= 0:
+            return empty, empty, [], None
+        if len(edges) < numEpochs or len(edges) % numEpochs > 1:
+            return empty, empty, [], f'{len(edges)} edges could not be split evenly into {numEpochs} epochs'
+        edgesPerEpoch = len(edges)//numEpochs
+        byEpoch = edges[:edgesPerEpoch*numEpochs].reshape(numEpochs, edgesPerEpoch)
+        return byEpoch[:, 0], byEpoch[:, -1], list(byEpoch[:, 1:-1]), None
+
+    completed = np.array([e for e in epochTTLs if e[1] is not None], dtype = np.int64).reshape(-1, 2)
+    warning = None
+    if len(completed) != len(epochTTLs):
+        warning = f'{len(epochTTLs) - len(completed)} epochs started but did not finish (the protocol was probably quit early)'
+    if len(completed) != numEpochs:
+        warning = f'{len(completed)} epochs were logged but {numEpochs} were completed'
+
+    inRecording = completed[:, 1] < len(edges)
+    if not inRecording.all():
+        warning = f'the recording ends before the end of epoch {np.argmin(inRecording) + 1}'
+        completed = completed[:np.argmin(inRecording)]
+
+    frames = [edges[start + 1:end] for start, end in completed]
+    return edges[completed[:, 0]], edges[completed[:, 1]], frames, warning
+
+
+def decodeTTL(trace, sampleRate, experiment, threshold = None, invert = False, tolerance = 0.3):
+    '''
+    Split a recorded TTL channel into protocols, epochs and frames
+
+    Inputs:
+        - trace: 1D numpy array of the recorded TTL channel
+        - sampleRate: sample rate of the recording (Hz)
+        - experiment: saved experiment (see loadExperiment)
+        - threshold, invert: see findEdges
+        - tolerance: how far (in frames) intervals of bookmarks and bursts can be from their expected length
+
+    returns: list with a dictionary for every logged protocol:
+        - 'protocolName', 'protocolIndex'
+        - 'markerStart', 'markerEnd': sample index of the start and end of the bookmark or burst that marks the protocol (None if there wasn't one)
+        - 'edges': sample index of every TTL of the protocol (edges in sustained/photodiode mode, pulses in pulse mode)
+        - 'epochStarts', 'epochEnds', 'frames': see splitEpochs (pulse mode experiments saved before pulses were counted have none)
+        - 'protocolIndex' is the protocol's index in the experiment's protocolList (_protocolIndex), which is what binary bookmarks encode. Experiments saved before _protocolIndex was logged use the position in loggedStimuli
+        - 'warning': description of anything that didn't match the log, otherwise None
+    '''
+    frameRate = experiment['FR']
+    mode = experiment['writeTTL']
+    loggedStimuli = experiment['loggedStimuli']
+    edgeSamples, edgeIsRising = findEdges(trace, threshold = threshold, invert = invert)
+
+    if mode == 'Pulse':
+        return decodePulses(edgeSamples, sampleRate, frameRate, loggedStimuli, tolerance)
+
+    #find the bookmarks that mark the start of each protocol
+    edgeTimes = edgeSamples/sampleRate
+    codes = [p.get('_bookmarkCode') for p in loggedStimuli]
+    binaryDataBits = {p.get('_bookmarkDataBits') or MAX_DATA_BITS for p in loggedStimuli if p.get('_bookmarkCode') == 'binary'}
+    binary = {dataBits: decodeBookmarks(edgeTimes, edgeIsRising, frameRate, tolerance, dataBits) for dataBits in binaryDataBits} #decoded once for every length of bookmark
+    legacy = findLegacyBookmarks(edgeTimes, edgeIsRising, frameRate, tolerance) if 'legacy' in codes else None
+
+    results = []
+    nextEdge = 0 #first edge that hasn't been assigned to a protocol yet
+    for position, p in enumerate(loggedStimuli):
+        protocolIndex = p.get('_protocolIndex')
+        if protocolIndex is None:
+            protocolIndex = position
+        result = {'protocolName': p.get('protocolName', ''), 'protocolIndex': protocolIndex,
+                  'markerStart': None, 'markerEnd': None, 'warning': None}
+        code = p.get('_bookmarkCode')
+        numBookmarkEdges = p.get('_timesTTLFlippedBookmark', 0)
+
+        markerEdges = None
+        if code == 'binary':
+            #the first bookmark after the last protocol with this protocol's index
+            dataBits = p.get('_bookmarkDataBits') or MAX_DATA_BITS
+            bookmarks = binary[dataBits]
+            found = np.flatnonzero((bookmarks['startEdge'] >= nextEdge) & (bookmarks['protocolIndex'] == protocolIndex % 2**dataBits))
+            if len(found):
+                markerEdges = (bookmarks['startEdge'][found[0]], bookmarks['endEdge'][found[0]])
+        elif code == 'legacy':
+            found = np.flatnonzero(legacy['startEdge'] >= nextEdge)
+            if len(found):
+                markerEdges = (legacy['startEdge'][found[0]], legacy['endEdge'][found[0]])
+
+        if markerEdges is not None:
+            result['markerStart'], result['markerEnd'] = edgeSamples[markerEdges[0]], edgeSamples[markerEdges[1]]
+            if markerEdges[0] > nextEdge:
+                result['warning'] = f'{markerEdges[0] - nextEdge} edges before the bookmark did not match the log'
+            nextEdge = markerEdges[1] + 1
+        else:
+            if code is not None:
+                result['warning'] = 'bookmark not found, the protocol was located by counting edges instead'
+            nextEdge += numBookmarkEdges
+
+        numEdges = p.get('_timesTTLFlipped', 0)
+        edges = edgeSamples[nextEdge:nextEdge + numEdges]
+        if len(edges) < numEdges:
+            result['warning'] = f'the recording ends {numEdges - len(edges)} edges before the end of this protocol'
+        nextEdge += numEdges
+
+        result['edges'] = edges
+        result['epochStarts'], result['epochEnds'], result['frames'], epochWarning = splitEpochs(edges, p.get('_epochTTLLog'), p.get('_numberOfEpochsCompleted', 0))
+        if epochWarning is not None:
+            result['warning'] = epochWarning if result['warning'] is None else result['warning'] + '; ' + epochWarning
+        results.append(result)
+
+    if nextEdge < len(edgeSamples):
+        print(f'*** NOTE: {len(edgeSamples) - nextEdge} edges at the end of the recording were not assigned to a protocol')
+    return results
+
+
+def decodePulses(edgeSamples, sampleRate, frameRate, loggedStimuli, tolerance = 0.3):
+    '''
+    decodeTTL for pulse mode recordings. Every protocol starts with a burst (see findBursts) followed by the pulses it logged in _timesTTLFlipped
+    '''
+    pulseSamples = groupPulses(edgeSamples, sampleRate)
+    bursts = findBursts(pulseSamples, sampleRate, frameRate, tolerance)
+    empty = np.array([], dtype = np.int64)
+
+    results = []
+    nextPulse = 0 #first pulse that hasn't been assigned to a protocol yet
+    for position, p in enumerate(loggedStimuli):
+        protocolIndex = p.get('_protocolIndex')
+        if protocolIndex is None:
+            protocolIndex = position
+        result = {'protocolName': p.get('protocolName', ''), 'protocolIndex': protocolIndex,
+                  'markerStart': None, 'markerEnd': None, 'edges': empty,
+                  'epochStarts': empty, 'epochEnds': empty, 'frames': [], 'warning': None}
+
+        #the first burst after the last protocol
+        found = np.flatnonzero(bursts >= nextPulse)
+        if len(found):
+            burst = bursts[found[0]]
+            result['markerStart'], result['markerEnd'] = pulseSamples[burst], pulseSamples[burst + 2*BURST_PULSES - 1]
+            if burst > nextPulse:
+                result['warning'] = f'{burst - nextPulse} pulses before the burst did not match the log'
+            nextPulse = burst + 2*BURST_PULSES
+        else:
+            result['warning'] = 'burst not found, the protocol was located by counting pulses instead'
+            nextPulse += 2*BURST_PULSES
+
+        if p.get('_timesTTLFlippedBookmark', 0) == 0:
+            #saved before pulses were counted: the protocol's pulses are everything up to the next burst
+            following = bursts[bursts >= nextPulse]
+            end = following[0] if len(following) else len(pulseSamples)
+            result['edges'] = pulseSamples[nextPulse:end]
+            nextPulse = max(nextPulse, end)
+            results.append(result)
+            continue
+
+        numPulses = p.get('_timesTTLFlipped', 0)
+        pulses = pulseSamples[nextPulse:nextPulse + numPulses]
+        if len(pulses) < numPulses:
+            result['warning'] = f'the recording ends {numPulses - len(pulses)} pulses before the end of this protocol'
+        nextPulse += numPulses
+
+        result['edges'] = pulses
+        result['epochStarts'], result['epochEnds'], result['frames'], epochWarning = splitEpochs(pulses, p.get('_epochTTLLog'), p.get('_numberOfEpochsCompleted', 0))
+        if epochWarning is not None:
+            result['warning'] = epochWarning if result['warning'] is None else result['warning'] + '; ' + epochWarning
+        results.append(result)
+
+    if nextPulse < len(pulseSamples):
+        print(f'*** NOTE: {len(pulseSamples) - nextPulse} pulses at the end of the recording were not assigned to a protocol')
+    return results
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the sequences that protocols build in prepare (noise
+sequences, position logs, scotoma schedules, phase logs...).
+
+The same protocols are often run with the same parameters and random seed
+many times. Their prepare step always produces the same result for the same
+protocol class, the parameters that prepare reads (protocol.prepareParameters,
+including randomSeed), frame rate and window geometry, so the result is stored under a hash of those and loaded
+instead of being rebuilt.
+
+Every cached result is a folder named after its key that holds
+attributes.json (the attributes that prepare set, other than numpy arrays)
+and one .npy file per numpy array. Arrays in protocol._preparedData are
+memory-mapped when they are loaded, so even very long noise sequences load in
+milliseconds. The least recently used results are removed when the cache
+grows beyond its maximum size.
+
+Frame rates are matched to the nearest 0.1 Hz. A result that was prepared
+for a frame rate more than 0.1% away from the current one is rebuilt (see
+protocol.isPreparedFor).
+
+"""
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+CACHE_VERSION = 2 #increase to ignore everything cached before a change to how protocols prepare
+
+
+class artifactCache():
+    def __init__(self, folder = 'artifactCache', maxSizeGB = 2.0):
+        self.folder = folder #folder that cached results are stored in
+        self.maxSizeGB = maxSizeGB #least recently used results are removed when the folder grows beyond this size
+
+
+    def getKey(self, p, geometry, FR):
+        '''
+        Returns the key of protocol p prepared for a window geometry (see protocol.getGeometry) and frame rate
+        '''
+        parameters = {name: getattr(p, name, None) for name in p.prepareParameters} #parameters that only matter when the protocol runs (e.g. writeTTL, which activate sets after compile time) don't change the key
+        description = {
+            'version': CACHE_VERSION,
+            'protocol': type(p).__module__ + '.' + type(p).__name__,
+            'parameters': parameters,
+            'FR': round(FR, 1),
+            'geometry': geometry,
+            }
+        text = json.dumps(description, sort_keys = True, default = repr)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+
+    def load(self, key):
+        '''
+        Returns the dictionary of attributes that was saved under key, or None if there isn't one (or it can't be read)
+        '''
+        entry = os.path.join(self.folder, key)
+        try:
+            with open(os.path.join(entry, 'attributes.json')) as f:
+                saved = json.load(f)
+
+            attributes = saved['attributes']
+            for name in saved['arrays']:
+                attributes[name] = np.load(os.path.join(entry, name + '.npy'))
+            preparedData = {}
+            for name in saved['preparedData']:
+                preparedData[name] = np.load(os.path.join(entry, '_preparedData.' + name + '.npy'), mmap_mode = 'r')
+            if saved['preparedData']:
+                attributes['_preparedData'] = preparedData
+
+            os.utime(entry) #mark as recently used
+        except (OSError, ValueError, KeyError):
+            return None
+
+        return attributes
+
+
+    def save(self, key, attributes):
+        '''
+        Save the attributes that prepare set under key, then remove the least recently used results if the cache is too big
+
+        returns: True if the attributes were saved. Attributes that can't be stored (anything other than numpy arrays and values that can be saved as JSON) are not cached
+        '''
+        saved = {'attributes': {}, 'arrays': [], 'preparedData': []}
+        arrays = {}
+        for name, value in attributes.items():
+            if isinstance(value, np.ndarray):
+                saved['arrays'].append(name)
+                arrays[name] = value
+            elif name == '_preparedData':
+                for dataName, data in value.items():
+                    saved['preparedData'].append(dataName)
+                    arrays['_preparedData.' + dataName] = np.asarray(data)
+            else:
+                saved['attributes'][name] = value
+
+        #write to a temporary folder first, so that other processes never load a result that is only partly written
+        entry = os.path.join(self.folder, key)
+        temporary = os.path.join(self.folder, 'writing-' + uuid.uuid4().hex)
+        try:
+            os.makedirs(temporary)
+            with open(os.path.join(temporary, 'attributes.json'), 'w') as f:
+                json.dump(saved, f)
+            for name, array in arrays.items():
+                np.save(os.path.join(temporary, name + '.npy'), array)
+            if os.path.isdir(entry):
+                shutil.rmtree(entry, ignore_errors = True) #an older result for a frame rate that was too far off
+            os.replace(temporary, entry)
+        except (OSError, TypeError, ValueError) as e:
+            shutil.rmtree(temporary, ignore_errors = True)
+            print(f'*** NOTE: could not cache a prepared protocol ({e!r})')
+            return False
+
+        self.evict(keep = key)
+        return True
+
+
+    def evict(self, keep = None):
+        '''
+        Remove the least recently used results until the cache is smaller than self.maxSizeGB. The result with key keep is never removed
+        '''
+        entries = []
+        totalSize = 0
+        try:
+            keys = os.listdir(self.folder)
+        except OSError:
+            return
+        for key in keys:
+            entry = os.path.join(self.folder, key)
+            if key.startswith('writing-'):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry) if f.is_file())
+                lastUsed = os.path.getmtime(entry)
+            except OSError: #not a folder, or another process removed it while this one was looking
+                continue
+            entries.append((lastUsed, size, key))
+            totalSize += size
+
+        for lastUsed, size, key in sorted(entries):
+            if totalSize <= self.maxSizeGB * 1e9:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.folder, key), ignore_errors = True)
+            totalSize -= size
+
+
+    def clear(self):
+        '''
+        Remove everything in the cache
+        '''
+        shutil.rmtree(self.folder, ignore_errors = True)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Binary TTL bookmarks that mark the start of each protocol in sustained and
+photodiode TTL modes.
+
+A bookmark is a sequence of TTL levels, each held for a whole number of
+frames, that starts with the TTL turning ON:
+    - a preamble: ON for PREAMBLE_FRAMES frames (longer than any data level, so it can't be mistaken for data)
+    - the protocol index (most significant bit first), with just enough bits for the number of protocols in the experiment (see getDataBits), then CHECKSUM_BITS bits of checksum
+    - each bit is one level that alternates OFF, ON, OFF... and is held for 1 frame for a 0 or 2 frames for a 1
+    - the TTL is turned OFF again after the last bit
+
+Every bit starts with an edge, so the code is self-clocking: the decoder only
+needs the time between edges and the approximate frame rate. The checksum is
+the parity of the index, so any single level that is read with the wrong
+length is rejected. With n data bits a bookmark takes between 4 + n and
+5 + 2n frames: at most 13 frames for up to 16 protocols, and never more than
+the 21 frames of the legacy 1-6 frame pattern, which doesn't carry the index.
+The number of data bits is logged with each protocol (_bookmarkDataBits) so
+that the decoder reads the same number back.
+
+The legacy pattern (ON 1 frame, OFF 2 frames, ... OFF 6 frames) can be found
+with findLegacyBookmarks.
+
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+PREAMBLE_FRAMES = 3
+MAX_DATA_BITS = 8 #protocol indices wrap around after 2**MAX_DATA_BITS protocols
+CHECKSUM_BITS = 1
+LEGACY_PATTERN = [1, 2, 3, 4, 5, 6]
+
+
+def getDataBits(numProtocols):
+    '''
+    Returns the number of data bits needed to send the index of every protocol of an experiment with numProtocols protocols (at least 1, at most MAX_DATA_BITS)
+    '''
+    return min(MAX_DATA_BITS, max(1, (numProtocols - 1).bit_length()))
+
+
+def getChecksum(index, dataBits = MAX_DATA_BITS):
+    '''
+    Returns the checksum for a protocol index
+    '''
+    index = index % 2**dataBits
+    return bin(index).count('1') % 2**CHECKSUM_BITS
+
+
+def encodeBookmark(index, dataBits = MAX_DATA_BITS):
+    '''
+    Encode a protocol index as a bookmark
+
+    Inputs:
+        - index: protocol index. Only the lowest dataBits bits are sent, so indices wrap around after 2**dataBits protocols
+        - dataBits: number of bits of the index to send (see getDataBits)
+
+    Returns: list of the number of frames to hold each level for, starting with the preamble (ON). The TTL is toggled at the start of every level and turned OFF after the last one
+    '''
+    index = index % 2**dataBits
+    bits = [(index >> b) & 1 for b in range(dataBits - 1, -1, -1)]
+    checksum = getChecksum(index, dataBits)
+    bits += [(checksum >> b) & 1 for b in range(CHECKSUM_BITS - 1, -1, -1)]
+    return [PREAMBLE_FRAMES] + [2 if bit else 1 for bit in bits]
+
+
+def getIntervalFrames(edgeTimes, frameRate, tolerance = 0.3):
+    '''
+    Convert the time between consecutive edges to a number of frames
+
+    Returns: (frames, valid) - the nearest whole number of frames for every interval, and whether the interval was within tolerance (in frames) of it
+    '''
+    intervals = np.diff(np.asarray(edgeTimes, dtype = float))*frameRate
+    frames = np.rint(intervals).astype(int)
+    valid = np.abs(intervals - frames) <= tolerance
+    return frames, valid
+
+
+def decodeBookmarks(edgeTimes, edgeIsRising, frameRate, tolerance = 0.3, dataBits = MAX_DATA_BITS):
+    '''
+    Find all binary bookmarks in a sequence of TTL edges
+
+    Inputs:
+        - edgeTimes: time (in seconds, or samples divided by the sample rate) of every edge of the TTL signal, in order
+        - edgeIsRising: bool array, True where the edge is the TTL turning ON
+        - frameRate: frame rate of the stimulus window (Hz)
+        - tolerance: how far (in frames) an interval can be from a whole number of frames
+        - dataBits: number of bits of the protocol index in each bookmark (the protocols' _bookmarkDataBits)
+
+    Returns: dictionary of numpy arrays with one entry per valid bookmark
+        - 'startEdge': index of the edge that starts the preamble
+        - 'endEdge': index of the edge that turns the TTL OFF after the last bit
+        - 'protocolIndex': the decoded protocol index (mod 2**dataBits)
+    and 'rejected', the number of bookmarks that had a preamble and valid levels but a wrong checksum
+    '''
+    numLevels = 1 + dataBits + CHECKSUM_BITS
+    edgeIsRising = np.asarray(edgeIsRising, dtype = bool)
+    frames, valid = getIntervalFrames(edgeTimes, frameRate, tolerance)
+    empty = {'startEdge': np.array([], dtype = int), 'endEdge': np.array([], dtype = int), 'protocolIndex': np.array([], dtype = int), 'rejected': 0}
+    if len(frames) < numLevels:
+        return empty
+
+    windows = sliding_window_view(frames, numLevels) #row k holds the levels that follow edge k
+    windowValid = sliding_window_view(valid, numLevels).all(axis = 1)
+    candidates = (edgeIsRising[:len(windows)]
+                  & windowValid
+                  & (windows[:, 0] == PREAMBLE_FRAMES)
+                  & ((windows[:, 1:] == 1) | (windows[:, 1:] == 2)).all(axis = 1))
+    startEdge = np.flatnonzero(candidates)
+    if len(startEdge) == 0:
+        return empty
+
+    bits = windows[startEdge, 1:] == 2
+    indexBits = bits[:, :dataBits]
+    protocolIndex = indexBits @ (1 << np.arange(dataBits - 1, -1, -1))
+    checksum = bits[:, dataBits:] @ (1 << np.arange(CHECKSUM_BITS - 1, -1, -1))
+    correct = checksum == indexBits.sum(axis = 1) % 2**CHECKSUM_BITS
+
+    return {'startEdge': startEdge[correct],
+            'endEdge': startEdge[correct] + numLevels,
+            'protocolIndex': protocolIndex[correct],
+            'rejected': int((~correct).sum())}
+
+
+def findLegacyBookmarks(edgeTimes, edgeIsRising, frameRate, tolerance = 0.3):
+    '''
+    Find all legacy bookmarks (ON 1 frame, OFF 2 frames, ..., ON 5 frames, then OFF for at least 6 frames)
+
+    Returns: dictionary with 'startEdge' (index of the first rising edge of each bookmark) and 'endEdge' (index of the edge that turns the TTL OFF for the last time)
+    '''
+    pattern = np.array(LEGACY_PATTERN[:-1]) #the last OFF level has no closing edge of its own
+    edgeIsRising = np.asarray(edgeIsRising, dtype = bool)
+    frames, valid = getIntervalFrames(edgeTimes, frameRate, tolerance)
+    if len(frames) < len(pattern) + 1:
+        return {'startEdge': np.array([], dtype = int), 'endEdge': np.array([], dtype = int)}
+
+    windows = sliding_window_view(frames, len(pattern) + 1)
+    windowValid = sliding_window_view(valid, len(pattern)).all(axis = 1)[:len(windows)]
+    matches = (edgeIsRising[:len(windows)]
+               & windowValid
+               & (windows[:, :-1] == pattern).all(axis = 1)
+               & (windows[:, -1] >= LEGACY_PATTERN[-1]))
+    startEdge = np.flatnonzero(matches)
+    return {'startEdge': startEdge, 'endEdge': startEdge + len(pattern)}
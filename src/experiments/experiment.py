@@ -4,10 +4,25 @@ Created on Fri Jul  9 17:24:12 2021
 
 @author: mrsco
 """
-from psychopy import core, visual, data, event, monitors
+from psychopy import core, visual, data, event, monitors, logging
 from psychopy.visual.windowwarp import Warper
+from experiments.stimulusPool import stimulusPool
+from experiments.reducedResolution import reducedResolutionRenderer
+from experiments.ttlWriter import ttlWriter
+from experiments.fakeSerial import fakeSerialPort
+from experiments.bookmarks import encodeBookmark, getDataBits
+from experiments.sharedArrays import shareArrays, attachArrays, releaseBlocks
+from experiments.artifactCache import artifactCache
+from experiments.runJournal import runJournal
+from experiments.logSpill import spillLargeAttributes
+from protocols.protocol import protocol
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+from types import SimpleNamespace
 import serial
 import json
+import os
+import time
 from pathlib import Path
 from datetime import datetime
 
@@ -27,6 +42,12 @@ class experiment():
         self.stimMonitor = 'testMonitor'
         self.gamma = 2.0 #Default gamma value, will be updated from calibration.
 
+        self.win = None #stimulus window, created in self.activate(). Must destroy to pickle the experiment object
+        self.warper = None #Warper for the stimulus window when an FBO is used. Must destroy to pickle the experiment object
+        self.persistentWindow = False #if True, the stimulus and information windows stay open between runs (while the GUI is open) instead of being recreated every time an experiment is run
+        self.stimulusPool = None #stimulusPool that lets protocols share stimulus objects (created with the stimulus window). Must destroy to pickle the experiment object
+        self.windowSettings = None #the window settings that the open windows were created with. If these change, the windows are recreated on the next run
+
         self.useInformationMonitor = False
         self.informationMonitor = 'testMonitor'
         self.informationWin = None #will become a process. Must destroy to pickle the experiment object
@@ -40,10 +61,14 @@ class experiment():
         self.userInitiated = False #If True, the user will have to manually start each stimulus. Can also set this property manually for each stimulus
         self.angleOffset = 0.0 #deg - offset for directional stimuli
 
-        self.writeTTL = 'None' #can be 'None', 'Pulse', 'Sustained'
-        self.ttlBookmarks = False #used for sustained mode only to send stereotyped bookmark patterns before each stimulus
+        self.writeTTL = 'None' #can be 'None', 'Pulse', 'Sustained', 'Photodiode'
+        self.ttlBookmarks = False #used for sustained and photodiode modes only to send stereotyped bookmark patterns before each stimulus
+        self.bookmarkCode = 'binary' #'binary' sends the protocol index as a short code (see experiments/bookmarks.py). 'legacy' sends the original 1-6 frame pattern
         self.ttlPort = ''
         self.ttlPortOpen = False #tracks whether the TTL port is open or not (not whether it's ON or OFF, but if the port itself is open and ready for commands)
+        self.asyncTTL = False #if True, TTLs are written to the port on a background thread so that the render loop doesn't wait for the serial I/O
+        self.syncPatchSize = 50 #pixels - width and height of the sync patch that is drawn in 'Photodiode' TTL mode
+        self.syncPatchCorner = 'bottom right' #corner of the window that the sync patch is drawn in: 'bottom right', 'bottom left', 'top right' or 'top left'
 
         self.warpFileName = 'Warp File Location' #must be .data
         self.useFBO = False
@@ -54,6 +79,20 @@ class experiment():
 
         self.timingReport = False
         
+        self.timeBasedAnimation = False #if True, motion is computed from the measured flip time rather than the frame count, which compensates for dropped frames
+        
+        self.reducedResolutionTolerance = 0.0 #if greater than 0, protocols with coarse features are rendered at a reduced resolution and upscaled to the window. One rendered pixel is kept smaller than this fraction of the protocol's smallest feature (e.g. 0.1). 0 always renders at full resolution
+        self.upscaleFilter = 'nearest' #filter used to upscale reduced resolution frames to the window: 'nearest' or 'linear'
+
+        self.artifactCacheFolder = 'artifactCache' #folder where the sequences that protocols build before they run are cached (see experiments/artifactCache.py). Leave empty to turn the cache off
+        self.artifactCacheSizeGB = 2.0 #least recently used sequences are removed from the cache when it grows beyond this size
+
+        self.journalFolder = 'journals' #folder where a journal of every run is written as it runs, so that it can be recovered after a crash (see experiments/runJournal.py). Leave empty to turn journaling off
+        self.journalEpochs = False #if True, every epoch is also written to the journal as it finishes. Otherwise only finished protocols are
+        self.journalFileName = '' #journal of the last run
+
+        self.spillLogSizeMB = 0.0 #attributes of logged protocols that hold more than this many MB of numbers are moved to a file in spilledLogs/ as each protocol finishes, which keeps memory use flat in long experiments (see experiments/logSpill.py). 0 keeps everything in memory
+        
         #Load previously saved experimental settings from configOptions.json
         if Path('configOptions.json').is_file():
             with open('configOptions.json') as f:
@@ -89,6 +128,19 @@ class experiment():
                     self.ttlBookmarks = configOptions['experiment']['ttlBookmarks']
                     self.timingReport = configOptions['experiment']['timingReport']
                     self.recompileExperiment = configOptions['experiment']['recompileExperiment']
+                    self.timeBasedAnimation = configOptions['experiment']['timeBasedAnimation']
+                    self.persistentWindow = configOptions['experiment']['persistentWindow']
+                    self.reducedResolutionTolerance = float(configOptions['experiment']['reducedResolutionTolerance'])
+                    self.upscaleFilter = configOptions['experiment']['upscaleFilter']
+                    self.asyncTTL = configOptions['experiment']['asyncTTL']
+                    self.syncPatchSize = float(configOptions['experiment']['syncPatchSize'])
+                    self.syncPatchCorner = configOptions['experiment']['syncPatchCorner']
+                    self.bookmarkCode = configOptions['experiment']['bookmarkCode']
+                    self.artifactCacheFolder = configOptions['experiment']['artifactCacheFolder']
+                    self.artifactCacheSizeGB = float(configOptions['experiment']['artifactCacheSizeGB'])
+                    self.journalFolder = configOptions['experiment']['journalFolder']
+                    self.journalEpochs = configOptions['experiment']['journalEpochs']
+                    self.spillLogSizeMB = float(configOptions['experiment']['spillLogSizeMB'])
                 except:
                     print('*** Could not load all configuration settings from src/configOptions.json. Manually apply settings in the Options menu.')
 
@@ -123,14 +175,14 @@ class experiment():
             self.ttlPortOpen = False
             self.portObj.close() #close the open port if one is open that has a DIFFERENT name than the new one
         
-        if self.writeTTL != ('Sustained' or 'Pulse'):
-            return #just in case, make sure this function is only called when the writeTTL option is set to Sustained
+        if self.writeTTL not in ('Sustained', 'Pulse'):
+            return #just in case, make sure this function is only called when the writeTTL option is set to Sustained or Pulse
         
         if portInfo == 'No Available Ports' or portInfo == '':
             return #check to make sure a real port has been selected
         
         #get port name
-        if fromSave:
+        if fromSave or ' ' not in portInfo:
             portName = portInfo
         else:   
             portName = portInfo[:portInfo.find(' ')] #PARSING FOR HOW PORT NAME IS DETERMINED - may need to be manually adjusted based on operating system
@@ -142,12 +194,18 @@ class experiment():
             self.writeTTL = 'None'
             return
         
+        #ports whose name starts with 'fake' are recorded in software instead of opened (for testing TTL timing without a rig)
+        if portName.lower().startswith('fake'):
+            portType = fakeSerialPort
+        else:
+            portType = serial.Serial
+        
         try:
             if self.writeTTL == 'Sustained':
-                self.portObj = serial.Serial(portName)
+                self.portObj = portType(portName)
                 self.portObj.rts = True #set the RTS value to True, moving the voltage to 0
             elif self.writeTTL == 'Pulse':
-                self.portObj = serial.Serial(portName, 4000000)   
+                self.portObj = portType(portName, 4000000)   
             self.ttlPortOpen = True
             print('--> New TTL port has been opened')
         except serial.serialutil.SerialException:
@@ -164,47 +222,60 @@ class experiment():
         
         
         
-    def activate(self):
+    def activate(self, startIndex = 0):
         '''
         Begin the experiment
-        '''
-        self.win = visual.Window(
-                    allowGUI = self.allowGUI,
-                    monitor = self.stimMonitor,
-                    screen = self.screen,
-                    fullscr = self.fullscr,
-                    color = self.backgroundColor,
-                    units = self.units,
-                    useFBO = self.useFBO,
-                    allowStencil = self.allowStencil
-                    )
-
-        self.FR = self.win.getActualFrameRate() #log the frame rate of the stimulus window
-
-        #set a warper if you want to morph the stimulus
-        if self.useFBO:
-            warper = Warper(
-                self.win,
-                warp = 'warpfile',
-                warpfile = self.warpFileName
-                )
-
-        #if the user would like to use a second screen to display stimulus information then initialize that screen here
-        #the flips to this second window must be called in the stimulus protocol itself
-        if self.useInformationMonitor:
-            self.informationWin = visual.Window(
-                        allowGUI = self.allowGUI,
-                        monitor = self.informationMonitor,
-                        screen = self.informationScreen,
-                        color = self.backgroundColor,
-                        fullscr = self.informationFullScreen,
-                        units = self.units,
-                        )
 
+        Inputs:
+            - startIndex: index of the first protocol to run. Use this to resume a run that was recovered from its journal, in which case the protocols that already ran stay in self.loggedStimuli
+        '''
+        #create the windows, or reuse the ones that are still open from the last run if nothing about them has changed
+        windowSettings = self.getWindowSettings()
+        if self.persistentWindow and self.win is not None and windowSettings == self.windowSettings:
+            print('--> Reusing the open stimulus window')
+        else:
+            self.closeWindows() #close windows left open by a previous run with different settings
+            self.openWindows()
+            self.windowSettings = windowSettings
+            self.stimulusPool = stimulusPool(self.win)
+
+        #write TTLs on a background thread if the user asks for it
+        writer = None
+        if self.asyncTTL and self.writeTTL in ['Pulse', 'Sustained'] and hasattr(self, 'portObj'):
+            writer = ttlWriter(self.portObj)
+
+        #in photodiode mode, TTLs are shown as a patch in the corner of the stimulus window instead of being written to a port
+        syncPatch = None
+        if self.writeTTL == 'Photodiode':
+            syncPatch = self.createSyncPatch()
+
+        #one clock for the whole run. As psychopy's default clock it also time stamps every flip, so epoch times of all protocols and the TTL logs can be compared directly
+        experimentClock = core.Clock()
+        logging.setDefaultClock(experimentClock)
+
+        #prepare the next protocol in a worker process while the current one is on screen. The first protocol prepares in its run method
+        self.assignArtifactCache()
+        preparer = None
+        preparing = {} #protocol index: future of the prepared protocol
+        if any(self.needsPreparation(p, p.getGeometry(self.win)) for name, p in self.protocolList[1:]):
+            preparer = ProcessPoolExecutor(max_workers = 1, initializer = lowerWorkerPriority, mp_context = multiprocessing.get_context('spawn')) #spawn rather than fork, so the worker doesn't inherit the window, Tk or the TTL writer thread
 
         self.activated = True
-        self.loggedStimuli = [] #always resets on a new run
+        if startIndex == 0:
+            self.loggedStimuli = [] #always resets on a new run
+
+        #write each protocol to the journal as soon as it finishes
+        runName = datetime.now().strftime('run_%Y%m%d_%H%M%S') #names the journal and spilled log files of this run
+        journal = None
+        if self.journalFolder:
+            self.journalFileName = os.path.join(self.journalFolder, runName + '.journal')
+            journal = runJournal(self.journalFileName)
+            journal.writeStart(self, startIndex)
+            print('--> Journaling this run to ' + self.journalFileName)
+
         for i, p in enumerate(self.protocolList):
+            if i < startIndex:
+                continue
             name = p[0] #note: p is not a deep copy, so the pointer in memory is to the same location as the protocol in self.protocolList and app.experiment.protocolList
             suffix = p[1].suffix
             
@@ -214,10 +285,27 @@ class experiment():
                 displayName = name + suffix
 
             print('!!! Running Protocol Number ' + str(i+1) + ' of ' +  str(len(self.protocolList)) + ', with name ' + displayName)
-            p = p[1] #the protocol object is the second one in the tuple
+            waitTime, sharedBlocks = self.collectPrepared(i, preparing)
+            p = self.protocolList[i][1] #the protocol object is the second one in the tuple. Read from the list again in case a prepared copy replaced it
+            p._prepareWaitTime = waitTime
+            if p._prepareWaitTime > 0.1:
+                print(f'--> Waited {p._prepareWaitTime:.2f} seconds for {displayName} to finish preparing')
+            self.prepareAhead(i + 1, preparer, preparing)
+
+            if self.writeTTL in ['Pulse', 'Sustained'] and not hasattr(self, 'portObj'):
+                print('\n***NOTICE: stimulus ', i, 'was skipped because a TTL write method was selected, but no port has been connected to.')
+                releaseBlocks(sharedBlocks) #free the arrays that were prepared for it
+                continue
 
             #assign relevant experiment properties to the protocol
+            p._protocolIndex = i
+            p._journal = journal if self.journalEpochs else None
+            if journal is not None:
+                journal.startProtocol(i)
             p._timingReport = self.timingReport
+            p._timeBasedAnimation = self.timeBasedAnimation
+            p._stimulusPool = self.stimulusPool
+            p._ttlWriter = writer
             if hasattr(p, '_angleOffset'):
                 p._angleOffset = self.angleOffset
 
@@ -225,54 +313,358 @@ class experiment():
 
             #set up the TTL ports based on the mode.
             if self.writeTTL == 'Pulse':
-                if not hasattr(self, 'portObj'):
-                    print('\n***NOTICE: stimulus ', i, 'was skipped because a TTL write method was selected, but no port has been connected to.')
-                    continue
                 p._portObj = self.portObj #initialize portObj for sending TTL pulses
                 p._portObj.rts = True #ensure TTL is OFF to begin
                 p.burstTTL(self.win) #execute a stereotyped burst to mark the start of the stimulus in pulse mode
-            elif self.writeTTL == 'Sustained':
-                if not hasattr(self, 'portObj'):
-                    print('\n***NOTICE: stimulus ', i, 'was skipped because a TTL write method was selected, but no port has been connected to.')
-                    continue
-                p._portObj = self.portObj
-                p._portObj.rts = True #ensure TTL is OFF to begin
+            elif self.writeTTL in ['Sustained', 'Photodiode']:
+                if self.writeTTL == 'Sustained':
+                    p._portObj = self.portObj
+                    p._portObj.rts = True #ensure TTL is OFF to begin
+                else:
+                    p._syncPatch = syncPatch
+                    p._syncPatch.fillColor = [-1.0, -1.0, -1.0] #ensure the patch is OFF to begin
                 p._TTLON = False #used to track state of sustained TTL pulses                
                
-                if self.ttlBookmarks: #Run the bookmark before the start of each stimulus: this is 1 frame on, 2 frames off, 3 frames on, 4 frames Off, 5 frames On, 6 frames Off at the frame frate of self.win The port should end in the off position again. Range is not inclusive
+                if self.ttlBookmarks:
+                    p._bookmarkCode = self.bookmarkCode
+                    p._bookmarkDataBits = getDataBits(len(self.protocolList)) if self.bookmarkCode == 'binary' else None
                     self.win.flip() #brief pause at frame rate in case there was just another flip from the previous stimulus (e.g., on the last frame of the previous stimulus)
-                    for i in range(1, 7):
-                        p.sendTTL(bookmark = True)
-                        for m in range(i): #flip a number of frames that is equal to the iteration number
+                    if self.bookmarkCode == 'legacy':
+                        #Run the bookmark before the start of each stimulus: this is 1 frame on, 2 frames off, 3 frames on, 4 frames Off, 5 frames On, 6 frames Off at the frame frate of self.win The port should end in the off position again. Range is not inclusive
+                        levelFrames = range(1, 7)
+                    else:
+                        levelFrames = encodeBookmark(i, p._bookmarkDataBits) #preamble followed by the protocol index and a checksum
+                    for numFrames in levelFrames:
+                        p.sendTTLOnFlip(self.win, bookmark = True)
+                        for m in range(numFrames): #hold each level for its number of frames
                             self.win.flip()
                     
-                    #just ensure that the TTL pulse is actually off:
+                    #turn the TTL off at the end of the bookmark. The binary code ends ON, and this last edge marks the end of its last bit
                     if p._TTLON:            
-                        p.sendTTL(bookmark = True)
+                        p.sendTTLOnFlip(self.win, bookmark = True)
+                        self.win.flip()
                     
 
+            #render at a reduced resolution if the protocol's features are coarse enough
+            p._renderScale = self.getRenderScale(p)
+            renderer = None
+            if p._renderScale < 1:
+                renderer = reducedResolutionRenderer(self.win, p._renderScale, self.upscaleFilter)
+                if not renderer.start():
+                    renderer = None
+                    p._renderScale = 1.0
+
             #run the protocol
             p.run(self.win, (self.useInformationMonitor, self.informationWin)) #send informationMonitor information as a tuple: bool (whether to use), window object
+            p.flushTTL(self.win) #write any frame-locked TTLs that are still waiting for a flip (e.g. the end of the last epoch)
+            
+            if renderer is not None:
+                renderer.stop()
             
             #Make sure TTL port is turned OFF if running in sustained mode (it's often left on if the user quits a stimulus early)
             if self.writeTTL == 'Sustained' and p._TTLON:
                 p.sendTTL()
+            elif self.writeTTL == 'Photodiode' and p._TTLON:
+                p.sendTTLOnFlip(self.win)
+                self.win.flip()
+            
+            #wait for the writer to finish this protocol's TTLs before the port is used directly again
+            if writer is not None:
+                writer.flush()
+                p._ttlQueueDelayLog = writer.popQueueDelays()
                                 
             #print the timing report if the user asks for it
             if p._timingReport:
                 p.reportTime(displayName)
                
 
-            #write down properties from previous stimulus
-            protocolProperties = vars(p)
-            protocolProperties.pop('_informationWin', None) #can't save ongoing psychopy win so remove it
+            #return this protocol's stimuli to the pool so the next protocol can use them
+            self.stimulusPool.releaseAll()
+
+            #remove what can't be saved from the protocol itself, since it stays in self.protocolList, which is pickled with the experiment
+            vars(p).pop('_informationWin', None) #can't save ongoing psychopy win so remove it
+            vars(p).pop('_stimulusPool', None)
+            vars(p).pop('_ttlWriter', None)
+            vars(p).pop('_syncPatch', None)
+            vars(p).pop('_preparedData', None) #can be rebuilt from the saved parameters and randomSeed. Its arrays may be in shared memory that is released below
+            vars(p).pop('_artifactCache', None)
+            vars(p).pop('_journal', None)
+
+            #write down properties from previous stimulus. This is a copy, so that spilling large logs doesn't change the protocol object
+            protocolProperties = dict(vars(p))
+            p._preparedFor = None #so that prepare runs again if this protocol object is run again
+            if self.spillLogSizeMB > 0:
+                spillLargeAttributes(protocolProperties, os.path.join('spilledLogs', runName, f'{runName}_protocol{i}.npz'), self.spillLogSizeMB*1e6)
             self.loggedStimuli.append(protocolProperties)
+            if journal is not None:
+                journal.writeProtocol(i, protocolProperties)
+            releaseBlocks(sharedBlocks)
 
 
 
         #clean up after the activation loop
-        self.win.close()
+        logging.setDefaultClock(core.monotonicClock)
+        if preparer is not None:
+            preparer.shutdown(cancel_futures = True)
+        if journal is not None:
+            journal.writeEnd()
+        cacheHits = [p['_artifactCacheHit'] for p in self.loggedStimuli if p.get('_artifactCacheHit') is not None]
+        if cacheHits:
+            print(f'--> Artifact cache: {sum(cacheHits)} protocols loaded, {len(cacheHits) - sum(cacheHits)} prepared and cached')
+        if syncPatch is not None:
+            syncPatch.autoDraw = False
+        if writer is not None:
+            writer.stop()
+            if writer.synchronousWrites > 0:
+                print(f'***NOTICE: the TTL queue was full {writer.synchronousWrites} times, so those TTLs were written on the render thread')
+
+        if self.persistentWindow:
+            self.win.color = self.backgroundColor
+            self.win.flip() #leave the window blank until the next run
+        else:
+            self.closeWindows()
+
+
+    def getGeometry(self, p):
+        '''
+        Geometry of the stimulus window (see protocol.getGeometry) for protocol p, without opening the window. The open window is used if it will be reused by the next run. Otherwise the size is the monitor's resolution in full screen mode or psychopy's default window size
+        '''
+        if self.persistentWindow and self.win is not None and self.getWindowSettings() == self.windowSettings:
+            return p.getGeometry(self.win)
+
+        stimMonitor = monitors.Monitor(self.stimMonitor)
+        size = stimMonitor.getSizePix() if self.fullscr else [800, 600]
+        return p.getGeometry(SimpleNamespace(size = size, monitor = stimMonitor))
+
+
+    def prepareProtocols(self, progressCallback = None):
+        '''
+        Run the prepare step of every protocol ahead of time, in parallel worker processes, so that activate can go straight from one protocol to the next
+
+        Protocols are prepared for the frame rate that was measured the last time the stimulus window opened. A protocol that was prepared for a different window size or frame rate prepares again when it runs (see protocol.ensurePrepared), as do all protocols if the window has never been opened
+
+        Inputs:
+            - progressCallback: function that is called with (number of protocols prepared, number of protocols to prepare) before the first and after every protocol is prepared
+
+        returns: seconds spent preparing
+        '''
+        toPrepare = [i for i, (name, p) in enumerate(self.protocolList) if type(p).prepare is not protocol.prepare]
+        if len(toPrepare) == 0:
+            return 0.0
+        self.assignArtifactCache()
+        if not self.FR:
+            print('--> Protocols will be prepared when they run because the frame rate of the stimulus window has not been measured yet')
+            return 0.0
+
+        startTime = time.perf_counter()
+        if progressCallback is not None:
+            progressCallback(0, len(toPrepare))
+
+        numWorkers = min(len(toPrepare), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers = numWorkers, mp_context = multiprocessing.get_context('spawn')) as pool: #spawn rather than fork, so workers don't inherit the GL context, Tk or running threads
+            futures = {}
+            for i in toPrepare:
+                p = self.protocolList[i][1]
+                futures[pool.submit(prepareProtocol, p, self.getGeometry(p), self.FR)] = i
+
+            for numPrepared, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                name = self.protocolList[i][0]
+                try:
+                    self.protocolList[i] = (name, future.result())
+                except Exception as e:
+                    print(f'***NOTICE: {name} could not be prepared ahead of time ({e!r}). It will be prepared when it runs')
+
+                if progressCallback is not None:
+                    progressCallback(numPrepared, len(toPrepare))
+
+        duration = time.perf_counter() - startTime
+        print(f'--> Prepared {len(toPrepare)} protocols in {duration:.1f} seconds')
+        return duration
+
+
+    def assignArtifactCache(self):
+        '''
+        Give every protocol the artifact cache (see experiments/artifactCache.py), or None if the cache is turned off
+        '''
+        cache = None
+        if self.artifactCacheFolder:
+            cache = artifactCache(self.artifactCacheFolder, self.artifactCacheSizeGB)
+        for name, p in self.protocolList:
+            p._artifactCache = cache
+
+
+    def needsPreparation(self, p, geometry):
+        '''
+        returns: True if protocol p has a prepare step that hasn't been run for this window geometry and the experiment's frame rate
+        '''
+        return type(p).prepare is not protocol.prepare and not p.isPreparedFor(geometry, self.FR)
+
+
+    def prepareAhead(self, i, preparer, preparing):
+        '''
+        Start preparing protocol i in the preparer's worker process if it needs it. The future is stored in preparing[i] and collected by collectPrepared before the protocol runs
+        '''
+        if preparer is None or i >= len(self.protocolList):
+            return
+
+        p = self.protocolList[i][1]
+        geometry = p.getGeometry(self.win)
+        if self.needsPreparation(p, geometry):
+            preparing[i] = preparer.submit(prepareProtocolShared, p, geometry, self.FR)
 
+
+    def collectPrepared(self, i, preparing):
+        '''
+        Wait for protocol i to finish preparing if it was sent to a worker process by prepareAhead, and put the prepared protocol in self.protocolList. If preparation failed, the protocol prepares when it runs instead
+
+        returns: (seconds spent waiting, shared memory blocks used by the protocol's prepared arrays, to be released once it has run)
+        '''
+        future = preparing.pop(i, None)
+        if future is None:
+            return 0.0, []
+
+        startTime = time.perf_counter()
+        name = self.protocolList[i][0]
+        try:
+            prepared = future.result()
+        except Exception as e:
+            print(f'***NOTICE: {name} could not be prepared ahead of time ({e!r}). It will be prepared when it runs')
+            return time.perf_counter() - startTime, []
+        waitTime = time.perf_counter() - startTime
+
+        prepared._preparedData, sharedBlocks = attachArrays(prepared._preparedData)
+        self.protocolList[i] = (name, prepared)
+        return waitTime, sharedBlocks
+
+
+    def getRenderScale(self, p):
+        '''
+        Choose the internal resolution (as a fraction of the window resolution) to render a protocol at
+
+        One rendered pixel is kept smaller than self.reducedResolutionTolerance times the smallest feature of the protocol (see protocol.getMinimumFeatureSize), so the content of the stimulus doesn't change beyond that tolerance.
+        Returns 1 (full resolution) if the option is off, if the protocol doesn't report a minimum feature size, or if an information window is used (switching between windows resets which framebuffer is drawn to).
+        '''
+        if self.reducedResolutionTolerance <= 0 or self.useInformationMonitor:
+            return 1.0
+
+        minimumFeatureSize = p.getMinimumFeatureSize(self.win)
+        if not minimumFeatureSize:
+            return 1.0
+
+        return min(1.0, 1/(self.reducedResolutionTolerance*minimumFeatureSize))
+
+
+    def createSyncPatch(self):
+        '''
+        Create the square that is drawn in a corner of the stimulus window in 'Photodiode' TTL mode. A photodiode taped over it records the same events as a sustained TTL (white = ON, black = OFF), but exactly locked to the frames.
+        The patch is drawn automatically on every flip until its autoDraw is turned off.
+        '''
+        halfWidth = self.win.size[0]/2 - self.syncPatchSize/2
+        halfHeight = self.win.size[1]/2 - self.syncPatchSize/2
+        x = -halfWidth if 'left' in self.syncPatchCorner else halfWidth
+        y = halfHeight if 'top' in self.syncPatchCorner else -halfHeight
+
+        return visual.Rect(
+                self.win,
+                width = self.syncPatchSize,
+                height = self.syncPatchSize,
+                pos = [x, y],
+                units = 'pix',
+                lineWidth = 0,
+                fillColor = [-1.0, -1.0, -1.0],
+                autoDraw = True,
+                )
+
+
+    def getWindowSettings(self):
+        '''
+        Returns a list of all of the settings that are used to create the stimulus and information windows. If any of these change, the windows need to be recreated
+        '''
+        return [self.allowGUI, self.screen, self.fullscr, self.stimMonitor, self.backgroundColor, self.units, self.useFBO, self.allowStencil, self.warpFileName,
+                self.useInformationMonitor, self.informationMonitor, self.informationScreen, self.informationFullScreen]
+
+
+    def openWindows(self):
+        '''
+        Create the stimulus window (and warper and information window, if they are used) and measure the frame rate
+        '''
+        self.win = visual.Window(
+                    allowGUI = self.allowGUI,
+                    monitor = self.stimMonitor,
+                    screen = self.screen,
+                    fullscr = self.fullscr,
+                    color = self.backgroundColor,
+                    units = self.units,
+                    useFBO = self.useFBO,
+                    allowStencil = self.allowStencil
+                    )
+
+        self.FR = self.win.getActualFrameRate() #log the frame rate of the stimulus window
+
+        #set a warper if you want to morph the stimulus
+        if self.useFBO:
+            self.warper = Warper(
+                self.win,
+                warp = 'warpfile',
+                warpfile = self.warpFileName
+                )
+
+        #if the user would like to use a second screen to display stimulus information then initialize that screen here
+        #the flips to this second window must be called in the stimulus protocol itself
         if self.useInformationMonitor:
+            self.informationWin = visual.Window(
+                        allowGUI = self.allowGUI,
+                        monitor = self.informationMonitor,
+                        screen = self.informationScreen,
+                        color = self.backgroundColor,
+                        fullscr = self.informationFullScreen,
+                        units = self.units,
+                        )
+
+
+    def closeWindows(self):
+        '''
+        Close the stimulus and information windows if they are open. This is called at the end of every run, or when the GUI closes if self.persistentWindow is True
+        '''
+        if self.stimulusPool is not None:
+            self.stimulusPool.clear()
+            self.stimulusPool = None
+
+        if self.win is not None:
+            self.win.close()
+            self.win = None
+        self.warper = None
+
+        if self.informationWin is not None:
             self.informationWin.close()
-            
\ No newline at end of file
+            self.informationWin = None
+
+        self.windowSettings = None
+
+            
+
+
+def prepareProtocol(p, geometry, FR):
+    '''
+    Prepare one protocol (see protocol.prepareFor). Runs in a worker process of experiment.prepareProtocols, so the prepared protocol is returned (pickled) rather than changed in place
+    '''
+    p.prepareFor(geometry, FR)
+    return p
+
+
+def prepareProtocolShared(p, geometry, FR):
+    '''
+    Same as prepareProtocol, but the prepared arrays are returned through shared memory (see experiments/sharedArrays.py). Used to prepare the next protocol while the current one is running
+    '''
+    p.prepareFor(geometry, FR)
+    p._preparedData = shareArrays(p._preparedData)
+    return p
+
+
+def lowerWorkerPriority():
+    '''
+    Runs when a preparation worker process starts, so that preparing the next protocol takes CPU time from the stimulus window as little as possible
+    '''
+    if hasattr(os, 'nice'):
+        os.nice(10)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for a serial TTL port, for testing TTL timing without a rig.
+
+fakeSerialPort has the parts of serial.Serial's interface that Bassoon uses
+(rts, write, baudrate, close) and records every RTS transition and write with
+a monotonic time stamp. On systems that support it, written bytes are also
+passed to a pseudo terminal (see self.ptyName) so another program can read
+them like a real port. experiment.establishPort opens one of these for any
+port whose name starts with 'fake'.
+
+"""
+import os
+import time
+
+class fakeSerialPort():
+    def __init__(self, port = 'fake', baudrate = 9600, usePty = True, clock = time.perf_counter):
+        self.port = port #name of the port
+        self.name = port
+        self.baudrate = baudrate #stored but not used, since nothing is actually transmitted at a baud rate
+        self.clock = clock #monotonic clock that events are time stamped with
+        self.is_open = True
+        self.events = [] #list of (time stamp, 'rts' or 'write', value) for every RTS transition and write, in order
+        self.rtsSetCount = 0 #number of times rts was assigned, including assignments that didn't change the line
+        self.droppedBytes = 0 #bytes that couldn't be passed to the pseudo terminal because nothing was reading it
+
+        self._rts = True #serial.Serial also starts with rts True (TTL off on picolo)
+        self._master = None
+        self._slave = None
+        self.ptyName = None #path of the pseudo terminal that receives written bytes, if one was opened
+        if usePty and hasattr(os, 'openpty'):
+            try:
+                self._master, self._slave = os.openpty()
+                os.set_blocking(self._master, False) #never let a full pseudo terminal block a TTL write
+                self.ptyName = os.ttyname(self._slave)
+            except OSError:
+                self._master = self._slave = None
+
+
+    @property
+    def rts(self):
+        return self._rts
+
+    @rts.setter
+    def rts(self, value):
+        self.rtsSetCount += 1
+        value = bool(value)
+        if value != self._rts:
+            self.events.append((self.clock(), 'rts', value))
+        self._rts = value
+
+
+    def write(self, data):
+        '''
+        Record a write. Data is converted the same way serial.Serial converts it (e.g. an int n becomes n zero bytes)
+
+        returns: number of bytes written
+        '''
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(bytearray(data))
+        self.events.append((self.clock(), 'write', len(data)))
+
+        if self._master is not None:
+            try:
+                os.write(self._master, data)
+            except OSError:
+                self.droppedBytes += len(data)
+
+        return len(data)
+
+
+    def getEventTimes(self, eventType = None):
+        '''
+        Returns the time stamps of all recorded events, or only of one type ('rts' or 'write')
+        '''
+        return [t for t, kind, value in self.events if eventType is None or kind == eventType]
+
+
+    def reset(self):
+        '''
+        Clear the recorded events
+        '''
+        self.events = []
+        self.rtsSetCount = 0
+        self.droppedBytes = 0
+
+
+    def close(self):
+        for fd in [self._master, self._slave]:
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+        self.is_open = False
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Moves large array attributes of logged protocols (position logs, check
+coordinates, phase logs, frame logs...) out of memory and into a sidecar file
+as each protocol finishes, so that memory use stays flat in long experiments.
+
+Every spilled attribute is replaced in experiment.loggedStimuli by a
+spilledArray, a small handle that loads the values again when they are
+needed. Each protocol gets its own uncompressed .npz file. Lists are spilled
+if they hold numbers and have the same length in every dimension, and are
+loaded back as numpy arrays.
+
+When the experiment is saved, the sidecar files are copied next to the
+.experiment file (see copySpilledArrays) and the .json file gets the values
+themselves, so nothing changes for analysis code that reads the .json file.
+
+"""
+import os
+import shutil
+
+import numpy as np
+
+
+class spilledArray():
+    def __init__(self, fileName, name, shape, dtype):
+        self.fileName = fileName #.npz file that holds the values
+        self.name = name #name of the array in the file
+        self.shape = tuple(shape)
+        self.dtype = str(dtype)
+
+    def load(self):
+        '''
+        returns: the spilled values as a numpy array
+        '''
+        with np.load(self.fileName) as f:
+            return f[self.name]
+
+    def __repr__(self):
+        return f'spilledArray({self.name}, shape = {self.shape}, dtype = {self.dtype}, file = {self.fileName})'
+
+
+def toArray(value):
+    '''
+    returns: value as a numeric numpy array, or None if it is not a numpy array or a list of numbers that can be converted to one
+    '''
+    if isinstance(value, np.ndarray):
+        array = value
+    elif isinstance(value, (list, tuple)) and len(value) > 0:
+        try:
+            array = np.asarray(value)
+        except ValueError: #lists of different lengths
+            return None
+    else:
+        return None
+    return array if array.dtype.kind in 'biuf' else None
+
+
+def spillLargeAttributes(attributes, fileName, minBytes):
+    '''
+    Write every array attribute that is at least minBytes big to fileName and replace it with a spilledArray
+
+    Inputs:
+        - attributes: dictionary of a logged protocol's attributes, changed in place. Pass a copy (e.g. dict(vars(p))), never a dictionary that the protocol object still uses
+        - fileName: path of the .npz file to write (its folder is created if needed)
+        - minBytes: smallest attribute to spill
+
+    returns: number of bytes spilled
+    '''
+    arrays = {}
+    for name, value in attributes.items():
+        array = toArray(value) #lists are converted to be measured, since nested lists (e.g. one list per epoch) can be much bigger than their length suggests
+        if array is not None and array.nbytes >= minBytes:
+            arrays[name] = array
+
+    if not arrays:
+        return 0
+
+    folder = os.path.dirname(fileName)
+    if folder:
+        os.makedirs(folder, exist_ok = True)
+    np.savez(fileName, **arrays)
+
+    for name, array in arrays.items():
+        attributes[name] = spilledArray(fileName, name, array.shape, array.dtype)
+    return sum(array.nbytes for array in arrays.values())
+
+
+def copySpilledArrays(loggedStimuli, folder):
+    '''
+    Copy the sidecar files of every spilledArray in loggedStimuli to folder, and point the spilledArrays to the copies. Used when the experiment is saved, so that the sidecar files are kept with the .experiment file
+    '''
+    copied = {} #original file name: copy
+    for attributes in loggedStimuli:
+        for value in attributes.values():
+            if not isinstance(value, spilledArray):
+                continue
+            if value.fileName not in copied:
+                os.makedirs(folder, exist_ok = True)
+                newFileName = os.path.join(folder, os.path.basename(value.fileName))
+                if os.path.abspath(newFileName) != os.path.abspath(value.fileName):
+                    shutil.copyfile(value.fileName, newFileName)
+                copied[value.fileName] = newFileName
+            value.fileName = copied[value.fileName]
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Renders a psychopy window at a reduced internal resolution and upscales
+each frame to the full window when it is flipped.
+
+Stimuli with coarse features (e.g. low spatial frequency gratings, wide bars
+or large noise checks) look the same at a lower resolution but are much
+cheaper to rasterise. Stimuli are drawn into a smaller framebuffer object
+(FBO), and on every flip that framebuffer is stretched onto the window with
+nearest neighbor or linear filtering. Since psychopy's projection is based on
+the window size, stimuli keep their size and position in window pixels.
+
+"""
+import ctypes
+import math
+from pyglet import gl as GL
+
+class reducedResolutionRenderer():
+    def __init__(self, win, scale, upscaleFilter = 'nearest'):
+        self.win = win #psychopy window to render for
+        self.scale = scale #fraction of the window resolution to render at (0 < scale <= 1)
+        self.upscaleFilter = upscaleFilter #'nearest' or 'linear'
+
+        #full size of the window's framebuffer (this can be different from win.size on high dpi displays)
+        self.fullSize = [int(v) for v in getattr(win, 'frameBufferSize', win.size)]
+        self.reducedSize = [max(1, math.ceil(v*scale)) for v in self.fullSize]
+
+        self._frameBuffer = None
+        self._texture = None
+        self._renderBuffer = None
+        self._originalFlip = None
+
+
+    def getTarget(self):
+        '''
+        Returns the framebuffer that psychopy itself renders to (its own FBO when useFBO is on, otherwise the window)
+        '''
+        if getattr(self.win, 'useFBO', False):
+            return self.win.frameBuffer
+        return 0
+
+
+    def start(self):
+        '''
+        Create the reduced resolution framebuffer and redirect all drawing to it until self.stop() is called
+        '''
+        self.win.flip() #finish anything that is still being drawn at full resolution
+
+        self._frameBuffer = GL.GLuint()
+        GL.glGenFramebuffersEXT(1, ctypes.byref(self._frameBuffer))
+        GL.glBindFramebufferEXT(GL.GL_FRAMEBUFFER_EXT, self._frameBuffer)
+
+        #color buffer
+        self._texture = GL.GLuint()
+        GL.glGenTextures(1, ctypes.byref(self._texture))
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._texture)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA8, self.reducedSize[0], self.reducedSize[1], 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        GL.glFramebufferTexture2DEXT(GL.GL_FRAMEBUFFER_EXT, GL.GL_COLOR_ATTACHMENT0_EXT, GL.GL_TEXTURE_2D, self._texture, 0)
+
+        #depth and stencil buffer (stencil is needed for apertures)
+        self._renderBuffer = GL.GLuint()
+        GL.glGenRenderbuffersEXT(1, ctypes.byref(self._renderBuffer))
+        GL.glBindRenderbufferEXT(GL.GL_RENDERBUFFER_EXT, self._renderBuffer)
+        GL.glRenderbufferStorageEXT(GL.GL_RENDERBUFFER_EXT, GL.GL_DEPTH24_STENCIL8_EXT, self.reducedSize[0], self.reducedSize[1])
+        GL.glFramebufferRenderbufferEXT(GL.GL_FRAMEBUFFER_EXT, GL.GL_DEPTH_ATTACHMENT_EXT, GL.GL_RENDERBUFFER_EXT, self._renderBuffer)
+        GL.glFramebufferRenderbufferEXT(GL.GL_FRAMEBUFFER_EXT, GL.GL_STENCIL_ATTACHMENT_EXT, GL.GL_RENDERBUFFER_EXT, self._renderBuffer)
+        GL.glBindRenderbufferEXT(GL.GL_RENDERBUFFER_EXT, 0)
+
+        if GL.glCheckFramebufferStatusEXT(GL.GL_FRAMEBUFFER_EXT) != GL.GL_FRAMEBUFFER_COMPLETE_EXT:
+            print('***Could not create the reduced resolution framebuffer. Rendering at full resolution instead')
+            self.stop()
+            return False
+
+        #wrap the window's flip method so that every frame is upscaled to the window first. Assigning to the instance only affects this window
+        self._originalFlip = self.win.flip
+        self.win.flip = self.flip
+
+        self.bind()
+        self.win.clearBuffer()
+        return True
+
+
+    def bind(self):
+        '''
+        Draw to the reduced resolution framebuffer
+        '''
+        GL.glBindFramebufferEXT(GL.GL_FRAMEBUFFER_EXT, self._frameBuffer)
+        GL.glViewport(0, 0, self.reducedSize[0], self.reducedSize[1])
+        GL.glScissor(0, 0, self.reducedSize[0], self.reducedSize[1])
+
+
+    def flip(self, clearBuffer = True):
+        '''
+        Replaces win.flip while the renderer is running. The reduced resolution frame is upscaled into the buffer that psychopy would normally have drawn to, and then the window is flipped as usual
+
+        returns: the time stamp of the flip (the same as win.flip)
+        '''
+        target = self.getTarget()
+        if self.upscaleFilter == 'linear':
+            blitFilter = GL.GL_LINEAR
+        else:
+            blitFilter = GL.GL_NEAREST
+
+        GL.glBindFramebufferEXT(GL.GL_READ_FRAMEBUFFER_EXT, self._frameBuffer)
+        GL.glBindFramebufferEXT(GL.GL_DRAW_FRAMEBUFFER_EXT, target)
+        GL.glBlitFramebufferEXT(0, 0, self.reducedSize[0], self.reducedSize[1],
+                                0, 0, self.fullSize[0], self.fullSize[1],
+                                GL.GL_COLOR_BUFFER_BIT, blitFilter)
+        GL.glBindFramebufferEXT(GL.GL_FRAMEBUFFER_EXT, target)
+        GL.glViewport(0, 0, self.fullSize[0], self.fullSize[1])
+        GL.glScissor(0, 0, self.fullSize[0], self.fullSize[1])
+
+        flipTime = self._originalFlip(clearBuffer = clearBuffer)
+
+        self.bind()
+        if clearBuffer:
+            self.win.clearBuffer()
+
+        return flipTime
+
+
+    def stop(self):
+        '''
+        Restore normal, full resolution drawing and delete the framebuffer
+        '''
+        if self._originalFlip is not None:
+            del self.win.flip #removes the wrapper so that the class method is used again
+            self._originalFlip = None
+
+        GL.glBindFramebufferEXT(GL.GL_FRAMEBUFFER_EXT, self.getTarget())
+        GL.glViewport(0, 0, self.fullSize[0], self.fullSize[1])
+        GL.glScissor(0, 0, self.fullSize[0], self.fullSize[1])
+
+        if self._frameBuffer is not None:
+            GL.glDeleteFramebuffersEXT(1, ctypes.byref(self._frameBuffer))
+            self._frameBuffer = None
+        if self._texture is not None:
+            GL.glDeleteTextures(1, ctypes.byref(self._texture))
+            self._texture = None
+        if self._renderBuffer is not None:
+            GL.glDeleteRenderbuffersEXT(1, ctypes.byref(self._renderBuffer))
+            self._renderBuffer = None
+
+        self.win.clearBuffer()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only journal of an experiment run, written while the experiment runs
+so that a crash doesn't lose the protocols that have already finished.
+
+The journal is a text file with one JSON record per line:
+    - start: the time, the experiment settings and the name and public parameters of every protocol in the run
+    - protocol: everything that is logged for a protocol (experiment.loggedStimuli), written as soon as it finishes
+    - epoch: start and end time of one epoch of the running protocol (only if experiment.journalEpochs is True)
+    - end: written when the run finishes normally
+
+Start, protocol and end records are synced to disk right away. Epoch records
+are flushed right away but only synced every syncInterval seconds, so that
+they don't hold up the stimulus. A line that was only partly written when
+Bassoon crashed is ignored by loadJournal.
+
+To recover a run, use 'Recover Run' in the Bassoon menu (or loadJournal).
+The recovered experiment can be saved as a normal .experiment/.json file, or
+resumed from the first protocol that didn't finish.
+
+"""
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from experiments.logSpill import spilledArray
+
+
+def jsonDefault(value):
+    '''
+    Used by json.dumps for values that json can't write: numpy arrays and numbers are converted, datetimes become text, spilled arrays (see experiments/logSpill.py) are written as a reference to their file and anything else (e.g. open ports or windows) is written as null
+    '''
+    if isinstance(value, spilledArray):
+        return {'spilledArray': vars(value)}
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, datetime):
+        return value.strftime("%D %H:%M:%S")
+    return None
+
+
+def getPublicAttributes(obj):
+    '''
+    Returns the attributes of an object that don't start with '_' (the parameters of a protocol or the settings of an experiment)
+    '''
+    return {k: v for k, v in vars(obj).items() if not k.startswith('_')}
+
+
+class runJournal():
+    def __init__(self, fileName, syncInterval = 5.0):
+        self.fileName = fileName #path of the journal file
+        self.syncInterval = syncInterval #seconds - epoch records are synced to disk at most this often
+
+        folder = os.path.dirname(fileName)
+        if folder:
+            os.makedirs(folder, exist_ok = True)
+        self._file = open(fileName, 'a', encoding = 'utf-8')
+        self._lastSync = time.perf_counter()
+        self._protocolIndex = None #index of the protocol that is running, for epoch records
+
+
+    def writeStart(self, experiment, startIndex = 0):
+        '''
+        Write the start record. startIndex is the index of the first protocol that runs. When a recovered run is resumed (startIndex > 0), the protocols that were already logged are journaled again so that every journal is complete on its own
+        '''
+        settings = getPublicAttributes(experiment)
+        for name in ['protocolList', 'loggedStimuli']:
+            settings.pop(name, None)
+        protocols = [[name, getPublicAttributes(p)] for name, p in experiment.protocolList]
+        self._write({'record': 'start', 'time': datetime.now(), 'startIndex': startIndex,
+                     'experiment': settings, 'protocols': protocols}, sync = startIndex == 0)
+        if startIndex > 0:
+            for attributes in experiment.loggedStimuli:
+                self.writeProtocol(None, attributes)
+
+
+    def startProtocol(self, index):
+        '''
+        Set the index of the protocol that is about to run
+        '''
+        self._protocolIndex = index
+
+
+    def writeProtocol(self, index, attributes):
+        '''
+        Write the logged attributes of a protocol that has finished. index is its index in experiment.protocolList (None for protocols from an earlier run)
+        '''
+        self._write({'record': 'protocol', 'index': index, 'attributes': attributes}, sync = True)
+
+
+    def writeEpoch(self, epoch, startTime, endTime):
+        '''
+        Write the start and end time of an epoch of the running protocol (see protocol.markEpochEnd)
+        '''
+        sync = time.perf_counter() - self._lastSync > self.syncInterval
+        self._write({'record': 'epoch', 'index': self._protocolIndex, 'epoch': epoch,
+                     'startTime': startTime, 'endTime': endTime}, sync = sync)
+
+
+    def writeEnd(self):
+        '''
+        Mark the run as finished and close the journal
+        '''
+        self._write({'record': 'end', 'time': datetime.now()}, sync = True)
+        self.close()
+
+
+    def _write(self, record, sync):
+        self._file.write(json.dumps(record, default = jsonDefault) + '\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+            self._lastSync = time.perf_counter()
+
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+def loadJournal(fileName):
+    '''
+    Read a run journal
+
+    returns: dictionary with
+        - 'startTime': time the run started (text)
+        - 'experiment': the experiment settings at the start of the run
+        - 'protocols': [name, public parameters] of every protocol in the run
+        - 'loggedStimuli': logged attributes of every protocol that finished, in the order they ran. A protocol that was running when the journal ends is added with _completed = 0, _recoveredFromJournal = True and the epochs that were journaled. Drop that entry before resuming the run, since the protocol runs again
+        - 'nextProtocol': index of the first protocol that didn't finish, or None if they all did
+        - 'finished': True if the run ended normally
+    '''
+    records = []
+    with open(fileName, encoding = 'utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                print('*** NOTE: skipped a journal record that was only partly written')
+
+    starts = [i for i, r in enumerate(records) if r['record'] == 'start']
+    if not starts:
+        raise ValueError(fileName + ' does not have a start record')
+    start = records[starts[-1]]
+
+    journal = {'startTime': start['time'], 'experiment': start['experiment'], 'protocols': start['protocols'],
+               'loggedStimuli': [], 'nextProtocol': None, 'finished': False}
+    lastIndex = start['startIndex'] - 1 #protocols before startIndex finished in an earlier run and are journaled without an index
+    epochs = {}
+    for r in records[starts[-1] + 1:]:
+        if r['record'] == 'protocol':
+            attributes = r['attributes']
+            for name, value in attributes.items():
+                if isinstance(value, dict) and list(value) == ['spilledArray']:
+                    attributes[name] = spilledArray(**value['spilledArray'])
+            journal['loggedStimuli'].append(attributes)
+            if r['index'] is not None:
+                lastIndex = max(lastIndex, r['index'])
+        elif r['record'] == 'epoch':
+            epochs.setdefault(r['index'], []).append(r)
+        elif r['record'] == 'end':
+            journal['finished'] = True
+
+    if not journal['finished'] and lastIndex + 1 < len(journal['protocols']):
+        journal['nextProtocol'] = lastIndex + 1
+        partialEpochs = epochs.get(lastIndex + 1, [])
+        if partialEpochs:
+            name, parameters = journal['protocols'][lastIndex + 1]
+            partial = dict(parameters)
+            partial['_completed'] = 0
+            partial['_protocolIndex'] = lastIndex + 1
+            partial['_numberOfEpochsCompleted'] = len(partialEpochs)
+            partial['_stimulusStartLog'] = [e['startTime'] for e in partialEpochs]
+            partial['_stimulusEndLog'] = [e['endTime'] for e in partialEpochs]
+            partial['_recoveredFromJournal'] = True
+            journal['loggedStimuli'].append(partial)
+
+    return journal
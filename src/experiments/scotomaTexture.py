@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Draws the scotoma grid of ScotomaMovingGrating as a single mask texture with
+one texel per scotoma (scotomaRenderMode = 'texture').
+
+The texture is padded to a power of two size and handed to psychopy once,
+when the stimulus is set up. After that, only the rows of texels that
+changed are uploaded with glTexSubImage2D on psychopy's mask texture,
+instead of setting stim.mask (which converts and re-uploads the whole
+texture on every growth frame).
+
+Scotomas are indexed x-major (see ScotomaMovingGrating._scotomaCoordinates),
+so scotoma i is drawn by the texel in row i % numRows and column
+i // numRows. The first row of a texture is drawn at the bottom, so rows
+follow the y coordinates and columns follow the x coordinates. Padding texels
+are transparent and extend the quad up and to the right of the grid.
+
+"""
+import ctypes
+
+import numpy as np
+
+
+def nextPowerOfTwo(n):
+    return 1 << max(0, int(n) - 1).bit_length()
+
+
+class scotomaTexture():
+    def __init__(self, xCoordinates, yCoordinates, scotomaSizePix):
+        self.numRows = len(yCoordinates) #rows of scotomas in the grid
+        self.numColumns = len(xCoordinates) #columns of scotomas in the grid
+        self.textureShape = (nextPowerOfTwo(self.numRows), nextPowerOfTwo(self.numColumns)) #rows and columns of the padded texture
+
+        #size and position of the quad, so that the texel in row r and column c is centered on (xCoordinates[c], yCoordinates[r])
+        self.size = (self.textureShape[1]*scotomaSizePix, self.textureShape[0]*scotomaSizePix)
+        self.pos = (xCoordinates[0] - scotomaSizePix/2 + self.size[0]/2, yCoordinates[0] - scotomaSizePix/2 + self.size[1]/2)
+
+        self.texture = -np.ones(self.textureShape) #psychopy mask values: -1 is transparent, 1 is opaque
+        self._stim = None
+
+
+    def getTexels(self, scotomaIndices):
+        '''
+        returns: (rows, columns) of the texels that draw the scotomas with the given 1d indices
+        '''
+        scotomaIndices = np.asarray(scotomaIndices, dtype = int)
+        return scotomaIndices % self.numRows, scotomaIndices // self.numRows
+
+
+    def attach(self, stim):
+        '''
+        Give the whole texture to a psychopy ImageStim. This is the only time the texture goes through psychopy
+        '''
+        self._stim = stim
+        stim.mask = self.texture
+
+
+    def setOpacities(self, scotomaIndices, opacity):
+        '''
+        Set the opacity (0 to 1) of a group of scotomas and upload the rows of texels that changed
+        '''
+        rows, columns = self.getTexels(scotomaIndices)
+        if len(rows) == 0:
+            return
+        self.texture[rows, columns] = 2*opacity - 1
+        self.upload(rows.min(), rows.max())
+
+
+    def upload(self, firstRow, lastRow):
+        '''
+        Copy rows firstRow to lastRow (inclusive) of self.texture to the mask texture of the attached stimulus
+        '''
+        from pyglet import gl as GL #only needed once there is a window, so that the texel layout can be used without one
+
+        alpha = np.ascontiguousarray((self.texture[firstRow:lastRow + 1] + 1)/2, dtype = np.float32) #the mask texture holds alpha from 0 to 1
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._stim._maskID)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, int(firstRow), self.textureShape[1], alpha.shape[0],
+                           GL.GL_ALPHA, GL.GL_FLOAT, alpha.ctypes.data_as(ctypes.POINTER(GL.GLfloat)))
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
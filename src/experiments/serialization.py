@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Writes the .json file of a saved experiment one attribute at a time, so that
+saving doesn't need a copy of the experiment and the GUI stays responsive.
+
+saveExperiment used to deepcopy every attribute of the experiment and then
+write the copy with a single json.dump. For long sessions with many logged
+protocols that doubled the memory in use and froze Bassoon while it ran.
+Instead, getJSONAttributes takes a shallow copy of the experiment's attributes
+and of every logged protocol's attributes on the GUI thread, and writeJSON
+walks the copy on a background thread and writes each value as it goes:
+    - the port objects (portObj, _portObj) are skipped
+    - windows and other objects that json can't write are written as null
+    - numpy arrays, including memory-mapped ones, are written a block of rows at a time instead of being converted to one big list
+    - spilled logs (see experiments/logSpill.py) are loaded one at a time and written the same way
+
+The file is written next to its final name and renamed once it is complete,
+so a .json file is never left half written. Its contents are the same as
+before: protocolList holds the protocol names and times are written as text.
+
+"""
+import json
+import os
+
+import numpy as np
+
+from experiments.runJournal import jsonDefault
+from experiments.logSpill import spilledArray
+
+SKIPPED_ATTRIBUTES = ['portObj', '_portObj'] #open serial ports are never written
+ROWS_PER_BLOCK = 65536 #rows of an array that are converted to text at a time
+
+
+def jsonValue(value):
+    '''
+    Used by json.dumps for values that json can't write. Spilled logs are loaded and written in full, everything else is handled by runJournal.jsonDefault
+    '''
+    if isinstance(value, spilledArray):
+        return value.load().tolist()
+    return jsonDefault(value)
+
+
+def getJSONAttributes(experiment):
+    '''
+    Returns the experiment's attributes, as they are written to the .json file. The experiment's dictionary and every logged protocol's dictionary are copied, so attributes that are added or replaced after this call, e.g. by another run while the file is being written, don't end up in the file. The values themselves aren't copied. Logged values are not changed in place once a protocol has finished, since every run works on new protocol objects (see compileExperiment in main.py)
+    '''
+    attributes = {k: v for k, v in vars(experiment).items() if k not in SKIPPED_ATTRIBUTES}
+    attributes['protocolList'] = [p[0] for p in attributes['protocolList']]
+    attributes['loggedStimuli'] = [dict(p) for p in attributes['loggedStimuli']]
+    return attributes
+
+
+def writeArray(f, array):
+    '''
+    Write a numpy array to an open file as a JSON list, ROWS_PER_BLOCK rows at a time
+    '''
+    if array.ndim == 0:
+        f.write(json.dumps(array.item()))
+        return
+
+    f.write('[')
+    for start in range(0, len(array), ROWS_PER_BLOCK):
+        if start > 0:
+            f.write(', ')
+        f.write(json.dumps(array[start:start + ROWS_PER_BLOCK].tolist())[1:-1])
+    f.write(']')
+
+
+def writeValue(f, value):
+    '''
+    Write any attribute value to an open file as JSON
+    '''
+    if isinstance(value, spilledArray):
+        value = value.load()
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+        writeArray(f, value)
+    else:
+        f.write(json.dumps(value, default = jsonValue))
+
+
+def writeDictionary(f, dictionary):
+    '''
+    Write a dictionary of attributes to an open file as a JSON object, one value at a time
+    '''
+    f.write('{')
+    separator = ''
+    for name, value in dictionary.items():
+        if name in SKIPPED_ATTRIBUTES:
+            continue
+        f.write(separator)
+        separator = ', '
+        f.write(json.dumps(str(name)) + ': ')
+        writeValue(f, value)
+    f.write('}')
+
+
+def writeJSON(attributes, fileName, progressCallback = None):
+    '''
+    Write the experiment attributes from getJSONAttributes to a .json file
+
+    Inputs:
+        - attributes: dictionary from getJSONAttributes
+        - fileName: path of the .json file
+        - progressCallback: optional function that is called with (numWritten, numToWrite) after every logged protocol is written. It is called from the thread that writes the file
+    '''
+    loggedStimuli = attributes['loggedStimuli']
+    temporaryFileName = fileName + '.writing'
+    try:
+        with open(temporaryFileName, 'w') as f:
+            f.write('{')
+            for i, (name, value) in enumerate(attributes.items()):
+                if i > 0:
+                    f.write(', ')
+                f.write(json.dumps(name) + ': ')
+                if name != 'loggedStimuli':
+                    writeValue(f, value)
+                    continue
+
+                f.write('[')
+                for protocolIndex, protocolAttributes in enumerate(loggedStimuli):
+                    if protocolIndex > 0:
+                        f.write(', ')
+                    writeDictionary(f, protocolAttributes)
+                    if progressCallback is not None:
+                        progressCallback(protocolIndex + 1, len(loggedStimuli))
+                f.write(']')
+            f.write('}')
+        os.replace(temporaryFileName, fileName)
+    except BaseException:
+        if os.path.exists(temporaryFileName):
+            os.remove(temporaryFileName)
+        raise
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Hands the numpy arrays that a protocol builds in prepare (protocol._preparedData)
+from a worker process back to the experiment through shared memory.
+
+While one protocol is on screen, the next one is prepared in a worker process
+(see experiment.activate). Returning a large noise sequence the usual way
+means pickling it, sending it through a pipe and unpickling it in the
+experiment's process while frames are being drawn. Instead, the worker copies
+every array into a shared memory block and only sends the block names; the
+experiment uses the arrays in place.
+
+Blocks are created by the worker and kept open there until it prepares the
+next protocol, so that they still exist when the experiment attaches to them
+(Windows frees a block as soon as no process has it open). The experiment
+releases its blocks once the protocol has run.
+
+"""
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker
+import os
+
+import numpy as np
+
+sharedArray = namedtuple('sharedArray', ['name', 'shape', 'dtype']) #stands in for an array while it is passed between processes
+
+_workerBlocks = [] #blocks created by this worker process for the last protocol it prepared
+
+
+def shareArrays(arrays):
+    '''
+    Worker side: copy every numpy array in a dictionary into a new shared memory block
+
+    returns: a copy of the dictionary with every array replaced by a sharedArray. Other values are left as they are
+    '''
+    releaseWorkerBlocks() #the experiment has attached to the previous protocol's blocks by now
+    shared = {}
+    for key, value in arrays.items():
+        if not isinstance(value, np.ndarray):
+            shared[key] = value
+            continue
+
+        block = shared_memory.SharedMemory(create = True, size = max(value.nbytes, 1))
+        np.ndarray(value.shape, dtype = value.dtype, buffer = block.buf)[...] = value
+        _workerBlocks.append(block)
+        if os.name == 'posix':
+            resource_tracker.unregister(block._name, 'shared_memory') #the experiment unlinks the block, so the worker shouldn't also clean it up when it exits
+        shared[key] = sharedArray(block.name, value.shape, value.dtype.str)
+    return shared
+
+
+def releaseWorkerBlocks():
+    '''
+    Worker side: close the blocks that were created for the last protocol
+    '''
+    while _workerBlocks:
+        _workerBlocks.pop().close()
+
+
+def attachArrays(shared):
+    '''
+    Experiment side: replace every sharedArray in a dictionary made by shareArrays with a numpy array that uses the shared memory directly
+
+    returns: (arrays, blocks) - the dictionary of arrays, and the blocks they use, which must be kept until the arrays are no longer needed and then passed to releaseBlocks
+    '''
+    arrays = {}
+    blocks = []
+    for key, value in shared.items():
+        if not isinstance(value, sharedArray):
+            arrays[key] = value
+            continue
+
+        block = shared_memory.SharedMemory(name = value.name)
+        blocks.append(block)
+        arrays[key] = np.ndarray(value.shape, dtype = np.dtype(value.dtype), buffer = block.buf)
+    return arrays, blocks
+
+
+def releaseBlocks(blocks):
+    '''
+    Experiment side: close and free blocks from attachArrays
+    '''
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            pass #an array that uses the block still exists. The memory is freed when the experiment closes instead
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
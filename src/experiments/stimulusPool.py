@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of psychopy stimulus objects that can be shared between the protocols of
+an experiment so that consecutive protocols with the same geometry don't have
+to rebuild their textures, shaders and vertex buffers.
+
+"""
+from collections import OrderedDict
+import copy
+import hashlib
+import pickle
+
+class stimulusPool():
+    def __init__(self, win, maxSize = 32):
+        self.win = win #the window that all of the pooled stimuli belong to. Stimuli can't be shared between windows
+        self.maxSize = maxSize #maximum number of stimuli to keep in the pool between protocols. The least recently used ones are removed first
+        self.resetAttributes = ['ori', 'phase', 'pos', 'size', 'opacity', 'contrast', 'opacities', 'colors', 'mask'] #attributes that protocols change during a run. These are set back to their initial values when a stimulus is borrowed
+        self._available = OrderedDict() #key -> list of (stimulus, initial values) that are not in use, in order of last use
+        self._borrowed = [] #list of (key, stimulus, initial values) that are in use by the current protocol
+        self.hits = 0 #number of stimuli that were borrowed from the pool
+        self.misses = 0 #number of stimuli that had to be created
+
+
+    def getKey(self, stimulusType, kwargs):
+        '''
+        Builds the key that identifies stimuli of the same type made with the same construction parameters
+        '''
+        parameters = pickle.dumps(sorted(kwargs.items()))
+        return (stimulusType.__name__, hashlib.sha1(parameters).hexdigest())
+
+
+    def get(self, stimulusType, **kwargs):
+        '''
+        Borrow a stimulus from the pool, or create a new one if there isn't an identical one available
+
+        Inputs:
+            - stimulusType: psychopy stimulus class (e.g. visual.GratingStim)
+            - kwargs: the keyword arguments that would be passed to the constructor (after the window)
+
+        Returns: the stimulus, with all of self.resetAttributes set back to the values it was created with
+        '''
+        key = self.getKey(stimulusType, kwargs)
+
+        if self._available.get(key):
+            stim, initialValues = self._available[key].pop()
+            if not self._available[key]:
+                del self._available[key]
+            for attribute, value in initialValues.items():
+                setattr(stim, attribute, copy.deepcopy(value))
+            self.hits += 1
+        else:
+            stim = stimulusType(self.win, **kwargs)
+            initialValues = {attribute: copy.deepcopy(getattr(stim, attribute)) for attribute in self.resetAttributes if hasattr(stim, attribute)}
+            self.misses += 1
+
+        self._borrowed.append((key, stim, initialValues))
+        return stim
+
+
+    def releaseAll(self):
+        '''
+        Return all borrowed stimuli to the pool. This is called by the experiment after every protocol. If the pool is larger than self.maxSize, the least recently used stimuli are removed
+        '''
+        for key, stim, initialValues in self._borrowed:
+            stim.autoDraw = False
+            self._available.setdefault(key, []).append((stim, initialValues))
+            self._available.move_to_end(key)
+        self._borrowed = []
+
+        while sum(len(v) for v in self._available.values()) > self.maxSize:
+            key = next(iter(self._available))
+            self._available[key].pop(0)
+            if not self._available[key]:
+                del self._available[key]
+
+
+    def clear(self):
+        '''
+        Remove all stimuli from the pool (e.g. before the window is closed)
+        '''
+        self._available = OrderedDict()
+        self._borrowed = []
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Writes TTL events to the serial port on a background thread so that the
+render loop doesn't block on serial I/O.
+
+Protocols keep all of the TTL bookkeeping (TTL state and flip counts) on the
+render thread and only hand the port operation itself to the writer. Events
+are written in the order they were queued. The queue is bounded: if it is
+full, the render thread waits for the writer to catch up and then writes the
+event itself, so events are never dropped or reordered.
+
+"""
+from collections import deque
+import threading
+import time
+
+class ttlWriter():
+    def __init__(self, portObj, maxSize = 256):
+        self.portObj = portObj #open serial port (or anything with the same rts and write interface)
+        self.maxSize = maxSize #maximum number of events waiting to be written before the render thread falls back to writing synchronously
+        self.queueDelayLog = [] #seconds between queueing and finishing the write for every event written by the worker thread
+        self.synchronousWrites = 0 #number of events that were written on the render thread because the queue was full
+        self.failedWrites = 0 #number of writes that raised an error
+
+        self._queue = deque() #(operation, value, time queued)
+        self._pending = 0 #events that are queued or being written. Only changed while holding self._condition
+        self._condition = threading.Condition() #guards the queue and self._pending, and wakes the worker and flush
+        self._running = True
+        self._thread = threading.Thread(target = self._work, name = 'ttlWriter', daemon = True)
+        self._thread.start()
+
+
+    def setRTS(self, value):
+        '''
+        Queue a change of the RTS line (sustained mode)
+        '''
+        self._put('rts', value)
+
+
+    def write(self, data):
+        '''
+        Queue a write to the port (pulse mode)
+        '''
+        self._put('write', data)
+
+
+    def _put(self, operation, value):
+        with self._condition:
+            queued = len(self._queue) < self.maxSize and self._running
+            if queued:
+                self._queue.append((operation, value, time.perf_counter()))
+                self._pending += 1
+                self._condition.notify_all()
+        if not queued:
+            #queue is full: wait for the worker to write everything that came before this event, then write it here
+            self.flush()
+            self._apply(operation, value)
+            self.synchronousWrites += 1
+
+
+    def _apply(self, operation, value):
+        try:
+            if operation == 'rts':
+                self.portObj.rts = value
+            else:
+                self.portObj.write(value)
+        except:
+            self.failedWrites += 1
+            print('***WARNING: TTL Pulse Failed***')
+
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue and self._running:
+                    self._condition.wait()
+                if not self._queue:
+                    return #stopped and everything has been written
+                operation, value, queueTime = self._queue.popleft()
+
+            self._apply(operation, value) #the port is written without holding the lock, so the render thread can keep queueing
+            self.queueDelayLog.append(time.perf_counter() - queueTime)
+
+            with self._condition:
+                self._pending -= 1 #only counted as done once the write and its delay are finished
+                if self._pending == 0:
+                    self._condition.notify_all()
+
+
+    def flush(self):
+        '''
+        Wait until every queued event has been written
+        '''
+        if not self._thread.is_alive():
+            with self._condition:
+                events = list(self._queue)
+                self._queue.clear()
+                self._pending = 0
+            for operation, value, queueTime in events:
+                self._apply(operation, value)
+            return
+
+        with self._condition:
+            while self._pending > 0:
+                self._condition.wait()
+
+
+    def popQueueDelays(self):
+        '''
+        Returns the queue delays logged since the last call and clears the log (the experiment stores them with each protocol)
+        '''
+        delays = self.queueDelayLog
+        self.queueDelayLog = []
+        return delays
+
+
+    def stop(self):
+        '''
+        Write any remaining events and stop the worker thread
+        '''
+        self.flush()
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join()
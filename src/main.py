@@ -32,9 +32,13 @@ import math
 import time
 import copy
 import random
+import threading
 
 # Each protocol subclass must be imported here:
 from experiments.experiment import experiment
+from experiments.runJournal import loadJournal
+from experiments.logSpill import copySpilledArrays
+from experiments.serialization import getJSONAttributes, writeJSON
 from protocols.protocol import protocol
 from protocols.Flash import Flash
 from protocols.Pause import Pause
@@ -67,6 +71,7 @@ class Bassoon:
         self.frame.pack(fill="both", expand=True)
         self.menubar = Menu(root)
         self.menubar.add_command(label="Load Experiment", command=self.loadExperiment)
+        self.menubar.add_command(label="Recover Run", command=self.recoverRun)
         self.optionsMenu = Menu(self.menubar, tearoff=0)
         self.menubar.add_command(label="Options", command=self.editExperiment)
         self.menubar.add_command(label ="Quick Actions", command=self.quickActionsWin)
@@ -193,6 +198,79 @@ class Bassoon:
 
 
 
+    def recoverRun(self):
+        '''
+        Recover a run from its journal (see experiments/runJournal.py), e.g. after Bassoon crashed in the middle of an experiment. The protocols of the run are loaded into the experiment sketch and the protocols that finished are put in experiment.loggedStimuli. The recovered experiment can then be saved, or resumed from the first protocol that didn't finish
+        '''
+        journalFileName = tkfd.askopenfilename(title="Select a run journal", initialdir = self.experiment.journalFolder or None,
+                                               filetypes=(("Run Journals", "*.journal"), ("all files", "*.*")))
+        if journalFileName == '':
+            return
+
+        try:
+            journal = loadJournal(journalFileName)
+        except Exception as e:
+            print('***Could not read the journal ' + journalFileName + ': ' + repr(e))
+            return
+
+        self.experimentSketch = []
+        for num, (pname, parameters) in enumerate(journal['protocols']):
+            newObj = eval(pname+'()') #get a new object of the correct name
+            for a in vars(newObj):
+                if not a.startswith('_') and a in parameters:
+                    setattr(newObj, a, parameters[a])
+
+            #build the display name
+            pnameWithSpaces = ''
+            for j, char in enumerate(pname):
+                if char.isupper() and j != 0:
+                    pnameWithSpaces += ' ' + char.lower()
+                else:
+                    pnameWithSpaces += char
+            self.experimentSketch.append((pnameWithSpaces, newObj))
+
+        self.updateExperimentSketch()
+        self.compileExperiment()
+        self.experiment.loggedStimuli = journal['loggedStimuli']
+        try:
+            self.experiment.experimentStartTime = datetime.strptime(journal['startTime'], "%m/%d/%y %H:%M:%S")
+        except (TypeError, ValueError):
+            pass
+        self.experiment.experimentEndTime = datetime.now()
+
+        nextProtocol = journal['nextProtocol']
+        print(f"\n--> Recovered {len(journal['loggedStimuli'])} logged protocols from {journalFileName}")
+        if journal['finished']:
+            print('--> The run finished normally')
+        elif nextProtocol is not None:
+            print(f"--> The run stopped at protocol number {nextProtocol + 1} of {len(journal['protocols'])}")
+
+        #let the user save or resume the recovered run
+        recoverWindow = Toplevel(root)
+        recoverWindow.title('Recover Run')
+        recoverFrame = Frame(recoverWindow, padx=20, pady=10)
+        recoverFrame.pack(fill = "both", expand = True)
+        Label(recoverFrame, text = f"Recovered {len(journal['loggedStimuli'])} logged protocols of {len(journal['protocols'])}").grid(row = 0, column = 0, columnspan = 3)
+
+        def save():
+            recoverWindow.destroy()
+            self.saveExperiment(runJustFinished = True)
+
+        def resume():
+            recoverWindow.destroy()
+            #the interrupted protocol runs again from the start, so its partial entry is dropped to keep it from being logged twice
+            self.experiment.loggedStimuli = [p for p in self.experiment.loggedStimuli if not p.get('_recoveredFromJournal')]
+            self.runExperiment(startIndex = nextProtocol)
+
+        saveButton = Button(recoverFrame, text = 'Save Recovered Experiment', command = save)
+        saveButton.grid(row = 1, column = 0, padx = 5, pady = 10)
+        if nextProtocol is not None:
+            resumeButton = Button(recoverFrame, text = f'Resume From Protocol {nextProtocol + 1}', command = resume)
+            resumeButton.grid(row = 1, column = 1, padx = 5, pady = 10)
+        closeButton = Button(recoverFrame, text = 'Close Window', command = recoverWindow.destroy)
+        closeButton.grid(row = 1, column = 2, padx = 5, pady = 10)
+
+
     def listProtocols(self):
         '''
         Generate a list of available protocols to display in the dropdown menu
@@ -662,17 +740,25 @@ class Bassoon:
         writeTtlLabel.grid(row = 1, column = 0, columnspan = 2)
         self.writeTtlSelection = StringVar(root)
         self.writeTtlSelection.set(self.experiment.writeTTL)
-        writeTtlDropdown = OptionMenu(experimentFrame, self.writeTtlSelection, *['None', 'Pulse', 'Sustained'])
+        writeTtlDropdown = OptionMenu(experimentFrame, self.writeTtlSelection, *['None', 'Pulse', 'Sustained', 'Photodiode'])
         writeTtlDropdown.grid(row = 1, column = 2)
         
         #check box for TTL bookmarks between protocols in sustained mode
-        ttlBookmarksLabel = Label(experimentFrame, text = 'TTL Bookmarks (for sustained mode only)', padx = 10)
+        ttlBookmarksLabel = Label(experimentFrame, text = 'TTL Bookmarks (for sustained and photodiode modes only)', padx = 10)
         ttlBookmarksLabel.grid(row = 2, column = 0, columnspan = 2)
         self.ttlBookmarksSelection = IntVar(root)
         self.ttlBookmarksSelection.set(self.experiment.ttlBookmarks)
         ttlBookmarksChk = Checkbutton(experimentFrame, var=self.ttlBookmarksSelection)
         ttlBookmarksChk.grid(row = 2, column = 2, pady = 10)
         
+        #type of bookmark code
+        bookmarkCodeLabel = Label(experimentFrame, text = 'Bookmark Code', padx = 10)
+        bookmarkCodeLabel.grid(row = 2, column = 3)
+        self.bookmarkCodeSelection = StringVar(root)
+        self.bookmarkCodeSelection.set(self.experiment.bookmarkCode)
+        bookmarkCodeDropdown = OptionMenu(experimentFrame, self.bookmarkCodeSelection, *['binary', 'legacy'])
+        bookmarkCodeDropdown.grid(row = 2, column = 4)
+        
            
         #choose ttl port
         ttlPortLabel = Label(experimentFrame, text = 'TTL Port', padx = 10)
@@ -682,6 +768,7 @@ class Bassoon:
         availablePorts = list(list_ports.comports()) #get available com ports
         if len(availablePorts) == 0:
             availablePorts = ['No Available Ports']        
+        availablePorts.append('fake - software stand-in port for testing TTL timing') #see experiments/fakeSerial.py
         ttlPortDropDown = OptionMenu(experimentFrame, self.ttlPortSelection, *availablePorts)
         ttlPortDropDown.grid(row = 1, column = 4)
 
@@ -722,6 +809,114 @@ class Bassoon:
         timingReportChk = Checkbutton(
             experimentFrame, var=self.timingReportSelection)
         timingReportChk.grid(row=5, column=3)
+        
+        #time-based animation
+        timeBasedAnimationLabel = Label(
+            experimentFrame, text='Compensate For Dropped Frames (Time-Based Motion)', padx=10)
+        timeBasedAnimationLabel.grid(row=6, column = 0, columnspan=3)
+        self.timeBasedAnimationSelection = IntVar(root)
+        self.timeBasedAnimationSelection.set(self.experiment.timeBasedAnimation)
+        timeBasedAnimationChk = Checkbutton(
+            experimentFrame, var=self.timeBasedAnimationSelection)
+        timeBasedAnimationChk.grid(row=6, column=3)
+        
+        #persistent window
+        persistentWindowLabel = Label(
+            experimentFrame, text='Keep Stimulus Window Open Between Runs', padx=10)
+        persistentWindowLabel.grid(row=7, column = 0, columnspan=3)
+        self.persistentWindowSelection = IntVar(root)
+        self.persistentWindowSelection.set(self.experiment.persistentWindow)
+        persistentWindowChk = Checkbutton(
+            experimentFrame, var=self.persistentWindowSelection)
+        persistentWindowChk.grid(row=7, column=3)
+        
+        #reduced internal resolution
+        reducedResolutionLabel = Label(
+            experimentFrame, text='Reduced Resolution Tolerance (0 = full resolution)', padx=10)
+        reducedResolutionLabel.grid(row=8, column = 0, columnspan=3)
+        self.reducedResolutionSelection = StringVar(root)
+        self.reducedResolutionSelection.set(str(self.experiment.reducedResolutionTolerance))
+        reducedResolutionEntry = Entry(experimentFrame, textvariable = self.reducedResolutionSelection, width = 6)
+        reducedResolutionEntry.grid(row=8, column=3)
+        
+        upscaleFilterLabel = Label(
+            experimentFrame, text='Upscale Filter', padx=10)
+        upscaleFilterLabel.grid(row=9, column = 0, columnspan=3)
+        self.upscaleFilterSelection = StringVar(root)
+        self.upscaleFilterSelection.set(self.experiment.upscaleFilter)
+        upscaleFilterDropdown = OptionMenu(experimentFrame, self.upscaleFilterSelection, *['nearest', 'linear'])
+        upscaleFilterDropdown.grid(row=9, column=3)
+        
+        #write TTLs on a background thread
+        asyncTTLLabel = Label(
+            experimentFrame, text='Write TTLs on a Background Thread', padx=10)
+        asyncTTLLabel.grid(row=10, column = 0, columnspan=3)
+        self.asyncTTLSelection = IntVar(root)
+        self.asyncTTLSelection.set(self.experiment.asyncTTL)
+        asyncTTLChk = Checkbutton(
+            experimentFrame, var=self.asyncTTLSelection)
+        asyncTTLChk.grid(row=10, column=3)
+        
+        #sync patch for photodiode mode
+        syncPatchSizeLabel = Label(
+            experimentFrame, text='Sync Patch Size (pixels, for photodiode mode only)', padx=10)
+        syncPatchSizeLabel.grid(row=11, column = 0, columnspan=3)
+        self.syncPatchSizeSelection = StringVar(root)
+        self.syncPatchSizeSelection.set(str(self.experiment.syncPatchSize))
+        syncPatchSizeEntry = Entry(experimentFrame, textvariable = self.syncPatchSizeSelection, width = 6)
+        syncPatchSizeEntry.grid(row=11, column=3)
+        
+        syncPatchCornerLabel = Label(
+            experimentFrame, text='Sync Patch Corner', padx=10)
+        syncPatchCornerLabel.grid(row=12, column = 0, columnspan=3)
+        self.syncPatchCornerSelection = StringVar(root)
+        self.syncPatchCornerSelection.set(self.experiment.syncPatchCorner)
+        syncPatchCornerDropdown = OptionMenu(experimentFrame, self.syncPatchCornerSelection, *['bottom right', 'bottom left', 'top right', 'top left'])
+        syncPatchCornerDropdown.grid(row=12, column=3)
+        
+        #cache of the sequences that protocols build before they run
+        artifactCacheFolderLabel = Label(
+            experimentFrame, text='Artifact Cache Folder (empty to turn off)', padx=10)
+        artifactCacheFolderLabel.grid(row=13, column = 0, columnspan=3)
+        self.artifactCacheFolderSelection = StringVar(root)
+        self.artifactCacheFolderSelection.set(self.experiment.artifactCacheFolder)
+        artifactCacheFolderEntry = Entry(experimentFrame, textvariable = self.artifactCacheFolderSelection, width = 20)
+        artifactCacheFolderEntry.grid(row=13, column=3)
+        
+        artifactCacheSizeLabel = Label(
+            experimentFrame, text='Artifact Cache Size (GB)', padx=10)
+        artifactCacheSizeLabel.grid(row=14, column = 0, columnspan=3)
+        self.artifactCacheSizeSelection = StringVar(root)
+        self.artifactCacheSizeSelection.set(str(self.experiment.artifactCacheSizeGB))
+        artifactCacheSizeEntry = Entry(experimentFrame, textvariable = self.artifactCacheSizeSelection, width = 6)
+        artifactCacheSizeEntry.grid(row=14, column=3)
+        
+        #journal of every run, for recovering from a crash
+        journalFolderLabel = Label(
+            experimentFrame, text='Run Journal Folder (empty to turn off)', padx=10)
+        journalFolderLabel.grid(row=15, column = 0, columnspan=3)
+        self.journalFolderSelection = StringVar(root)
+        self.journalFolderSelection.set(self.experiment.journalFolder)
+        journalFolderEntry = Entry(experimentFrame, textvariable = self.journalFolderSelection, width = 20)
+        journalFolderEntry.grid(row=15, column=3)
+        
+        journalEpochsLabel = Label(
+            experimentFrame, text='Journal Every Epoch', padx=10)
+        journalEpochsLabel.grid(row=16, column = 0, columnspan=3)
+        self.journalEpochsSelection = IntVar(root)
+        self.journalEpochsSelection.set(self.experiment.journalEpochs)
+        journalEpochsChk = Checkbutton(
+            experimentFrame, var=self.journalEpochsSelection)
+        journalEpochsChk.grid(row=16, column=3)
+        
+        #move big logs to disk as each protocol finishes
+        spillLogSizeLabel = Label(
+            experimentFrame, text='Move Logs Larger Than This to Disk (MB, 0 = off)', padx=10)
+        spillLogSizeLabel.grid(row=17, column = 0, columnspan=3)
+        self.spillLogSizeSelection = StringVar(root)
+        self.spillLogSizeSelection.set(str(self.experiment.spillLogSizeMB))
+        spillLogSizeEntry = Entry(experimentFrame, textvariable = self.spillLogSizeSelection, width = 6)
+        spillLogSizeEntry.grid(row=17, column=3)
 
         # add apply and close buttons
         buttonFrame = Frame(editFrame)
@@ -996,8 +1191,11 @@ class Bassoon:
 
         self.experiment.writeTTL = self.writeTtlSelection.get()
         self.experiment.ttlBookmarks = self.ttlBookmarksSelection.get() == 1
+        self.experiment.bookmarkCode = self.bookmarkCodeSelection.get()
         portSelection = self.ttlPortSelection.get()
-        if portSelection in ['No Available Ports', '', None]:
+        if self.experiment.writeTTL == 'Photodiode':
+            pass #the photodiode mode draws a patch on the stimulus window and doesn't need a port
+        elif portSelection in ['No Available Ports', '', None]:
             self.experiment.writeTTL = 'None' #reset write ttl feature to not active
             self.writeTtlSelection.set('None') #reset option box to reflect that you're not writing
             self.experiment.ttlPort = 'No Available Ports' #set the name of the port
@@ -1009,6 +1207,32 @@ class Bassoon:
         self.experiment.useFBO = self.FBObjectSelection.get() == 1
         self.experiment.recompileExperiment = self.recompileSelection.get() == 1
         self.experiment.timingReport = self.timingReportSelection.get()==1
+        self.experiment.timeBasedAnimation = self.timeBasedAnimationSelection.get()==1
+        self.experiment.persistentWindow = self.persistentWindowSelection.get()==1
+        if not self.experiment.persistentWindow:
+            self.experiment.closeWindows() #close any window that was left open by a previous run
+        try:
+            self.experiment.reducedResolutionTolerance = float(self.reducedResolutionSelection.get())
+        except:
+            print('***Could not update Reduced Resolution Tolerance value. Input type was probably not convertible to a float')
+        self.experiment.upscaleFilter = self.upscaleFilterSelection.get()
+        self.experiment.asyncTTL = self.asyncTTLSelection.get()==1
+        try:
+            self.experiment.syncPatchSize = float(self.syncPatchSizeSelection.get())
+        except:
+            print('***Could not update Sync Patch Size value. Input type was probably not convertible to a float')
+        self.experiment.syncPatchCorner = self.syncPatchCornerSelection.get()
+        self.experiment.artifactCacheFolder = self.artifactCacheFolderSelection.get().strip()
+        try:
+            self.experiment.artifactCacheSizeGB = float(self.artifactCacheSizeSelection.get())
+        except:
+            print('***Could not update Artifact Cache Size value. Input type was probably not convertible to a float')
+        self.experiment.journalFolder = self.journalFolderSelection.get().strip()
+        self.experiment.journalEpochs = self.journalEpochsSelection.get()==1
+        try:
+            self.experiment.spillLogSizeMB = float(self.spillLogSizeSelection.get())
+        except:
+            print('***Could not update the log size value. Input type was probably not convertible to a float')
 
         print('\n--> New experiment settings have been applied')
 
@@ -1040,13 +1264,27 @@ class Bassoon:
                 "useFBO": self.FBObjectSelection.get() == 1,
                 "warpFileName": self.experiment.warpFileName,
                 "timingReport": self.timingReportSelection.get()==1,
-                "recompileExperiment":self.recompileSelection.get()==1
+                "recompileExperiment":self.recompileSelection.get()==1,
+                "timeBasedAnimation":self.timeBasedAnimationSelection.get()==1,
+                "persistentWindow":self.persistentWindowSelection.get()==1,
+                "reducedResolutionTolerance":self.reducedResolutionSelection.get(),
+                "upscaleFilter":self.upscaleFilterSelection.get(),
+                "asyncTTL":self.asyncTTLSelection.get()==1,
+                "syncPatchSize":self.syncPatchSizeSelection.get(),
+                "syncPatchCorner":self.syncPatchCornerSelection.get(),
+                "bookmarkCode":self.bookmarkCodeSelection.get(),
+                "artifactCacheFolder":self.artifactCacheFolderSelection.get().strip(),
+                "artifactCacheSizeGB":self.artifactCacheSizeSelection.get(),
+                "journalFolder":self.journalFolderSelection.get().strip(),
+                "journalEpochs":self.journalEpochsSelection.get()==1,
+                "spillLogSizeMB":self.spillLogSizeSelection.get()
             }
         }
 
         portSelection = configDict['experiment']['ttlPort']
         if portSelection in ['No Available Ports', '', None]:
-            configDict['experiment']['writeTTL'] = False
+            if configDict['experiment']['writeTTL'] != 'Photodiode':
+                configDict['experiment']['writeTTL'] = False
             configDict['experiment']['ttlPort'] = 'No Available Ports'
 
         #Once Dictionary is filled with preferences it can be converted to JSON and saved
@@ -1290,12 +1528,14 @@ class Bassoon:
         self.experimentSketchBox.bind('<Button-3>', self.changeProtocolIndex)
 
 
-    def compileExperiment(self):
+    def compileExperiment(self, prepare = False):
         '''
         Generates experiment.protocolList based off the protocol objects listed
         in self.experimentSketch.
 
         experiment.protocolList is required to run experiment.activate()
+
+        If prepare is True, the protocols are also prepared ahead of time (see experiment.prepareProtocols) while a progress bar is shown
         '''
         print('\n--> Clearing pre-existing experiments...')
         # clear the protocolList in case it has any previous data
@@ -1306,6 +1546,29 @@ class Bassoon:
             protocolObject = copy.deepcopy(p[1]) #do a deep copy to establish a new pointer, so that  you can update values during experiment run that won't carry over to the next experiment
             self.experiment.addProtocol(protocolObject)
 
+        if not prepare:
+            return
+
+        progress = {} #the progress window is only created if there are protocols to prepare
+        def showProgress(numPrepared, numToPrepare):
+            if not progress:
+                progress['window'] = Toplevel(root)
+                progress['window'].title('Preparing Experiment')
+                progress['label'] = Label(progress['window'], text = '')
+                progress['label'].pack(padx = 20, pady = (15, 5))
+                progress['bar'] = ttk.Progressbar(progress['window'], length = 300, mode = 'determinate', maximum = numToPrepare)
+                progress['bar'].pack(padx = 20, pady = (5, 15))
+            progress['label'].configure(text = f'Preparing protocols: {numPrepared} of {numToPrepare} done')
+            progress['bar']['value'] = numPrepared
+            progress['window'].update()
+
+        print('--> Preparing protocols...')
+        try:
+            self.experiment.prepareProtocols(showProgress)
+        finally:
+            if progress:
+                progress['window'].destroy()
+
 
     def saveExperiment(self, runJustFinished=False):
         '''
@@ -1327,9 +1590,13 @@ class Bassoon:
             print('--> Save was ABORTED. Try saving again from the Bassoon GUI or console. Recompile should be set to False in the options menu in order to keep current data.')
             return
 
-        # set wins to None type because they may still be running processes which will prevent pickling
+        # set wins to None type because they may still be running processes which will prevent pickling. They are put back after saving so that persistent windows stay open
+        openWindows = (self.experiment.win, self.experiment.warper, self.experiment.informationWin, self.experiment.stimulusPool)
         self.experiment.win = None
+        self.experiment.warper = None
+        self.experiment.stimulusPool = None
         self.experiment.informationWin = None
+        copySpilledArrays(self.experiment.loggedStimuli, expfname[0:-11] + '_arrays') #keep spilled logs (see experiments/logSpill.py) with the .experiment file
         with open(expfname, 'wb') as f:
             pickle.dump(self.experiment, f)
 
@@ -1340,45 +1607,77 @@ class Bassoon:
             del self.experiment.portObj #delete the port object (it is readded after saving at the end of this function)
             
             
-        # save a json file as well that can be read in matlab
+        # save a json file as well that can be read in matlab. Only a shallow copy of the experiment and its logs is taken here - the file is written on a background thread (see experiments/serialization.py)
         jsonfname = expfname[0:-11] + '.json'
-        jsonDict = copy.deepcopy(vars(self.experiment))
-        jsonDict['protocolList'] = [p[0] for p in jsonDict['protocolList']]
-        for p in jsonDict['loggedStimuli']:
-            p.pop('_portObj', None)
-
-        
-        try:  # LOOK INTO WHY THESE COMMANDS THROW AN ERROR SOMETIMES... MIGHT HAVE TO DO WITH WHEN AN EXPERIMENT IS RELOADED AFTER BEING RUN ONCE
-            jsonDict['experimentStartTime'] = jsonDict['experimentStartTime'].strftime(
-                "%D %H:%M:%S")
-            jsonDict['experimentEndTime'] = jsonDict['experimentEndTime'].strftime(
-                "%D %H:%M:%S")
-        except:
-            pass
-        
-        with open(jsonfname, 'w') as f:
-            json.dump(jsonDict, f)
+        jsonAttributes = getJSONAttributes(self.experiment)
 
-        now = datetime.now()
-        print('--> Save succesful. Time: ', now.strftime("%D %H:%M:%S"))
-        print('--> .experiment and .json files saved at ' +
-              expfname[0:-11] + '.*')
+        self.experiment.win, self.experiment.warper, self.experiment.informationWin, self.experiment.stimulusPool = openWindows
         
         # re-establish the TTL port for the experiment
         self.experiment.establishPort(self.experiment.ttlPort, fromSave=True)
-        
-        try:
-            self.saveExperimentButton.configure(bg=_from_rgb((100, 200, 100)))
-        except:
-            print('It looks like the Bassoon GUI is not accessable... if it has already closed then you can ignore this message')
+
+        print('--> .experiment file saved at ' + expfname + '. Writing the .json file...')
+        self.writeJSONInBackground(jsonAttributes, jsonfname)
+
+
+    def writeJSONInBackground(self, jsonAttributes, jsonfname):
+        '''
+        Write the .json file of a saved experiment on a background thread while a progress bar is shown (see experiments/serialization.py)
+        '''
+        status = {'numWritten': 0, 'numToWrite': len(jsonAttributes['loggedStimuli']), 'error': None}
+        def updateStatus(numWritten, numToWrite):
+            status['numWritten'] = numWritten
+
+        def write():
+            try:
+                writeJSON(jsonAttributes, jsonfname, updateStatus)
+            except Exception as e:
+                status['error'] = e
+                print('***Could not write the .json file: ' + repr(e))
+                return
+            now = datetime.now()
+            print('--> Save succesful. Time: ', now.strftime("%D %H:%M:%S"))
+            print('--> .experiment and .json files saved at ' +
+                  jsonfname[0:-5] + '.*')
+
+        writer = threading.Thread(target = write, name = 'jsonWriter') #not a daemon, so that closing Bassoon waits for the file to be finished
+        writer.start()
+
+        progress = {} #the progress window is only created if writing takes more than a moment
+        def checkWriter():
+            try:
+                if writer.is_alive():
+                    if not progress:
+                        progress['window'] = Toplevel(root)
+                        progress['window'].title('Saving Experiment')
+                        progress['label'] = Label(progress['window'], text = '')
+                        progress['label'].pack(padx = 20, pady = (15, 5))
+                        progress['bar'] = ttk.Progressbar(progress['window'], length = 300, mode = 'determinate', maximum = max(status['numToWrite'], 1))
+                        progress['bar'].pack(padx = 20, pady = (5, 15))
+                    progress['label'].configure(text = f"Writing .json file: {status['numWritten']} of {status['numToWrite']} logged protocols done")
+                    progress['bar']['value'] = status['numWritten']
+                    root.after(100, checkWriter)
+                    return
+
+                if progress:
+                    progress['window'].destroy()
+                if status['error'] is None:
+                    self.saveExperimentButton.configure(bg=_from_rgb((100, 200, 100)))
+            except:
+                print('It looks like the Bassoon GUI is not accessable... if it has already closed then you can ignore this message')
+
+        checkWriter()
             
 
-    def runExperiment(self):
+    def runExperiment(self, startIndex = 0):
         '''
-        Execute the psychopy experiment
+        Execute the psychopy experiment. startIndex is the index of the first protocol to run (see recoverRun)
         '''
-        # assemble the experiment
-        self.compileExperiment()
+        # assemble the experiment and prepare the protocols before the stimulus window opens
+        loggedStimuli = self.experiment.loggedStimuli
+        self.compileExperiment(prepare = True)
+        if startIndex > 0:
+            self.experiment.loggedStimuli = loggedStimuli #keep the protocols that already ran
 
         # add all protocol objects to the experiment
         print(' \n--> Preparing to run experiment. Bassoon will become tacet.')
@@ -1387,8 +1686,9 @@ class Bassoon:
         print('--> Tacet!')
         print('--> Experiment is now live! If available, use the information window for further assistance. Good luck.')
 
-        self.experiment.experimentStartTime = datetime.now()  # write down start time
-        self.experiment.activate()  # run the experiment
+        if startIndex == 0:
+            self.experiment.experimentStartTime = datetime.now()  # write down start time
+        self.experiment.activate(startIndex)  # run the experiment
         self.experiment.experimentEndTime = datetime.now()  # write down end time
 
         try:
@@ -1408,6 +1708,12 @@ class Bassoon:
         '''
         Executes when the main app window closes in order to clean up anything that needs to get done
         '''
+        #close the stimulus windows if they were kept open between runs
+        try:
+            self.experiment.closeWindows()
+        except:
+            print('\nCould not close the stimulus window')
+            
         #close any open com ports
         if self.experiment.ttlPortOpen:
             try:
@@ -1448,15 +1754,16 @@ def secondsToMinutesAndSeconds(seconds):
 
 
 ##############################################################################
-root = Tk()  # full function = tk.Tk()
-root.geometry('400x600')
-#root.iconbitmap(r'images\bassoonIcon.ico')
-app = Bassoon(root)
-root.mainloop()
-try:
-    root.destroy()
-except:
-    pass #normally root.destroy is not needed because it's handled in app.onClosing()
+if __name__ == '__main__': #protocols are prepared in worker processes that import this module, and they shouldn't open the GUI
+    root = Tk()  # full function = tk.Tk()
+    root.geometry('400x600')
+    #root.iconbitmap(r'images\bassoonIcon.ico')
+    app = Bassoon(root)
+    root.mainloop()
+    try:
+        root.destroy()
+    except:
+        pass #normally root.destroy is not needed because it's handled in app.onClosing()
     
 
 # Example of how to load experiments without opening the GUI:
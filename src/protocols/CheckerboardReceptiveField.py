@@ -7,12 +7,14 @@ Created on Thu Jul 15 15:23:17 2021
 
 from protocols.protocol import protocol
 import random
-from psychopy import core, visual, data, event, monitors
+from psychopy import visual, data, event, monitors
 import math
 import numpy as np
 import serial
 
 class CheckerboardReceptiveField(protocol):
+    prepareParameters = protocol.prepareParameters + ['randomSeed', 'stimulusReps', 'checkHeight', 'checkWidth', 'frameDwell'] #see protocol.prepareParameters
+
     def __init__(self):
         super().__init__()
         self.protocolName = 'CheckerboardReceptiveField' #This stimulus randomly updates a checkerboard pattern over time. It is a common method for building linear models of receptive fields.
@@ -27,6 +29,13 @@ class CheckerboardReceptiveField(protocol):
         self.interStimulusInterval = 1.0 #seconds - the wait time between each epoch. The background color is displayed during this time.
         self.noiseType = 'Binary' #The type of noise pattern to use. Binary is the only type currently implemented... future additions will have more.
 
+    def getMinimumFeatureSize(self, win):
+        '''
+        Returns the smallest dimension of one check in pixels (see protocol.getMinimumFeatureSize)
+        '''
+        return min(self.checkWidth, self.checkHeight) * self.getPixPerDeg(win.monitor)
+
+
     def estimateTime(self):
         '''
         Estimate the total amount of time that this protocol will take to run
@@ -61,6 +70,30 @@ class CheckerboardReceptiveField(protocol):
         return colorLog
 
 
+    def prepare(self, geometry, FR):
+        '''
+        Builds the grid of checks and the noise sequence for a window of the given geometry (see protocol.prepare)
+        '''
+        pixPerDeg = geometry['pixPerDeg']
+        winWidthPix, winHeightPix = geometry['size']
+
+        checkWidthPix = int(self.checkWidth*pixPerDeg) #maybe a slight rounding error here by using int
+        checkHeightPix = int(self.checkHeight*pixPerDeg)
+        self._checkSizePix = [checkWidthPix, checkHeightPix]
+
+        #specify the x and y center coordinates for each check
+        xCoordinates = [x - winWidthPix/2 for x in range(-checkWidthPix,winWidthPix+checkWidthPix,checkWidthPix)]
+        yCoordinates = [y - winHeightPix/2 for y in range(-checkHeightPix,winHeightPix+checkHeightPix,checkHeightPix)]
+        numChecks = len(xCoordinates)*len(yCoordinates)
+
+        self._checkCoordinates = []
+        for i in range(len(xCoordinates)):
+            for j in range(len(yCoordinates)):
+                self._checkCoordinates.append([xCoordinates[i], yCoordinates[j]])
+
+        self._preparedData = {'colorLog': self.generateColorLog(numChecks)}
+
+
     def run(self, win, informationWin):
         '''
         Executes the Checkerboard Receptive Field stimulus
@@ -69,44 +102,25 @@ class CheckerboardReceptiveField(protocol):
 
         self._informationWin = informationWin #tuple, save here so you don't have to pass this as a function parameter every time you use it
 
-        stimMonitor = win.monitor
-        pixPerDeg = self.getPixPerDeg(stimMonitor)
-
         self.getFR(win)
+        self.ensurePrepared(win) #builds the checks and the noise sequence unless they were prepared ahead of time
         self._interStimulusIntervalNumFrames = round(self._FR * self.interStimulusInterval)
         self._actualInterStimulusInterval = self._interStimulusIntervalNumFrames * 1/self._FR
 
+        colorLog = self._preparedData['colorLog'] #3 dimensional numpy array: d1 = rep number, d2 = flip number for that rep, d3 = check number. Value is the color
+        numChecks = len(self._checkCoordinates)
+        checkWidthPix, checkHeightPix = self._checkSizePix
 
         #Pause for keystroke if the user wants to manually initiate
         if self.userInitiated:
             self.showInformationText(win, 'Stimulus Information: Checkerboard Receptive Field \nPress any key to begin')
             event.waitKeys() #wait for key press
 
-        winWidthPix = win.size[0]
-        winHeightPix = win.size[1]
-
-        checkWidthPix = int(self.checkWidth*pixPerDeg) #maybe a slight rounding error here by using int
-        checkHeightPix = int(self.checkHeight*pixPerDeg)
-
-        #specify the x and y center coordinates for each check
-        xCoordinates = [x - win.size[0]/2 for x in range(-checkWidthPix,win.size[0]+checkWidthPix,checkWidthPix)]
-        yCoordinates = [y - win.size[1]/2 for y in range(-checkHeightPix,win.size[1]+checkHeightPix,checkHeightPix)]
-        numChecks = len(xCoordinates)*len(yCoordinates)
-
-        self._checkCoordinates = []
-        colors = []
-        for i in range(len(xCoordinates)):
-            for j in range(len(yCoordinates)):
-                self._checkCoordinates.append([xCoordinates[i], yCoordinates[j]])
-
-
         sizes = [(checkWidthPix, checkHeightPix) for i in range(numChecks)]
 
-        colorLog = self.generateColorLog(numChecks) #3 dimensional numpy array: d1 = rep number, d2 = flip number for that rep, d3 = check number. Value is the color
-
 
-        noiseField = visual.ElementArrayStim(
-            win,
+        noiseField = self.getStimulus(
+            win, visual.ElementArrayStim,
             nElements = numChecks,
             elementMask="None",
             elementTex = None,
@@ -115,9 +129,8 @@ class CheckerboardReceptiveField(protocol):
             )
 
 
-        self.burstTTL(win) #burst to mark onset of the stimulus
+        self.warmUp(win, noiseField) #draw once before the first epoch so that the first frames are not dropped
 
-        trialClock = core.Clock() #this will reset every trial
         self._totalFrames = (self._interStimulusIntervalNumFrames+self._preTimeNumFrames+self._stimTimeNumFrames+self._tailTimeNumFrames)*self.stimulusReps
             
         for i in range(self.stimulusReps):
@@ -130,24 +143,24 @@ class CheckerboardReceptiveField(protocol):
             #pause for inter stimulus interval
             win.color = self.backgroundColor
             for f in range(self._interStimulusIntervalNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                         return
 
 
-            self._stimulusStartLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochStart()
+            self.sendTTLOnFlip(win)
             self._numberOfEpochsStarted += 1
             #pretime... nothing happens
             for f in range(self._preTimeNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                         return
 
             #stim time
 
-            #decrease baudrate for speed during frame flips
-            if self.writeTTL == 'Pulse':
+            #decrease baudrate for speed during frame flips (not needed if a ttlWriter writes the pulses on its own thread)
+            if self.writeTTL == 'Pulse' and self._ttlWriter is None:
                 self._portObj.baudrate = 1000000
 
             for f in range(self._stimTimeNumFrames):
@@ -157,24 +170,24 @@ class CheckerboardReceptiveField(protocol):
                     noiseField.colors = colors
 
                 noiseField.draw()
-                win.flip()
-                self.sendTTL()  #write ttl for every frame flip for this stimulus
+                self.sendTTLOnFlip(win)  #write ttl for every frame flip for this stimulus
+                self.flip(win)
                 if self.checkQuitOrPause():
                         return
 
             #return baudrate to high value
-            if self.writeTTL == 'Pulse':
+            if self.writeTTL == 'Pulse' and self._ttlWriter is None:
                 self._portObj.baudrate = 4000000
 
             #tail time
             for f in range(self._tailTimeNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                         return
 
 
-            self._stimulusEndLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochEnd()
+            self.sendTTLOnFlip(win)
 
             self._numberOfEpochsCompleted += 1
 
@@ -7,7 +7,7 @@ Noise pattern moves in random directions distributed within some window
 @author: mrsco
 """
 from protocols.protocol import protocol
-from psychopy import core, visual, data, event, monitors
+from psychopy import visual, data, event, monitors
 import serial, random, math
 
 class DriftingNoise(protocol):
@@ -29,6 +29,12 @@ class DriftingNoise(protocol):
         self.interStimulusInterval = 0.5 #seconds - the wait time between each epoch. The background color is displayed during this time.
         self._angleOffset = 0.0 # reassigned by the experiment in most cases
 
+    def getMinimumFeatureSize(self, win):
+        '''
+        The smallest feature of the noise pattern is one check. Returns its size in pixels (see protocol.getMinimumFeatureSize)
+        '''
+        return self.checkSize * self.getPixPerDeg(win.monitor)
+
     def estimateTime(self):
         '''
         Estimate the total amount of time that this protocol will take to run
@@ -88,9 +94,11 @@ class DriftingNoise(protocol):
         
         checkSizePix = self.checkSize * pixPerDeg
         
+        self.createOrientationLog()
+        
         pattern = visual.NoiseStim(
             win, name = 'noise',
-            size = (win.size[0]*2, win.size[1]*2),
+            size = (win.size[0]*2, win.size[1]*2), #not reduced to getCoverSize: the noise texture is generated at this size, so a smaller stimulus would change the pattern and how far it drifts before repeating
             noiseType= self.noiseType,
             noiseElementSize = checkSizePix, #pixels
             contrast = self.patternContrast,
@@ -98,31 +106,18 @@ class DriftingNoise(protocol):
             )
 
 
-        #The cover rectangle is drawn on top of the primary pattern. It is used
-        #to change the mean intensity of the pattern when the user desires.
-        #If the mean intensity is set to 0, then the cover rectangle is still
-        #drawn but with an opacity of 0
-        coverRectangle = visual.Rect(
-            win,
-            size = (win.size[0]*2, win.size[1]*2),
-            opacity = 0
-            )
-
-        if self.meanIntensity > 0:
-            coverRectangle.fillColor = [1, 1, 1]
-            coverRectangle.opacity = self.meanIntensity
-        elif self.meanIntensity < 0:
-            coverRectangle.fillColor = [-1, -1, -1]
-            coverRectangle.opacity = -1*self.meanIntensity
+        meanIntensityColor = self.applyMeanIntensity(pattern) #mean intensity is applied in the same pass (see protocol.applyMeanIntensity)
             
         cyclesPerPix = pattern.sf[1]
         self._numCyclesToShiftByFrame = self.speed*pixPerDeg*cyclesPerPix*(1/self._FR) #using y coordinate of sf
+        
+        #absolute phase of the pattern on each frame of each epoch (saved as a list for analysis)
+        phaseLog = self.createPhaseLog(self._numCyclesToShiftByFrame, len(self._orientationLog), self._stimTimeNumFrames)
+        self._phaseLog = phaseLog.tolist()
 
-        self.createOrientationLog()
-
+        self.warmUp(win, pattern) #draw once before the first epoch so that the first frames are not dropped
         totalEpochs = len(self._orientationLog)
         epochNum = 0
-        trialClock = core.Clock() #this will reset every trial
 
         self._totalFrames = (self._interStimulusIntervalNumFrames+self._preTimeNumFrames+self._stimTimeNumFrames+self._tailTimeNumFrames)*self.stimulusReps
         
@@ -130,6 +125,7 @@ class DriftingNoise(protocol):
         for ori in self._orientationLog:
             pattern.ori = -ori + 37 - self._angleOffset #add 37 b/c for some reason binary noise phase modulates along this direction... flip for coordinate convention: 0 = east, 90 = north, 180 = west, 270 = south
             epochNum += 1
+            epochPhase = phaseLog[epochNum-1]
             print (ori)
             #show information if necessary
             if self._informationWin[0]:
@@ -139,43 +135,38 @@ class DriftingNoise(protocol):
 
             #pause for inter stimulus interval
             win.color = self.backgroundColor
-            for f in range(self._interStimulusIntervalNumFrames):
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._interStimulusIntervalNumFrames):
+                return
 
             #pretime... stationary pattern
-            self._stimulusStartLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochStart()
+            self.sendTTLOnFlip(win)
             self._numberOfEpochsStarted += 1
-            for f in range(self._preTimeNumFrames):
-                pattern.draw()
-                coverRectangle.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            self.setWindowColor(win, meanIntensityColor)
+            pattern.phase = epochPhase[0]
+            if self.flipStaticFrames(win, self._preTimeNumFrames, pattern):
+                return
             
             
             #stim time - drifting pattern
-            for f in range(self._stimTimeNumFrames):
-                pattern.phase += self._numCyclesToShiftByFrame
+            f = 0
+            while f < self._stimTimeNumFrames:
+                pattern.phase = epochPhase[f+1]
                 pattern.draw()
-                coverRectangle.draw()
-                win.flip()
+                flipTime = self.flip(win)
                 if self.checkQuitOrPause():
                     return
+                f = self.getNextFrameIndex(f, flipTime, epochNum)
+            pattern.phase = epochPhase[-1] #make sure the pattern ends where it should, even if the last frames were skipped
 
             #tail time - stationary pattern
-            for f in range(self._tailTimeNumFrames):
-                pattern.draw()
-                coverRectangle.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._tailTimeNumFrames, pattern):
+                return
 
-            self._stimulusEndLog.append(trialClock.getTime())
-            self.sendTTL()
-            win.flip();win.flip() #two flips to allow for a pause for TTL writing
+            self.setWindowColor(win, self.backgroundColor)
+            self.markEpochEnd()
+            self.sendTTLOnFlip(win)
+            self.flip(win);self.flip(win) #two flips to allow for a pause for TTL writing
 
             self._numberOfEpochsCompleted += 1
 
@@ -6,7 +6,7 @@ Created on Fri Jul 16 12:09:17 2021
 """
 
 from protocols.protocol import protocol
-from psychopy import core, visual, data, event, monitors
+from psychopy import visual, data, event, monitors
 import numpy
 import serial
 
@@ -61,7 +61,6 @@ class Flash(protocol):
             event.waitKeys() #wait for key press  
         
         epochNum = 0
-        trialClock = core.Clock() #this will reset every trial
         
         for stim in range(self.stimulusReps):
             epochNum += 1
@@ -73,36 +72,36 @@ class Flash(protocol):
             #pause for inter stimulus interval
             win.color = self.backgroundColor
             for f in range(self._interStimulusIntervalNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                     return
                     
             #pretime... nothing happens
-            self._stimulusStartLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochStart()
+            self.sendTTLOnFlip(win)
             self._numberOfEpochsStarted += 1
             for f in range(self._preTimeNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                     return
             
             #stim time - flash
             win.color = self.flashIntensity
             for f in range(self._stimTimeNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                     return
             
             #tail time
             win.color = self.backgroundColor
             for f in range(self._tailTimeNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                     return
         
             
-            self._stimulusEndLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochEnd()
+            self.sendTTLOnFlip(win)
             
             self._numberOfEpochsCompleted += 1
                 
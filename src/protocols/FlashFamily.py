@@ -9,7 +9,7 @@ Flash intensities of different magnitudes
 
 from protocols.protocol import protocol
 import random
-from psychopy import core, visual, data, event, monitors
+from psychopy import visual, data, event, monitors
 import math
 import numpy as np
 import serial
@@ -86,7 +86,6 @@ class FlashFamily(protocol):
         intensityList = [[size, size, size] for size in self._flashLog[0:len(self.stepSizes)]] #List of list corresponding to color to assign to win object for each flash in one family
         epochNum = 0
         
-        trialClock = core.Clock() #this will reset every trial
         for i in range(self.stimulusReps):
             
             
@@ -99,7 +98,7 @@ class FlashFamily(protocol):
             #pause for interfamily interval
             win.color = self.backgroundColor
             for f in range(self._interFamilyIntervalNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                         return
             
@@ -108,37 +107,37 @@ class FlashFamily(protocol):
                 #pause for inter stimulus interval
                 win.color = self.backgroundColor
                 for f in range(self._interFlashIntervalNumFrames):
-                    win.flip()
+                    self.flip(win)
                     if self.checkQuitOrPause():
                         return
                 
-                self._stimulusStartLog.append(trialClock.getTime())
-                self.sendTTL()
+                self.markEpochStart()
+                self.sendTTLOnFlip(win)
                 self._numberOfEpochsStarted += 1
                 #pretime... nothing happens
                 win.color = self.backgroundColor
                 for f in range(self._preTimeNumFrames):
-                    win.flip()
+                    self.flip(win)
                     if self.checkQuitOrPause():
                         return
             
                 #stim time
                 win.color = intensityList[stepNum] #set flash intensity
                 for f in range(self._stimTimeNumFrames):
-                    win.flip()
+                    self.flip(win)
                     if self.checkQuitOrPause():
                         return
                     
                 #tail time
                 win.color = self.backgroundColor
                 for f in range(self._tailTimeNumFrames):
-                    win.flip()
+                    self.flip(win)
                     if self.checkQuitOrPause():
                         return
         
             
-                self._stimulusEndLog.append(trialClock.getTime())
-                self.sendTTL()
+                self.markEpochEnd()
+                self.sendTTLOnFlip(win)
 
                 self._numberOfEpochsCompleted += 1
                 
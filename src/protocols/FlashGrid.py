@@ -6,8 +6,9 @@ Created on Sun Oct 29 20:12:51 2023
 """
 
 from protocols.protocol import protocol
-from psychopy import core, visual, data, event, monitors
-import serial, random, math
+from psychopy import visual, data, event, monitors
+import serial, math
+import numpy as np
 
 class FlashGrid(protocol):
     def __init__(self):
@@ -53,6 +54,13 @@ class FlashGrid(protocol):
          return tf, errorMessage
      
         
+    def getMinimumFeatureSize(self, win):
+        '''
+        Returns the smallest dimension of one check in pixels (see protocol.getMinimumFeatureSize)
+        '''
+        return min(self.checkWidth, self.checkHeight) * self.getPixPerDeg(win.monitor)
+
+
     def estimateTime(self):
         '''
         Estimate the total amount of time that this protocol will take to run
@@ -102,19 +110,18 @@ class FlashGrid(protocol):
         '''
         Set the sequence of flashes for each check in the grid.
         
-        The flash sequence is a list of lists. The outer list has n elements, 
-        equal to the number of stimulus repetitions (i.e. epochs). The inner list
-        has m elements, equal to the total number of flashes per epoch
-        (i.e., number of checks * repsPerCheck).
+        The flash sequence is a numpy array with one row per epoch. There are
+        stimulusReps * repsPerCheck epochs, and each row is a pseudorandom
+        permutation of the check indices (so every check flashes once per epoch).
+        It is saved as a list of lists in self._flashSequence.
+        
+        returns: the flash sequence as a numpy array
         '''
-        random.seed(self.randomSeed) #reinitialize the random seed
-        self._flashSequence = [] #initialize, this will end up being a list of lists
-        for i in range(self.stimulusReps):
-            thisEpoch = []
-            for j in range(self.repsPerCheck):
-                thisEpoch += [random.sample(range(numChecks), numChecks)]
-            
-            self._flashSequence += thisEpoch
+        rng = self.getRandomGenerator()
+        flashSequence = rng.permuted(np.tile(np.arange(numChecks), (self.stimulusReps*self.repsPerCheck, 1)), axis = 1)
+        self._flashSequence = flashSequence.tolist() #make it a list b/c ndarrays have trouble saving
+        
+        return flashSequence
         
             
     def run(self, win, informationWin):
@@ -160,20 +167,19 @@ class FlashGrid(protocol):
             for j in range(len(yCoordinates)):
                 self._checkCoordinates.append([xCoordinates[i], yCoordinates[j]])
 
-        sizes = [(checkWidthPix, checkHeightPix) for i in range(numChecks)]
-        colors = [self.backgroundColor for i in range(numChecks)]
+        checkPositions = np.array(self._checkCoordinates) #preallocated so that only the position of the flashing check changes on each flash
         
-        flashField = visual.ElementArrayStim(
-            win,
-            nElements = numChecks,
-            elementMask="None",
-            elementTex = None,
-            xys = self._checkCoordinates,
-            sizes = sizes,
-            colors = colors
+        #Only one check flashes at a time and the rest of the grid is the background color, so a single check is moved into place for each flash.
+        #This keeps the cost of each flash independent of the size of the grid
+        flashCheck = self.getStimulus(
+            win, visual.Rect,
+            width = checkWidthPix,
+            height = checkHeightPix,
+            fillColor = [c * self.flashIntensity for c in self.flashColor],
+            lineColor = None
             )
         
-        self.setFlashSequence(numChecks)
+        flashSequence = self.setFlashSequence(numChecks)
         
         self.estimatedNumberOfChecks = numChecks
         totalS = self.estimateTime()
@@ -182,14 +188,12 @@ class FlashGrid(protocol):
               this stimulus is now estimated to take " + str(m) + " minutes and " \
                   + str(s) + " seconds")
         
-        self.burstTTL(win) #burst to mark onset of the stimulus for pulse mode only
+        self.warmUp(win, flashCheck) #draw once before the first epoch so that the first frames are not dropped
 
-        trialClock = core.Clock() #this will reset every trial
         
         epochNum = 0
-        flashColor = [c * self.flashIntensity for c in self.flashColor]
         #stimulus loop
-        for sequence in self._flashSequence: #looping through the outer list
+        for sequence in flashSequence: #looping through the rows
             epochNum += 1
             
             #show information if necessary
@@ -200,62 +204,57 @@ class FlashGrid(protocol):
             #pause for inter stimulus interval
             win.color = self.backgroundColor
             for f in range(self._interStimulusIntervalNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                         return
 
 
-            self._stimulusStartLog.append(trialClock.getTime())
+            self.markEpochStart()
             self._numberOfEpochsStarted += 1
             #pretime... nothing happens
             for f in range(self._preTimeNumFrames):
-                win.flip()
+                self.flip(win)
                 allKeys = event.getKeys() #check if user wants to quit early
                 if self.checkQuitOrPause():
                         return
 
-            #decrease baudrate for speed during frame flips
-            if self.writeTTL == 'Pulse':
+            #decrease baudrate for speed during frame flips (not needed if a ttlWriter writes the pulses on its own thread)
+            if self.writeTTL == 'Pulse' and self._ttlWriter is None:
                 self._portObj.baudrate = 1000000
         
             #stim time
             for check in sequence:
                 
-                #use this weird work around to change flash color
-                #   because there is a problem with indexing directly to flashField.colors on some computers
-                cs = flashField.colors
-                cs[check, :] = flashColor
-                flashField.colors = cs
+                flashCheck.pos = checkPositions[check]
                 for f in range(self._flashDurationNumFrames):
-                    flashField.draw()
-                    win.flip()
+                    flashCheck.draw()
                     if f == 0:
-                        self.sendTTL()  #write ttl at the onset of every flash
+                        self.sendTTLOnFlip(win)  #write ttl at the onset of every flash
+                    self.flip(win)
                     
                     if self.checkQuitOrPause():
                         return
             
-                flashField.colors = colors #reset opacities to all zero
-                self.sendTTL()
+                self.sendTTLOnFlip(win) #the check is no longer drawn, so the grid is back to the background color
                 
                 #wait the interFlashInterval time
                 for f in range(self._interFlashIntervalNumFrames):
-                    win.flip()
+                    self.flip(win)
                     if self.checkQuitOrPause():
                         return
 
             #return baudrate to high value
-            if self.writeTTL == 'Pulse':
+            if self.writeTTL == 'Pulse' and self._ttlWriter is None:
                 self._portObj.baudrate = 4000000
 
 
             #tail time
             for f in range(self._tailTimeNumFrames):
-                win.flip()
-                if self.checkQuit():
+                self.flip(win)
+                if self.checkQuitOrPause():
                         return
 
-            self._stimulusEndLog.append(trialClock.getTime())
+            self.markEpochEnd()
             
             self._numberOfEpochsCompleted += 1
 
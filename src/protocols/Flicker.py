@@ -6,7 +6,7 @@ Created on Sun Nov 10 13:30:40 2024
 """
 
 from protocols.protocol import protocol
-from psychopy import core, visual, data, event, monitors
+from psychopy import visual, data, event, monitors
 import numpy
 import serial
 
@@ -99,7 +99,6 @@ class Flicker(protocol):
             event.waitKeys() #wait for key press  
         
         epochNum = 0
-        trialClock = core.Clock() #this will reset every trial
         
         self.flickerCount = self._stimTimeNumFrames / self._flickerNumFrames
         self.roundedFlickerCount = round(self.flickerCount)
@@ -115,16 +114,16 @@ class Flicker(protocol):
             #pause for inter stimulus interval
             win.color = self.backgroundColor
             for f in range(self._interStimulusIntervalNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                     return
                     
             #pretime... nothing happens
-            self._stimulusStartLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochStart()
+            self.sendTTLOnFlip(win)
             self._numberOfEpochsStarted += 1
             for f in range(self._preTimeNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                     return
             
@@ -143,22 +142,22 @@ class Flicker(protocol):
                     count = 0
                 
                 count += 1
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                     return
 
             #tail time
             win.color = self.backgroundColor
             for f in range(self._tailTimeNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                     return
         
             
 
                 
-            self._stimulusEndLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochEnd()
+            self.sendTTLOnFlip(win)
             
             self._numberOfEpochsCompleted += 1
                 
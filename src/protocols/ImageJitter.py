@@ -14,13 +14,15 @@ Must use .jpg images only.
 
 
 from protocols.protocol import protocol
-from psychopy import core, visual, data, event, monitors
+from psychopy import visual, data, event, monitors
 import serial, random, math
 import os, glob, json
 import numpy as np
 
 
 class ImageJitter(protocol):
+    prepareParameters = protocol.prepareParameters + ['randomSeed', 'stimulusReps', 'imageFolderPath', 'imageFileExtension', 'imageStartingPosition', 'apertureDiameter', 'moveMeanFrames', 'speedStandardDeviation', 'recenterSpeed'] #see protocol.prepareParameters
+
     def __init__(self):
         super().__init__()
         self.protocolName = 'ImageJitter' #in the ImageJitter stimulus, presaved images are moved smoothly across the monitor according to a random walk pattern.
@@ -215,6 +217,19 @@ class ImageJitter(protocol):
         
         print("Done!")
 
+
+    def prepare(self, geometry, FR):
+        '''
+        Finds the images and creates the image sequence and position log (see protocol.prepare). self._imagesFound is False if the images couldn't be found
+        '''
+        self._pixPerDeg = geometry['pixPerDeg'] #only included for this stimulus to help with analysis of the position log (which is in pixels)
+        self._imagesFound = bool(self.findImageInfo()) #loads the list of images to use in the experiment and grabs data about them, list in self._allImgs
+        if not self._imagesFound:
+            return
+        
+        self.createImageSequence() #creates the self._imageSequence
+        self.createPositionLog(self._pixPerDeg) #creates the position log in PIXEL units, self._positionLog_Pix
+
         
     def run(self, win, informationWin):
         '''
@@ -225,21 +240,17 @@ class ImageJitter(protocol):
         self._informationWin = informationWin #tuple, save here so you don't have to pass this as a function parameter every time you use it
 
         self.getFR(win)
+        self.ensurePrepared(win) #finds the images and creates the image sequence and position log unless they were prepared ahead of time
         self._interStimulusIntervalNumFrames = round(self._FR * self.interStimulusInterval)
         self._actualInterStimulusInterval = self._interStimulusIntervalNumFrames * 1/self._FR
    
         stimMonitor = win.monitor
         pixPerDeg = self.getPixPerDeg(stimMonitor)
-        self._pixPerDeg = self.getPixPerDeg(stimMonitor) #only included for this stimulus to help with analysis of the position log (which is in pixels). Rerunning the function to create an independent pointer
         
-        imagesFound = self.findImageInfo() #loads the list of images to use in the experiment and grabs data about them, list in self._allImgs
-        if not imagesFound:
+        if not self._imagesFound:
             print("!!! There was a problem locating the images and/or JSON data in the ImageJitter stimulus at path " \
                   + self.imageFolderPath + "\n \n !!! The Image Jitter stimulus is being ABORTED")
             return
-        
-        self.createImageSequence() #creates the self._imageSequence
-        self.createPositionLog(pixPerDeg) #creates the position log in PIXEL units, self._positionLog_Pix
 
         #Pause for keystroke if the user wants to manually initiate
         if self.userInitiated:
@@ -263,14 +274,12 @@ class ImageJitter(protocol):
             )
 
         epochNum = 0
-        trialClock = core.Clock() #this will reset every trial
-        
-        self.burstTTL(win) #burst to mark onset of the stimulus
 
         #stimulus loop
         for img in self._imageSequence:
             image.image = img
             image.pos = startingPositionPix
+            self.warmUp(win, image) #each epoch has a new image, so draw it once before the epoch starts
             
             epochNum += 1
             #show information if necessary
@@ -281,56 +290,46 @@ class ImageJitter(protocol):
 
             #pause for inter stimulus interval
             win.color = self.backgroundColor
-            for f in range(self._interStimulusIntervalNumFrames):
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._interStimulusIntervalNumFrames):
+                return
 
             #pretime... stationary image
-            self._stimulusStartLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochStart()
+            self.sendTTLOnFlip(win)
             self._numberOfEpochsStarted += 1
-            for f in range(self._preTimeNumFrames):
-                image.draw()
-                #aperture.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._preTimeNumFrames, image):
+                return
             
-            if self.writeTTL == 'Pulse':
+            if self.writeTTL == 'Pulse' and self._ttlWriter is None:
                 self._portObj.baudrate = 1000000
 
             #stim time - flash
-            for f in range(self._stimTimeNumFrames):
+            f = 0
+            while f < self._stimTimeNumFrames:
                 
                 image.pos = (self._positionLog_Pix[f, 0, epochNum-1], self._positionLog_Pix[f, 1, epochNum-1])
                 image.draw()
-                win.flip()
-                
-                self.sendTTL()
+                self.sendTTLOnFlip(win) #write ttl at the moment this frame is displayed
+                flipTime = self.flip(win)
                     
                 if self.checkQuitOrPause():
                     return
+                f = self.getNextFrameIndex(f, flipTime, epochNum)
             
             #return baudrate to high value
-            if self.writeTTL == 'Pulse':
+            if self.writeTTL == 'Pulse' and self._ttlWriter is None:
                 self._portObj.baudrate = 4000000
 
             #tail time
-            for f in range(self._tailTimeNumFrames):
-                image.draw()
-                #aperture.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._tailTimeNumFrames, image):
+                return
 
 
-            self._stimulusEndLog.append(trialClock.getTime())
-            self.sendTTL()
-            win.flip();win.flip() #two flips to allow for a pause for TTL writing
+            self.markEpochEnd()
+            self.sendTTLOnFlip(win)
+            self.flip(win);self.flip(win) #two flips to allow for a pause for TTL writing
 
             self._numberOfEpochsCompleted += 1
 
-        self._positionLog_Pix = self._positionLog_Pix.tolist() #convert to list for JSON dump saving
         self._completed = 1
         
\ No newline at end of file
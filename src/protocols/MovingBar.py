@@ -8,7 +8,7 @@ Bar moves across the screen at a given speed in each of n directions
 """
 from protocols.protocol import protocol
 import random
-from psychopy import core, visual, data, event, monitors
+from psychopy import visual, data, event, monitors
 import math
 import numpy
 import serial
@@ -32,6 +32,13 @@ class MovingBar(protocol):
         self._angleOffset = 0.0 #deg - reassigned by the experiment in most cases
                 
         
+    def getMinimumFeatureSize(self, win):
+        '''
+        Returns the smallest dimension of the bar in pixels (see protocol.getMinimumFeatureSize)
+        '''
+        return min(self.barWidth, self.barHeight) * self.getPixPerDeg(win.monitor)
+        
+        
     def estimateTime(self):
         '''
         Estimate the total amount of time that this protocol will take to run
@@ -99,17 +106,17 @@ class MovingBar(protocol):
         self.createOrientationLog()
         
         
-        bar = visual.Rect(
-                win,
+        bar = self.getStimulus(
+                win, visual.Rect,
                 width = barWidthPix,
                 height = barHeightPix,
                 fillColor = self.barColor,
                 )
         
+        self.warmUp(win, bar) #draw once before the first epoch so that the first frames are not dropped
         totalEpochs = len(self._orientationLog)
         epochNum = 0
         
-        trialClock = core.Clock() #this will reset every trial
         for ori in self._orientationLog:
             
             epochNum += 1
@@ -117,6 +124,7 @@ class MovingBar(protocol):
             radiansOri = math.radians(ori)
             initialPosition = [-math.cos(radiansOri)*winRadius+winCenter[0], -math.sin(radiansOri)*winRadius+winCenter[1]]
             speedComponents = [math.cos(radiansOri)*pixPerFrame, math.sin(radiansOri)*pixPerFrame];
+            barPositions = numpy.array(initialPosition) + numpy.outer(numpy.arange(1, self._stimTimeNumFrames+1), speedComponents) #position of the bar on each frame of the stim time
             
             #move bar by the proper components given the current orientation
             bar.opacity = 0
@@ -133,40 +141,42 @@ class MovingBar(protocol):
             #pause for inter stimulus interval
             win.color = self.backgroundColor
             for f in range(self._interStimulusIntervalNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                     return
                 
             
-            self._stimulusStartLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochStart()
+            self.sendTTLOnFlip(win)
             self._numberOfEpochsStarted += 1
             #pretime... nothing happens
             for f in range(self._preTimeNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                     return
             
             #move the bar during the stim time
             bar.opacity = 1
-            for f in range(self._stimTimeNumFrames):
-                bar.pos += speedComponents
+            f = 0
+            while f < self._stimTimeNumFrames:
+                bar.pos = barPositions[f]
                 bar.draw()
-                win.flip()
+                flipTime = self.flip(win)
                 if self.checkQuitOrPause():
                     return
+                f = self.getNextFrameIndex(f, flipTime, epochNum)
                     
             #remove bar at the end of the stimulus and wait the post time
             bar.opacity = 0
             for f in range(self._tailTimeNumFrames):
-                win.flip()
+                self.flip(win)
                 if self.checkQuitOrPause():
                     return
                 
         
             
-            self._stimulusEndLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochEnd()
+            self.sendTTLOnFlip(win)
             
             
             self._numberOfEpochsCompleted += 1
@@ -11,7 +11,7 @@ oscillationPeriod is the amount of time it takes to complete one full oscillatio
 """
 
 from protocols.protocol import protocol
-from psychopy import core, visual, data, event, monitors
+from psychopy import visual, data, event, monitors
 import math, random
 import serial
 import numpy as np
@@ -39,6 +39,9 @@ class OscillatingGrating(protocol):
         
     
    
+    getMinimumFeatureSize = protocol.getGratingFeatureSize #see protocol.getMinimumFeatureSize
+    
+    
     def estimateTime(self):
         '''
         Estimate the total amount of time that this protocol will take to run
@@ -76,6 +79,8 @@ class OscillatingGrating(protocol):
     def determineVelocityByFrame(self, pixPerDeg):
         '''
         Determine the phase shift to move the grating on each frame
+        
+        returns: numpy array of velocities (pixels per frame) for one full oscillation cycle
         '''
         self._oscillationFrequency = 1/self.oscillationPeriod
         
@@ -92,10 +97,8 @@ class OscillatingGrating(protocol):
             self.oscillationPhaseShift = abs(math.degrees(math.asin(math.sin(math.radians(self.oscillationPhaseShift)))))
             print('oscillationPhaseShift parameter not within bounds, correcting to ', self.oscillationPhaseShift, 'degrees')
             
-        def velocityOnFrameN(frameNum, A = A, framesPerCycle = framesPerCycle, phaseShift = self.oscillationPhaseShift):
-            return A*math.sin(2*frameNum*math.pi/framesPerCycle + math.radians(phaseShift)) 
-        
-        velocity_pixPerFrame = [velocityOnFrameN(f) for f in range(framesPerCycle)]
+        frameNums = np.arange(framesPerCycle)
+        velocity_pixPerFrame = A*np.sin(2*frameNums*np.pi/framesPerCycle + math.radians(self.oscillationPhaseShift))
         return velocity_pixPerFrame 
     
       
@@ -124,9 +127,9 @@ class OscillatingGrating(protocol):
         
         spatialFrequencyCyclesPerPixel = self.spatialFrequency * (1/pixPerDeg)
         
-        grating = visual.GratingStim(
-            win,
-            size = (win.size[0]*2, win.size[1]*2),
+        grating = self.getStimulus(
+            win, visual.GratingStim,
+            size = self.getCoverSize(win, 0), #resized for each orientation below
             ori = 0, #self.gratingOrientation + 180 - self._angleOffset,
             sf = (spatialFrequencyCyclesPerPixel, None),
             tex = self.gratingTexture,
@@ -135,36 +138,28 @@ class OscillatingGrating(protocol):
             )
         
         
-        #The cover rectangle is drawn on top of the primary grating. It is used
-        #to change the mean intensity of the grating when the user desires. 
-        #If the mean intensity is set to 0, then the cover rectangle is still
-        #drawn but with an opacity of 0
-        coverRectangle = visual.Rect(
-            win,
-            size = (win.size[0]*2, win.size[1]*2),
-            opacity = 0
-            )
-        
-        if self.meanIntensity > 0:
-            coverRectangle.fillColor = [1, 1, 1]
-            coverRectangle.opacity = self.meanIntensity
-        elif self.meanIntensity < 0:
-            coverRectangle.fillColor = [-1, -1, -1]
-            coverRectangle.opacity = -1*self.meanIntensity
+        meanIntensityColor = self.applyMeanIntensity(grating) #mean intensity is applied in the same pass (see protocol.applyMeanIntensity)
             
             
         self.createOrientationLog()
         pixPerFrame = self.determineVelocityByFrame(pixPerDeg)
-        cyclesPerFrame = [speed*spatialFrequencyCyclesPerPixel for speed in pixPerFrame] #the number of cycles to move per frame
-        #number of cycles to shift the grating by on each frame. In other words phase += numCyclesToShift for each frame
-        self._numCyclesToShiftByFrame = [cyclesPerFrame[f%len(cyclesPerFrame)] for f in range(self._stimTimeNumFrames)]
+        cyclesPerFrame = pixPerFrame*spatialFrequencyCyclesPerPixel #the number of cycles to move per frame
+        #number of cycles to shift the grating by on each frame (the velocity profile repeats every oscillation cycle)
+        numCyclesToShiftByFrame = cyclesPerFrame[np.arange(self._stimTimeNumFrames) % len(cyclesPerFrame)]
+        self._numCyclesToShiftByFrame = numCyclesToShiftByFrame.tolist()
         
+        #absolute phase of the grating on each frame of each epoch (saved as a list for analysis)
+        phaseLog = self.createPhaseLog(numCyclesToShiftByFrame, len(self._orientationLog), self._stimTimeNumFrames)
+        self._phaseLog = phaseLog.tolist()
+        
+        self.warmUp(win, grating) #draw once before the first epoch so that the first frames are not dropped
         epochNum = 0
-        trialClock = core.Clock() #this will reset every trial
         for ori in self._orientationLog:
             epochNum += 1
+            epochPhase = phaseLog[epochNum-1]
             
             grating.ori = -ori - self._angleOffset
+            grating.size = self.getCoverSize(win, grating.ori) #smallest grating that covers the window at this orientation
             
             #show information if necessary
             if self._informationWin[0]:
@@ -172,44 +167,38 @@ class OscillatingGrating(protocol):
             
             #pause for inter stimulus interval
             win.color = self.backgroundColor
-            for f in range(self._interStimulusIntervalNumFrames):
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._interStimulusIntervalNumFrames):
+                return
                     
             #pretime... stationary grating
-            self._stimulusStartLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochStart()
+            self.sendTTLOnFlip(win)
             self._numberOfEpochsStarted += 1
-            for f in range(self._preTimeNumFrames):
-                grating.draw()
-                coverRectangle.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            self.setWindowColor(win, meanIntensityColor)
+            grating.phase = epochPhase[0]
+            if self.flipStaticFrames(win, self._preTimeNumFrames, grating):
+                return
             
             #stim time - flash
-            for f in range(self._stimTimeNumFrames):
-                grating.phase += self._numCyclesToShiftByFrame[f]
+            f = 0
+            while f < self._stimTimeNumFrames:
+                grating.phase = epochPhase[f+1]
                 grating.draw()
-                coverRectangle.draw()
-                win.flip()
+                flipTime = self.flip(win)
                 if self.checkQuitOrPause():
                     return
+                f = self.getNextFrameIndex(f, flipTime, epochNum)
+            grating.phase = epochPhase[-1] #make sure the pattern ends where it should, even if the last frames were skipped
             
             #tail time
-            win.color = self.backgroundColor
-            for f in range(self._tailTimeNumFrames):
-                grating.draw()
-                coverRectangle.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._tailTimeNumFrames, grating):
+                return
         
             
-            self._stimulusEndLog.append(trialClock.getTime())
-            self.sendTTL()
-            win.flip();win.flip() #two flips in to allow for a pause for TTL writing
+            self.setWindowColor(win, self.backgroundColor)
+            self.markEpochEnd()
+            self.sendTTLOnFlip(win)
+            self.flip(win);self.flip(win) #two flips in to allow for a pause for TTL writing
             
             self._numberOfEpochsCompleted += 1
                 
@@ -6,7 +6,7 @@ Created on Fri Jul 16 12:43:47 2021
 """
 
 from protocols.protocol import protocol
-from psychopy import core, visual,data, event, monitors
+from psychopy import visual, data, event, monitors
 import numpy
 import serial
 
@@ -55,7 +55,6 @@ class Pause(protocol):
             event.waitKeys() #wait for key press  
         
         
-        trialClock = core.Clock() #initiate clock
         
         #show information if necessary
         if self._informationWin[0]:
@@ -66,30 +65,30 @@ class Pause(protocol):
 
                 
         #pretime... nothing happens
-        self._stimulusStartLog.append(trialClock.getTime())
-        self.sendTTL()
+        self.markEpochStart()
+        self.sendTTLOnFlip(win)
         self._numberOfEpochsStarted += 1
         for f in range(self._preTimeNumFrames):
-            win.flip()
+            self.flip(win)
             if self.checkQuitOrPause():
                 return
         
         #stim time
         for f in range(self._stimTimeNumFrames):
-            win.flip()
+            self.flip(win)
             if self.checkQuitOrPause():
                 return
         
         #tail time
         win.color = self.backgroundColor
         for f in range(self._tailTimeNumFrames):
-            win.flip()
+            self.flip(win)
             if self.checkQuitOrPause():
                 return
     
         
-        self._stimulusEndLog.append(trialClock.getTime())
-        self.sendTTL()
+        self.markEpochEnd()
+        self.sendTTLOnFlip(win)
         
         self._numberOfEpochsCompleted += 1
             
@@ -5,7 +5,7 @@ Created on Mon Aug  2 15:46:55 2021
 @author: mrsco
 """
 from protocols.protocol import protocol
-from psychopy import core, visual, data, event, monitors
+from psychopy import visual, data, event, monitors
 import serial, random, numpy, time
 
 class PupilCalibration(protocol):
@@ -65,6 +65,23 @@ class PupilCalibration(protocol):
             self._lightLevelLog += random.sample(lightLevels, len(lightLevels))
             
     
+    def markSnap(self, win):
+        '''
+        Marks a camera snap with a TTL that is on for 0.5 seconds. In Photodiode mode the window is flipped after each change of the sync patch, otherwise the patch would turn on and off again before a frame showed it
+        '''
+        if self.writeTTL == 'Photodiode':
+            self.sendTTLOnFlip(win)
+            self.flip(win)
+            time.sleep(0.5)
+            self.sendTTLOnFlip(win)
+            self.flip(win)
+            return
+
+        self.sendTTL()
+        time.sleep(0.5)
+        self.sendTTL()
+
+
     def run(self, win, informationWin):
         '''
         Executes the PupilCalibration stimulus
@@ -86,13 +103,12 @@ class PupilCalibration(protocol):
 
         totalEpochs = len(self._lightLevelLog)
         epochNum = 0
-        trialClock = core.Clock() #this will reset every trial
         
         for level in self._lightLevelLog:
             win.color = [level, level, level];
             epochNum += 1
-            win.flip()
-            win.flip()
+            self.flip(win)
+            self.flip(win)
 
             #LEFT SIDE SNAP FIRST
             if self._informationWin[0]:
@@ -100,12 +116,10 @@ class PupilCalibration(protocol):
                                           '\n Epoch ' + str(epochNum) + ' of ' + str(totalEpochs))
             
             self._numberOfEpochsStarted += 1
-            self._stimulusStartLog.append(trialClock.getTime())
+            self._stimulusStartLog.append(self.getTime())
             
             event.waitKeys() #wait for key press to signal moving on to the next epoch
-            self.sendTTL() #mark left side snap
-            time.sleep(0.5)
-            self.sendTTL()
+            self.markSnap(win) #mark left side snap
             self.checkQuitOrPause()
             
             #RIGHT SIDE SNAP SECOND
@@ -115,26 +129,20 @@ class PupilCalibration(protocol):
            
 
             event.waitKeys() #wait for key press to signal moving on to the next epoch
-            self.sendTTL() #mark right side snap
-            time.sleep(0.5)
-            self.sendTTL()
+            self.markSnap(win) #mark right side snap
             
             self.checkQuitOrPause()
-            self._stimulusEndLog.append(trialClock.getTime())
+            self._stimulusEndLog.append(self.getTime())
             self._numberOfEpochsCompleted += 1
                 
         
         #mark primary and secondary LEDs
         self.showInformationText(win, 'ALMOST DONE \n Move the camera to the RECORDING POSITION and turn on the TOP LED, then press enter')
         event.waitKeys() #wait for key press to signal moving on to the next epoch
-        self.sendTTL() #mark right side snap
-        time.sleep(0.5)
-        self.sendTTL()
+        self.markSnap(win) #mark right side snap
         
         self.showInformationText(win, 'ALMOST DONE \n Move the camera to the RECORDING POSITION and turn on the SIDE LED, then press enter')
         event.waitKeys() #wait for key press to signal moving on to the next epoch
-        self.sendTTL() #mark right side snap
-        time.sleep(0.5)
-        self.sendTTL()
+        self.markSnap(win) #mark right side snap
             
         self._completed = 1
\ No newline at end of file
@@ -7,11 +7,14 @@ Grating moves across the screen as an overlaid scotoma mask changes density
 @author: mrsco
 """
 from protocols.protocol import protocol
-from psychopy import core, visual, data, event, monitors
+from experiments.scotomaTexture import scotomaTexture
+from psychopy import visual, data, event, monitors
 import serial, random, math
 import numpy as np
 
 class ScotomaMovingGrating(protocol):
+    prepareParameters = protocol.prepareParameters + ['randomSeed', 'stimulusReps', 'orientations', 'spatialFrequency', 'speed', 'scotomaSize', 'scotomaStartFraction', 'scotomaEndFraction', 'scotomaGrowth', 'scotomaGrowthTime', 'scotomaBookendTime', 'scotomaReverse'] #see protocol.prepareParameters
+
     def __init__(self):
         super().__init__()
         self.protocolName = 'ScotomaMovingGrating' #in the Scotoma Moving Grating stimulus, there is a drifting grating pattern that is progressively covered by a grid of "scotomas" (overlaid on top of the grating). The stimulus consists of up to 7 segments:   1) pretime: the grating is visible and static, with the initial scotoma density overlaid (defined by the scotoma start fraction),   2) bookend 1: the grating starts to move, but the scotomas do not change (again, the initial scotoma density is overlaid, but it is static),   3) growth/decay period 1: the grating continues to move, and the scotomas start to dynamically change in number from their start fraction to their end fraction (if scotomaReverse is set to False, skip ahead to segment 6),   4) bookend 2 (occurs only when scotomaReverse is set to True): the scotomas have reached their end fraction and are now static again while the grating continues to move,    5) growth/decay period 2 (occurs only when scotomaReverse is set to True): the scotomas start to dynamically change again, this time going from the end fraction to the start fraction value,   6) bookend 3: the scotomas now stop changing again, but the grating continues to move,   7) tailtime: the grating is visible and static, with the final scotoma density overlaid (final scotoma densitiy is equal to the scotomaEndFraction if scotomaReverse is False and the scotomaStartFraction if scotomaReverse is True).      The scotoma start fraction can be less than or greater than the end fraction. If if it is less than the end fraction, then scotomas will start out by appearing on the screen. If it is greater than the end fraction, then scotomas will start out by disappearing on the screen. The order of scotoma appearance is pseudorandom. You visualize this stimulus by following this link, where the start fraction is 0, then end fraction is 1, and scotomaReverse is set to True: https://youtu.be/9pvIeY91nvk
@@ -36,6 +39,7 @@ class ScotomaMovingGrating(protocol):
         self.scotomaGrowth = 'lin' #Sets the pattern of scotoma growth. Currently only 'lin' is supported for linear growth
         self.scotomaSize = 0.67 #degrees - The size of the scotomas (height and width). Scotomas will be square, such that height == width
         self.scotomaColor = [0.0, 0.0, 0.0] #The color of the scotomas (in RGB).-1.0 equates to 0 and 1.0 equates to 255 for 8 bit colors.
+        self.scotomaRenderMode = 'elements' #How the scotomas are drawn. 'elements' draws one element per scotoma. 'texture' draws all of the scotomas as a single low resolution texture (one texel per scotoma), which is much faster for small scotomas or large screens.
         
         self.stimulusReps = 3 #number of repetitions of the stimulus. The total number of epochs is equal to the number of orientations times the number of stimulus reps.
         self.preTime = 20.0 #seconds - the number of seconds before the first bookend, when the grating starts moving. During this time, a static grating with the scotoma start fraction of scotomas overlaid appears on the screen.
@@ -73,8 +77,12 @@ class ScotomaMovingGrating(protocol):
             self.stimTime = 0
             print('\nNOTE: Stim Time was reset to 0. It will be updated on the fly during run time. Users should not manually change this parameter for the Scotoma Moving Grating stimulus.')
             
-        if self.scotomaSize < 0.5:
-            print('\nNOTE: Scotoma Size is small. This may slow down the frame rate. If this occurs, increase scotoma size to improve the frame rate')
+        if self.scotomaRenderMode not in ['elements', 'texture']:
+            tf = False
+            errorMessage.append('Scotoma Render Mode must be either "elements" or "texture".')
+            
+        if self.scotomaSize < 0.5 and self.scotomaRenderMode == 'elements':
+            print('\nNOTE: Scotoma Size is small. This may slow down the frame rate. If this occurs, set scotomaRenderMode to "texture" or increase scotoma size to improve the frame rate')
         
         
         tf, colorErrorMessages = self.validateColorInput()
@@ -83,6 +91,15 @@ class ScotomaMovingGrating(protocol):
         return tf, errorMessage
 
 
+    def getMinimumFeatureSize(self, win):
+        '''
+        The smallest feature is either half of one grating cycle or one scotoma. Returns its size in pixels (see protocol.getMinimumFeatureSize)
+        '''
+        scotomaSizePix = self.scotomaSize * self.getPixPerDeg(win.monitor)
+        halfCycle = self.getGratingFeatureSize(win)
+        return scotomaSizePix if halfCycle is None else min(halfCycle, scotomaSizePix)
+
+
     def estimateTime(self):
         '''
         Estimate the total amount of time that this protocol will take to run
@@ -124,47 +141,131 @@ class ScotomaMovingGrating(protocol):
         return
     
     
-    def createScotomaGrowthSequence(self, numScotomasToAdd, numTotalScotomas, scotomaIndices):
+    def createScotomaGrowthSequence(self, numScotomasStart, numScotomasEnd, numTotalScotomas):
         '''
-        Builds a sequence of scotoma indices to add or remove from the mask
+        Builds the schedule of scotoma changes for one growth/decay period
+        
+        The schedule is a pseudorandom permutation of all scotoma indices plus the number of visible scotomas on each frame. At any point in time, the first n indices of the permutation are visible and all others are transparent, so the mask on every frame can be reconstructed from self._scotomaPermutation and self._scotomaCountByFrame. The reverse growth/decay period walks back through the same counts.
         
         Inputs:
-            - numScotomasToAdd: the total number of scotomas you need to add by the end of the growth sequence. Can be a positive or negative integer. If this number is negative, you'll be taking away scotomas from the mask rather than adding them
-            - scotomaIndices: list 1d indices where scotomas have already been filled
+            - numScotomasStart: number of scotomas visible at the start of the growth/decay period
+            - numScotomasEnd: number of scotomas visible at the end of the growth/decay period. Can be less than numScotomasStart, in which case scotomas are taken away
+            - numTotalScotomas: total number of scotoma locations
             
         Returns:
-            - no explicit returns, but creates variables self._newScotomasPerFrame (number of new scotomas to add on each frame) and self._scotomaSequence (list of indices that indicate where to add or take away scotomas in sequence)
+            - permutation: numpy array, pseudorandom order of all scotoma indices
+            - countByFrame: numpy array of length self._numFramesGrowth+1. Entry 0 is numScotomasStart and entry f+1 is the number of visible scotomas on growth frame f
+            - also creates self._scotomaPermutation and self._scotomaCountByFrame (lists of the above for saving), self._newScotomasPerFrame (number of scotomas added or taken away on each frame) and self._scotomaSequence (list of indices in the order that they are added or taken away)
         '''
+        permutation = self.getRandomGenerator().permutation(numTotalScotomas)
         
         if self.scotomaGrowth == 'lin':
-            #First figure out an integer number of scotomas to add on each frame. Consider that you need to add an integer number on each frame, and the frame rate may not divide the growth rate evenly
-            meanScotomasAddedPerFrame = numScotomasToAdd / self._numFramesGrowth
-            cumulativeScotomasAdded = np.round(np.cumsum([meanScotomasAddedPerFrame for f in range(self._numFramesGrowth)]))
-            self._newScotomasPerFrame = np.diff(cumulativeScotomasAdded) #new scotomas per frame is the number of new additions to make on every sequential frame.
-            self._newScotomasPerFrame = [int(el) for el in self._newScotomasPerFrame] #convert to list of integers
-            self._newScotomasPerFrame = [round(meanScotomasAddedPerFrame)] + self._newScotomasPerFrame
+            #integer number of visible scotomas on each frame. The frame rate may not divide the growth rate evenly, so the counts are rounded
+            frameFraction = np.arange(self._numFramesGrowth+1) / max(self._numFramesGrowth, 1)
+            countByFrame = numScotomasStart + np.round(frameFraction * (numScotomasEnd - numScotomasStart)).astype(int)
             
-        elif self.scotomaGrowth == 'exp':
-            #   --- enter code here for exponential growth pattern --- #
-            pass
+        #   --- enter code here for other growth patterns (e.g. exponential) --- #
+        
+        self._scotomaPermutation = permutation.tolist() #make it a list b/c ndarrays have trouble saving
+        self._scotomaCountByFrame = countByFrame.tolist()
+        self._newScotomasPerFrame = np.diff(countByFrame).tolist() #negative values mean that scotomas are taken away
+        
+        if numScotomasEnd >= numScotomasStart:
+            self._scotomaSequence = permutation[numScotomasStart:numScotomasEnd].tolist()
+        else:
+            self._scotomaSequence = permutation[numScotomasEnd:numScotomasStart][::-1].tolist() #scotomas are taken away from the end of the visible part of the permutation
+        
+        return permutation, countByFrame
+    
+    def setScotomaCount(self, scotomaMask, mask, maskTexture, permutation, currentCount, newCount):
+        '''
+        Updates the mask so that only the first newCount scotomas of the permutation are visible
+        
+        Only the scotomas between currentCount and newCount are changed. Skipped frames are handled automatically because the change is always relative to the current state of the mask.
+        
+        returns: newCount (the new current count)
+        '''
+        if newCount > currentCount:
+            self.setScotomaOpacities(scotomaMask, mask, maskTexture, permutation[currentCount:newCount], self.scotomaOpacity)
+        elif newCount < currentCount:
+            self.setScotomaOpacities(scotomaMask, mask, maskTexture, permutation[newCount:currentCount], 0)
             
-        #if adding scotomas:
-        if numScotomasToAdd > 0:
-            noScotomaIndices = list(set([i for i in range(numTotalScotomas)]) - set(scotomaIndices))
-            self._scotomaSequence = np.array(random.sample(noScotomaIndices, numScotomasToAdd)) 
-
-        #if subtracting scotomas:
-        if numScotomasToAdd < 0:
-            self._scotomaSequence = np.array(random.sample(scotomaIndices, -numScotomasToAdd))
-            self._newScotomasPerFrame = [-x for x in self._newScotomasPerFrame]
+        return newCount
+            
+    def setScotomaOpacities(self, scotomaMask, mask, maskTexture, scotomaIndices, opacity):
+        '''
+        Sets the opacity of a group of scotomas and updates the stimulus that draws them
+        
+        Inputs:
+            - scotomaMask: the psychopy stimulus that draws the scotomas (an ElementArrayStim or, in texture mode, an ImageStim)
+            - mask: numpy array of the opacity of every scotoma, updated in place
+            - maskTexture: scotomaTexture that draws the scotomas (see experiments/scotomaTexture.py). None unless scotomaRenderMode is 'texture'
+            - scotomaIndices: 1d indices (into self._scotomaCoordinates) of the scotomas to change
+            - opacity: the new opacity of those scotomas
+        '''
+        mask[scotomaIndices] = opacity
+        
+        if maskTexture is None:
+            scotomaMask.opacities = mask
+        else:
+            maskTexture.setOpacities(scotomaIndices, opacity) #only the changed rows of texels are uploaded
+        
 
-        if numScotomasToAdd == 0:
-            self._scotomaSequence = np.array([0])
+    def setFrameRate(self, FR):
+        '''
+        Updates the stim time from the scotoma bookend and growth times, then calculates the number of frames for each segment of the stimulus (see protocol.setFrameRate)
+        '''
+        if self.scotomaReverse:
+            self.stimTime = 3*self.scotomaBookendTime + 2*self.scotomaGrowthTime
+        else:
+            self.stimTime = 2*self.scotomaBookendTime + self.scotomaGrowthTime
+            
+        super().setFrameRate(FR)
         
-        self._scotomaSequence = self._scotomaSequence.tolist() # make it a list b/c ndarrays have trouble saving
+    def prepare(self, geometry, FR):
+        '''
+        Creates the grid of scotomas, the scotoma growth sequence, the orientation log and the phase log (see protocol.prepare)
+        '''
+        pixPerDeg = geometry['pixPerDeg']
+        winWidthPix, winHeightPix = geometry['size']
+
+        self._scotomaSizePix = int(self.scotomaSize*pixPerDeg) #maybe a slight rounding error here by using int
+        scotomaSizePix = self._scotomaSizePix
         
-        return
+        #specify the x and y center coordinates for each check
+        self._scotomaXCoordinates = [x - winWidthPix/2 for x in range(-scotomaSizePix, winWidthPix+scotomaSizePix, scotomaSizePix)]
+        self._scotomaYCoordinates = [y - winHeightPix/2 for y in range(-scotomaSizePix, winHeightPix+scotomaSizePix, scotomaSizePix)]
+        numTotalScotomas = len(self._scotomaXCoordinates) * len(self._scotomaYCoordinates)
+       
+        self._scotomaCoordinates = []
+        for x in self._scotomaXCoordinates:
+            for y in self._scotomaYCoordinates:
+                self._scotomaCoordinates.append([x, y])
+    
+        numScotomasStart = round(numTotalScotomas*self.scotomaStartFraction)
+        numScotomasEnd = round(numTotalScotomas*self.scotomaEndFraction)
             
+        self._numFramesGrowth = round(self._FR * self.scotomaGrowthTime) #number of frames overwhich the scotoma will grow
+        self._actualScotomaGrowthTime = self._numFramesGrowth * 1/self._FR
+        
+        self._numFramesBookend = round(self._FR * self.scotomaBookendTime)
+        self._actualBookendTime = self._numFramesBookend * 1/self._FR
+        
+        #Now build up the number of visible scotomas on each frame of the growth period
+        self.createScotomaGrowthSequence(numScotomasStart, numScotomasEnd, numTotalScotomas)
+
+        self._numCyclesToShiftByFrame = self.speed*self.spatialFrequency*(1/self._FR)
+
+        self.createOrientationLog()
+        
+        #absolute phase of the grating on each moving frame (all bookends and growth periods) of each epoch (saved as a list for analysis)
+        if self.scotomaReverse:
+            numMovingFrames = 3*self._numFramesBookend + 2*self._numFramesGrowth
+        else:
+            numMovingFrames = 2*self._numFramesBookend + self._numFramesGrowth
+        self._phaseLog = self.createPhaseLog(self._numCyclesToShiftByFrame, len(self._orientationLog), numMovingFrames).tolist()
+        
+        
     def run(self, win, informationWin):
         '''
         Executes the ScotomaMovingGrating stimulus
@@ -174,13 +275,8 @@ class ScotomaMovingGrating(protocol):
 
         self._informationWin = informationWin #tuple, save here so you don't have to pass this as a function parameter every time you use it
         
-        #update the stim time
-        if self.scotomaReverse:
-            self.stimTime = 3*self.scotomaBookendTime + 2*self.scotomaGrowthTime
-        else:
-            self.stimTime = 2*self.scotomaBookendTime + self.scotomaGrowthTime
-            
         self.getFR(win)
+        self.ensurePrepared(win) #creates the scotoma grid, growth sequence and phase log unless they were prepared ahead of time
         self._interStimulusIntervalNumFrames = round(self._FR * self.interStimulusInterval)
         self._actualInterStimulusInterval = self._interStimulusIntervalNumFrames * 1/self._FR
 
@@ -194,9 +290,9 @@ class ScotomaMovingGrating(protocol):
 
         spatialFrequencyCyclesPerPixel = self.spatialFrequency * (1/pixPerDeg)
 
-        grating = visual.GratingStim(
-            win,
-            size = (win.size[0]*2, win.size[1]*2),
+        grating = self.getStimulus(
+            win, visual.GratingStim,
+            size = self.getCoverSize(win, 0), #resized for each orientation below
             sf = (spatialFrequencyCyclesPerPixel, None),
             tex = self.gratingTexture,
             contrast = self.gratingContrast,
@@ -204,93 +300,61 @@ class ScotomaMovingGrating(protocol):
             )
         
         #create the mask
-        winWidthPix = win.size[0]
-        winHeightPix = win.size[1]
-
-        scotomaSizePix = int(self.scotomaSize*pixPerDeg) #maybe a slight rounding error here by using int
-        
-        #specify the x and y center coordinates for each check
-        xCoordinates = [x - win.size[0]/2 for x in range(-scotomaSizePix, win.size[0]+scotomaSizePix, scotomaSizePix)]
-        yCoordinates = [y - win.size[1]/2 for y in range(-scotomaSizePix, win.size[1]+scotomaSizePix, scotomaSizePix)]
-        numTotalScotomas = len(xCoordinates) * len(yCoordinates)
+        xCoordinates = self._scotomaXCoordinates
+        yCoordinates = self._scotomaYCoordinates
+        scotomaSizePix = self._scotomaSizePix
+        numTotalScotomas = len(self._scotomaCoordinates)
         sizes = [(scotomaSizePix, scotomaSizePix) for i in range(numTotalScotomas)]
-       
-        self._scotomaCoordinates = []
-        colors = []
-        for i in range(len(xCoordinates)):
-            for j in range(len(yCoordinates)):
-                self._scotomaCoordinates.append([xCoordinates[i], yCoordinates[j]])
                 
-        scotomaMask = visual.ElementArrayStim(
-            win,
-            nElements = numTotalScotomas,
-            elementMask="None",
-            elementTex = None,
-            xys = self._scotomaCoordinates,
-            sizes = sizes,
-            colors = self.scotomaColor
-            )
-        
-        random.seed(self.randomSeed) #reinitialize the random seed
+        if self.scotomaRenderMode == 'texture':
+            #a single quad covering the whole grid of scotomas with one texel per scotoma (see experiments/scotomaTexture.py)
+            maskTexture = scotomaTexture(xCoordinates, yCoordinates, scotomaSizePix) #starts fully transparent
+            scotomaMask = self.getStimulus(
+                win, visual.ImageStim,
+                image = np.ones(maskTexture.textureShape + (3,)) * self.scotomaColor,
+                size = maskTexture.size,
+                pos = maskTexture.pos,
+                interpolate = False #nearest neighbor sampling so that each texel is drawn as a sharp, square scotoma
+                )
+            maskTexture.attach(scotomaMask)
+        else:
+            maskTexture = None
+            scotomaMask = self.getStimulus(
+                win, visual.ElementArrayStim,
+                nElements = numTotalScotomas,
+                elementMask="None",
+                elementTex = None,
+                xys = self._scotomaCoordinates,
+                sizes = sizes,
+                colors = self.scotomaColor
+                )
         
         mask = np.zeros((numTotalScotomas, 1)) #1 is fully transparent, -1 is fully opaque. Start with a fully transparent mask.
+        visibleCount = 0 #number of scotomas (from the start of the permutation) that are currently visible
+        self.setScotomaOpacities(scotomaMask, mask, maskTexture, [], 0) #apply the transparent mask to the stimulus
     
-        #fill the mask with the number of scotomas needed at the start of the stimulus
         numScotomasStart = round(numTotalScotomas*self.scotomaStartFraction)
-        scotomaIndices = random.sample([i for i in range(numTotalScotomas)], numScotomasStart)
-        mask[scotomaIndices] = self.scotomaOpacity
-            
-        scotomaMask.opacities = mask #set the first mask
-        
-        
-        #Now build up a list of which mask locations you want to update on each frame 
-        numScotomasEnd = round(numTotalScotomas*self.scotomaEndFraction)
-        numScotomasToAdd = numScotomasEnd - numScotomasStart #note, this value can be positive or negative.
-            
-        self._numFramesGrowth = round(self._FR * self.scotomaGrowthTime) #number of frames overwhich the scotoma will grow
-        self._actualScotomaGrowthTime = self._numFramesGrowth * 1/self._FR
-        
-        self._numFramesBookend = round(self._FR * self.scotomaBookendTime)
-        self._actualBookendTime = self._numFramesBookend * 1/self._FR
+        permutation = np.asarray(self._scotomaPermutation)
+        countByFrame = np.asarray(self._scotomaCountByFrame)
         
-        #create self._scotomaSequence and self._newScotomasPerFrame
-        self.createScotomaGrowthSequence(numScotomasToAdd, numTotalScotomas, scotomaIndices)
-            
-        #create flipped copies of self._scotomaSequence and self._newScotomasPerFrame if you will also be doing a reversel
+        #the reverse growth period walks back through the same counts (this is a view, not a copy)
         if self.scotomaReverse:
-            scotomaSequenceReverse = np.flip(self._scotomaSequence)
-            newScotomasPerFrameReverse = np.flip(self._newScotomasPerFrame)
-        
-        #The cover rectangle is drawn on top of the primary grating. It is used
-        #to change the mean intensity of the grating when the user desires.
-        #If the mean intensity is set to 0, then the cover rectangle is still
-        #drawn but with an opacity of 0
-        coverRectangle = visual.Rect(
-            win,
-            size = (win.size[0]*2, win.size[1]*2),
-            opacity = 0
-            )
-
-        if self.meanIntensity > 0:
-            coverRectangle.fillColor = [1, 1, 1]
-            coverRectangle.opacity = self.meanIntensity
-        elif self.meanIntensity < 0:
-            coverRectangle.fillColor = [-1, -1, -1]
-            coverRectangle.opacity = -1*self.meanIntensity
-
-        self._numCyclesToShiftByFrame = self.speed*self.spatialFrequency*(1/self._FR)
-
-        self.createOrientationLog()
+            countByFrameReverse = countByFrame[::-1]
         
+        meanIntensityColor = self.applyMeanIntensity(grating) #mean intensity is applied in the same pass (see protocol.applyMeanIntensity)
+
+        phaseLog = np.asarray(self._phaseLog)
         
+        self.warmUp(win, grating, scotomaMask) #draw once before the first epoch so that the first frames are not dropped
         totalEpochs = len(self._orientationLog)
         epochNum = 0
-        trialClock = core.Clock() #this will reset every trial
                 
         #stimulus loop
         for ori in self._orientationLog:
             grating.ori = -ori - self._angleOffset #flip for coordinate convention: 0 = east, 90 = north, 180 = west, 270 = south
+            grating.size = self.getCoverSize(win, grating.ori) #smallest grating that covers the window at this orientation
             epochNum += 1
+            epochPhase = phaseLog[epochNum-1]
             #show information if necessary
             if self._informationWin[0]:
                 self.showInformationText(win, 'Running Scotoma Moving Grating. Current orientation = ' + \
@@ -299,111 +363,100 @@ class ScotomaMovingGrating(protocol):
 
             #pause for inter stimulus interval
             win.color = self.backgroundColor
-            for f in range(self._interStimulusIntervalNumFrames):
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._interStimulusIntervalNumFrames):
+                return
 
             #pretime... stationary grating
-            self._stimulusStartLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochStart()
+            self.sendTTLOnFlip(win)
             self._numberOfEpochsStarted += 1
-            for f in range(self._preTimeNumFrames):
-                grating.draw()
-                coverRectangle.draw()
-                scotomaMask.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            self.setWindowColor(win, meanIntensityColor)
+            grating.phase = epochPhase[0]
+            visibleCount = self.setScotomaCount(scotomaMask, mask, maskTexture, permutation, visibleCount, numScotomasStart) #every epoch starts with the scotoma start fraction
+            if self.flipStaticFrames(win, self._preTimeNumFrames, grating, scotomaMask):
+                return
 
             
             #stim time
+            #each segment of the stim time runs through getNextFrameIndex so that time-based animation can skip frames that were dropped.
+            #segmentStart keeps track of where each segment begins in the epoch's phase log
+            segmentStart = 0
             
             #bookend 1 (grating starts moving before scotomas are added)
-            for f in range(self._numFramesBookend):
-                grating.phase += self._numCyclesToShiftByFrame
+            f = 0
+            while f < self._numFramesBookend:
+                grating.phase = epochPhase[segmentStart + f + 1]
                 grating.draw()
-                coverRectangle.draw()
                 scotomaMask.draw()
-                win.flip()
+                flipTime = self.flip(win)
                 if self.checkQuitOrPause():
                     return
+                f = self.getNextFrameIndex(f, flipTime, epochNum)
+            segmentStart += self._numFramesBookend
             
-            #first check whether you will be adding or taking away scotomas. Assign the addColor accordingly so that when you update the mask it either places a scotoma or sets the value to transparent
-            if numScotomasToAdd > 0:
-                addColor = self.scotomaOpacity #scotoma color, used when adding scotomas
-            else:
-                addColor = 0 #transparent - used when taking away scotomas
-
-            #scotoma growth starts here
-            count = 0 
-            for f in range(self._numFramesGrowth):
-                scotomasToChangeThisFrame = self._scotomaSequence[count:count+self._newScotomasPerFrame[f]]
-                count += self._newScotomasPerFrame[f]
-                mask[scotomasToChangeThisFrame] = addColor
-                scotomaMask.opacities = mask
-                grating.phase += self._numCyclesToShiftByFrame
+            #scotoma growth starts here. The mask is brought up to the count for the current frame, which includes the changes of any skipped frames
+            f = 0
+            while f < self._numFramesGrowth:
+                visibleCount = self.setScotomaCount(scotomaMask, mask, maskTexture, permutation, visibleCount, countByFrame[f+1])
+                grating.phase = epochPhase[segmentStart + f + 1]
                 grating.draw()
-                coverRectangle.draw()
                 scotomaMask.draw()
-                win.flip()
+                flipTime = self.flip(win)
                 if self.checkQuitOrPause():
                     return
+                f = self.getNextFrameIndex(f, flipTime, epochNum)
+            visibleCount = self.setScotomaCount(scotomaMask, mask, maskTexture, permutation, visibleCount, countByFrame[-1]) #catch up on any changes from skipped frames at the end of the growth period
+            segmentStart += self._numFramesGrowth
             
             #middle bookend
             if self.scotomaReverse:
                 #pause time before reversal
-                for f in range(self._numFramesBookend):
-                    grating.phase += self._numCyclesToShiftByFrame
+                f = 0
+                while f < self._numFramesBookend:
+                    grating.phase = epochPhase[segmentStart + f + 1]
                     grating.draw()
-                    coverRectangle.draw()
                     scotomaMask.draw()
-                    win.flip()
+                    flipTime = self.flip(win)
                     if self.checkQuitOrPause():
                         return
+                    f = self.getNextFrameIndex(f, flipTime, epochNum)
+                segmentStart += self._numFramesBookend
                 
-                if numScotomasToAdd > 0:
-                    addColor = 0 #if you were originally adding scotomas, now you'll take them away
-                else:
-                    addColor = self.scotomaOpacity #if you were originally taking away scotomas, now you'll add them
-                #flip the scotoma sequence and scotomas to change this frame lists
-                count = 0
-                for f in range(self._numFramesGrowth):
-                    scotomasToChangeThisFrame = scotomaSequenceReverse[count:count+newScotomasPerFrameReverse[f]]
-                    count += newScotomasPerFrameReverse[f]
-                    mask[scotomasToChangeThisFrame] = addColor
-                    scotomaMask.opacities = mask
-                    grating.phase += self._numCyclesToShiftByFrame
+                #reverse growth, back to the start fraction
+                f = 0
+                while f < self._numFramesGrowth:
+                    visibleCount = self.setScotomaCount(scotomaMask, mask, maskTexture, permutation, visibleCount, countByFrameReverse[f+1])
+                    grating.phase = epochPhase[segmentStart + f + 1]
                     grating.draw()
-                    coverRectangle.draw()
                     scotomaMask.draw()
-                    win.flip()
+                    flipTime = self.flip(win)
                     if self.checkQuitOrPause():
                         return
+                    f = self.getNextFrameIndex(f, flipTime, epochNum)
+                visibleCount = self.setScotomaCount(scotomaMask, mask, maskTexture, permutation, visibleCount, countByFrameReverse[-1])
+                segmentStart += self._numFramesGrowth
                     
             #bookend 2
-            for f in range(self._numFramesBookend):
-                grating.phase += self._numCyclesToShiftByFrame
+            f = 0
+            while f < self._numFramesBookend:
+                grating.phase = epochPhase[segmentStart + f + 1]
                 grating.draw()
-                coverRectangle.draw()
                 scotomaMask.draw()
-                win.flip()
+                flipTime = self.flip(win)
                 if self.checkQuitOrPause():
                     return
+                f = self.getNextFrameIndex(f, flipTime, epochNum)
+            grating.phase = epochPhase[-1] #make sure the grating ends where it should, even if the last frames were skipped
 
             #tail time
-            for f in range(self._tailTimeNumFrames):
-                grating.draw()
-                coverRectangle.draw()
-                scotomaMask.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._tailTimeNumFrames, grating, scotomaMask):
+                return
 
 
-            self._stimulusEndLog.append(trialClock.getTime())
-            self.sendTTL()
-            win.flip();win.flip() #two flips to allow for a pause for TTL writing
+            self.setWindowColor(win, self.backgroundColor)
+            self.markEpochEnd()
+            self.sendTTLOnFlip(win)
+            self.flip(win);self.flip(win) #two flips to allow for a pause for TTL writing
 
             self._numberOfEpochsCompleted += 1
             
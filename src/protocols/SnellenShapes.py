@@ -12,7 +12,7 @@ Created on Mon Aug  2 15:46:55 2021
 @author: mrsco
 """
 from protocols.protocol import protocol
-from psychopy import core, visual, data, event, monitors
+from psychopy import visual, data, event, monitors
 import serial, random, numpy, time
 from psychopy.hardware import keyboard
 
@@ -101,8 +101,8 @@ class SnellenShapes(protocol):
         kb = keyboard.Keyboard()
         
         win.color = self.backgroundColor
-        win.flip()
-        win.flip()
+        self.flip(win)
+        self.flip(win)
         
         #initialize the circle
         optotypeCircle = visual.Circle(
@@ -126,7 +126,6 @@ class SnellenShapes(protocol):
         
         epochNum = 0
         testComplete = False
-        trialClock = core.Clock() #this will reset every trial
         nextOptotypeLevel = self.startingLevel
         
         while not testComplete:
@@ -143,7 +142,7 @@ class SnellenShapes(protocol):
                 optotypeSquare.height = currentRadius
                 optotypeSquare.draw()
                 
-            win.flip()
+            self.flip(win)
             keypress = kb.waitKeys(keyList = ['c', 's', 'q'])
             thisKey = keypress[0].name
             
@@ -15,7 +15,7 @@ Order is random.
 @author: mrsco
 """
 from protocols.protocol import protocol
-from psychopy import core, visual, data, event, monitors
+from psychopy import visual, data, event, monitors
 import serial, random, math
 
 class StaticGrating(protocol):
@@ -36,6 +36,9 @@ class StaticGrating(protocol):
         self.interStimulusInterval = 1.0 #seconds - the wait time between each epoch. The background color is displayed during this time
         self._angleOffset = 0.0 # reassigned by the experiment in most cases
 
+    getMinimumFeatureSize = protocol.getGratingFeatureSize #see protocol.getMinimumFeatureSize
+    
+    
     def estimateTime(self):
         '''
         Estimate the total amount of time that this protocol will take to run
@@ -95,9 +98,9 @@ class StaticGrating(protocol):
 
         spatialFrequencyCyclesPerPixel = self.spatialFrequency * (1/pixPerDeg)
 
-        grating = visual.GratingStim(
-            win,
-            size = (win.size[0]*2, win.size[1]*2),
+        grating = self.getStimulus(
+            win, visual.GratingStim,
+            size = self.getCoverSize(win, 0), #resized for each orientation below
             sf = (spatialFrequencyCyclesPerPixel, None),
             tex = self.gratingTexture,
             contrast = self.gratingContrast,
@@ -105,33 +108,19 @@ class StaticGrating(protocol):
             )
 
 
-        #The cover rectangle is drawn on top of the primary grating. It is used
-        #to change the mean intensity of the grating when the user desires.
-        #If the mean intensity is set to 0, then the cover rectangle is still
-        #drawn but with an opacity of 0
-        coverRectangle = visual.Rect(
-            win,
-            size = (win.size[0]*2, win.size[1]*2),
-            opacity = 0
-            )
-
-        if self.meanIntensity > 0:
-            coverRectangle.fillColor = [1, 1, 1]
-            coverRectangle.opacity = self.meanIntensity
-        elif self.meanIntensity < 0:
-            coverRectangle.fillColor = [-1, -1, -1]
-            coverRectangle.opacity = -1*self.meanIntensity
+        meanIntensityColor = self.applyMeanIntensity(grating) #mean intensity is applied in the same pass (see protocol.applyMeanIntensity)
 
 
         self.createOrientationLog()
 
+        self.warmUp(win, grating) #draw once before the first epoch so that the first frames are not dropped
         totalEpochs = len(self._orientationLog)
         epochNum = 0
-        trialClock = core.Clock() #this will reset every trial
 
         #stimulus loop
         for ori in self._orientationLog:
             grating.ori = -ori - self._angleOffset #flip for coordinate convention: 0 = east, 90 = north, 180 = west, 270 = south
+            grating.size = self.getCoverSize(win, grating.ori) #smallest grating that covers the window at this orientation
             epochNum += 1
             #show information if necessary
             if self._informationWin[0]:
@@ -141,42 +130,30 @@ class StaticGrating(protocol):
 
             #pause for inter stimulus interval
             win.color = self.backgroundColor
-            for f in range(self._interStimulusIntervalNumFrames):
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._interStimulusIntervalNumFrames):
+                return
 
             #pretime... stationary grating
-            self._stimulusStartLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochStart()
+            self.sendTTLOnFlip(win)
             self._numberOfEpochsStarted += 1
-            for f in range(self._preTimeNumFrames):
-                grating.draw()
-                coverRectangle.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            self.setWindowColor(win, meanIntensityColor)
+            if self.flipStaticFrames(win, self._preTimeNumFrames, grating):
+                return
 
             #stim time - flash
-            for f in range(self._stimTimeNumFrames):
-                grating.draw()
-                coverRectangle.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._stimTimeNumFrames, grating):
+                return
 
             #tail time
-            for f in range(self._tailTimeNumFrames):
-                grating.draw()
-                coverRectangle.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._tailTimeNumFrames, grating):
+                return
 
 
-            self._stimulusEndLog.append(trialClock.getTime())
-            self.sendTTL()
-            win.flip();win.flip() #two flips to allow for a pause for TTL writing
+            self.setWindowColor(win, self.backgroundColor)
+            self.markEpochEnd()
+            self.sendTTLOnFlip(win)
+            self.flip(win);self.flip(win) #two flips to allow for a pause for TTL writing
 
             self._numberOfEpochsCompleted += 1
 
@@ -18,13 +18,15 @@ oscillationPeriod is the amount of time it takes to complete one full oscillatio
 """
 
 from protocols.protocol import protocol
-from psychopy import core, visual, data, event, monitors
+from psychopy import visual, data, event, monitors
 import math, random
 import serial
 import numpy as np
 from functools import reduce
 
 class SumOfSinesOscillation(protocol):
+    prepareParameters = protocol.prepareParameters + ['randomSeed', 'stimulusReps', 'gratingOrientations', 'spatialFrequency', 'oscillationPeriods', 'oscillationAmplitude', 'oscillationPhaseShift'] #see protocol.prepareParameters
+
     def __init__(self):
         super().__init__()
         self.protocolName = 'SumOfSinesOscillation' #During the Oscillating Grating stimulus a grating pattern oscillates sinusoidally over time
@@ -111,6 +113,9 @@ class SumOfSinesOscillation(protocol):
         
         return tf, errorMessage
     
+    getMinimumFeatureSize = protocol.getGratingFeatureSize #see protocol.getMinimumFeatureSize
+    
+    
     def estimateTime(self):
         '''
         Estimate the total amount of time that this protocol will take to run
@@ -148,18 +153,16 @@ class SumOfSinesOscillation(protocol):
     def determineVelocityByFrame(self, pixPerDeg):
         '''
         Determine the phase shift to move the grating on each frame
-        '''
-        
-        def velocityOnFrameN(frameNum, A , period, phaseShift):
-            return A*math.sin(2*frameNum*math.pi/period + math.radians(phaseShift))
-       
         
+        returns: numpy array of velocities (pixels per frame) for one full cycle of the longest period
+        '''
         framesPerCycle = round(max(self.oscillationPeriods) * self._FR) #total length of one cycle
         totalDistance_pix = self.oscillationAmplitude * pixPerDeg #total pixels that the grating moves by for one half cycle
         #frame number vs velocity is described by a sin wave. Integral of Asin(2pi*frameNum/framesPerCycle) evaluated from 0 to framesPerCycle/2 should equal totalDistance_pix
         #A = pi*totalDistance_pix/(framesPerCycle)
         A = math.pi*totalDistance_pix/framesPerCycle
-        velocities_pixPerFrame = []
+        frameNums = np.arange(framesPerCycle)
+        finalVelocity = np.zeros(framesPerCycle)
         for index, phaseShift in enumerate(self.oscillationPhaseShift):
             
             period = round(self.oscillationPeriods[index] * self._FR) #total length of one cycle
@@ -168,14 +171,28 @@ class SumOfSinesOscillation(protocol):
                 phaseShift = abs(math.degrees(math.asin(math.sin(math.radians(phaseShift)))))
                 print('oscillationPhaseShift parameter not within bounds, correcting to ', phaseShift, 'degrees')
             
-            velocity_pixPerFrame = [velocityOnFrameN(f, A, period, phaseShift) for f in range(framesPerCycle)]
-            velocities_pixPerFrame.append(velocity_pixPerFrame)
+            finalVelocity += A*np.sin(2*frameNums*np.pi/period + math.radians(phaseShift))
             
-        finalVelocity = [sum(velocity) for velocity in zip(*velocities_pixPerFrame)]
-        return list(finalVelocity) 
+        return finalVelocity 
         
+
+    def prepare(self, geometry, FR):
+        '''
+        Creates the orientation log and the phase of the grating on every frame (see protocol.prepare)
+        '''
+        pixPerDeg = geometry['pixPerDeg']
+        spatialFrequencyCyclesPerPixel = self.spatialFrequency * (1/pixPerDeg)
+
+        self.createOrientationLog()
+        pixPerFrame = self.determineVelocityByFrame(pixPerDeg)
+        cyclesPerFrame = pixPerFrame*spatialFrequencyCyclesPerPixel #the number of cycles to move per frame
+        #number of cycles to shift the grating by on each frame (the velocity profile repeats every oscillation cycle)
+        numCyclesToShiftByFrame = cyclesPerFrame[np.arange(self._stimTimeNumFrames) % len(cyclesPerFrame)]
+        self._numCyclesToShiftByFrame = numCyclesToShiftByFrame.tolist()
+        
+        #absolute phase of the grating on each frame of each epoch (saved as a list for analysis)
+        self._phaseLog = self.createPhaseLog(numCyclesToShiftByFrame, len(self._orientationLog), self._stimTimeNumFrames).tolist()
     
-      
     
     def run(self, win, informationWin):
         '''
@@ -188,11 +205,13 @@ class SumOfSinesOscillation(protocol):
         
         
         self.getFR(win)
+        self.ensurePrepared(win) #creates the orientation and phase logs unless they were prepared ahead of time
         self._interStimulusIntervalNumFrames = round(self._FR * self.interStimulusInterval)
         self._actualInterStimulusInterval = self._interStimulusIntervalNumFrames * 1/self._FR
         
         stimMonitor = win.monitor
         pixPerDeg = self.getPixPerDeg(stimMonitor)
+
                 
         #Pause for keystroke if the user wants to manually initiate
         if self.userInitiated:
@@ -201,9 +220,9 @@ class SumOfSinesOscillation(protocol):
         
         spatialFrequencyCyclesPerPixel = self.spatialFrequency * (1/pixPerDeg)
         
-        grating = visual.GratingStim(
-            win,
-            size = (win.size[0]*2, win.size[1]*2),
+        grating = self.getStimulus(
+            win, visual.GratingStim,
+            size = self.getCoverSize(win, 0), #resized for each orientation below
             ori = 0, #self.gratingOrientation + 180 - self._angleOffset,
             sf = (spatialFrequencyCyclesPerPixel, None),
             tex = self.gratingTexture,
@@ -212,36 +231,19 @@ class SumOfSinesOscillation(protocol):
             )
         
         
-        #The cover rectangle is drawn on top of the primary grating. It is used
-        #to change the mean intensity of the grating when the user desires. 
-        #If the mean intensity is set to 0, then the cover rectangle is still
-        #drawn but with an opacity of 0
-        coverRectangle = visual.Rect(
-            win,
-            size = (win.size[0]*2, win.size[1]*2),
-            opacity = 0
-            )
-        
-        if self.meanIntensity > 0:
-            coverRectangle.fillColor = [1, 1, 1]
-            coverRectangle.opacity = self.meanIntensity
-        elif self.meanIntensity < 0:
-            coverRectangle.fillColor = [-1, -1, -1]
-            coverRectangle.opacity = -1*self.meanIntensity
+        meanIntensityColor = self.applyMeanIntensity(grating) #mean intensity is applied in the same pass (see protocol.applyMeanIntensity)
             
             
-        self.createOrientationLog()
-        pixPerFrame = self.determineVelocityByFrame(pixPerDeg)
-        cyclesPerFrame = [speed*spatialFrequencyCyclesPerPixel for speed in pixPerFrame] #the number of cycles to move per frame
-        #number of cycles to shift the grating by on each frame. In other words phase += numCyclesToShift for each frame
-        self._numCyclesToShiftByFrame = [cyclesPerFrame[f%len(cyclesPerFrame)] for f in range(self._stimTimeNumFrames)]
+        phaseLog = np.asarray(self._phaseLog)
         
+        self.warmUp(win, grating) #draw once before the first epoch so that the first frames are not dropped
         epochNum = 0
-        trialClock = core.Clock() #this will reset every trial
         for ori in self._orientationLog:
             epochNum += 1
+            epochPhase = phaseLog[epochNum-1]
             
             grating.ori = -ori - self._angleOffset
+            grating.size = self.getCoverSize(win, grating.ori) #smallest grating that covers the window at this orientation
             
             #show information if necessary
             if self._informationWin[0]:
@@ -249,44 +251,38 @@ class SumOfSinesOscillation(protocol):
             
             #pause for inter stimulus interval
             win.color = self.backgroundColor
-            for f in range(self._interStimulusIntervalNumFrames):
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._interStimulusIntervalNumFrames):
+                return
                     
             #pretime... stationary grating
-            self._stimulusStartLog.append(trialClock.getTime())
-            self.sendTTL()
+            self.markEpochStart()
+            self.sendTTLOnFlip(win)
             self._numberOfEpochsStarted += 1
-            for f in range(self._preTimeNumFrames):
-                grating.draw()
-                coverRectangle.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            self.setWindowColor(win, meanIntensityColor)
+            grating.phase = epochPhase[0]
+            if self.flipStaticFrames(win, self._preTimeNumFrames, grating):
+                return
             
             #stim time - flash
-            for f in range(self._stimTimeNumFrames):
-                grating.phase += self._numCyclesToShiftByFrame[f]
+            f = 0
+            while f < self._stimTimeNumFrames:
+                grating.phase = epochPhase[f+1]
                 grating.draw()
-                coverRectangle.draw()
-                win.flip()
+                flipTime = self.flip(win)
                 if self.checkQuitOrPause():
                     return
+                f = self.getNextFrameIndex(f, flipTime, epochNum)
+            grating.phase = epochPhase[-1] #make sure the pattern ends where it should, even if the last frames were skipped
             
             #tail time
-            win.color = self.backgroundColor
-            for f in range(self._tailTimeNumFrames):
-                grating.draw()
-                coverRectangle.draw()
-                win.flip()
-                if self.checkQuitOrPause():
-                    return
+            if self.flipStaticFrames(win, self._tailTimeNumFrames, grating):
+                return
         
             
-            self._stimulusEndLog.append(trialClock.getTime())
-            self.sendTTL()
-            win.flip();win.flip() #two flips in to allow for a pause for TTL writing
+            self.setWindowColor(win, self.backgroundColor)
+            self.markEpochEnd()
+            self.sendTTLOnFlip(win)
+            self.flip(win);self.flip(win) #two flips in to allow for a pause for TTL writing
             
             self._numberOfEpochsCompleted += 1
                 
@@ -4,21 +4,27 @@ Created on Fri Jul  9 17:24:45 2021
 
 @author: mrsco
 """
-from psychopy import core, visual, data, event, monitors
+from psychopy import core, visual, data, event, monitors, logging
+from pyglet import gl as GL
 import time
 import random, math
+import numpy as np
 import inspect
 import ast
 from functools import lru_cache
 
 
 class protocol():
+    prepareParameters = ['preTime', 'stimTime', 'tailTime'] #parameters that setFrameRate and prepare read. The result of prepare is cached under these (see experiments/artifactCache.py), so subclasses that override prepare add the parameters it reads
+
     def __init__(self):
         self.protocolName = '' #replaced by subclass
         self.suffix = '_' #suffix for the protocol name, begin with _
         self.userInitiated = False #determines whether a key stroke is needed to initiate the protocol. Will be set to the corresponding experiment value if not updated by the user
-        self._stimulusStartLog = [] #list of time stamps marking the start of each epoch
-        self._stimulusEndLog = [] #list of time stamps marking the end of each epoch
+        self._stimulusStartLog = [] #list of time stamps marking the start of each epoch (the flip time of its first frame, on the experiment clock)
+        self._stimulusEndLog = [] #list of time stamps marking the end of each epoch (the flip time of its last frame, on the experiment clock)
+        self._lastFlipTime = None #time stamp of the most recent flip made through self.flip
+        self._epochStartPending = False #True between markEpochStart and the next flip
         self._pauseTimeLog = []
         self.randomSeed = random.random() #seed value to use to generate pseudorandom sequences
         self.tagList = [] #a list of tags for the protocol.
@@ -26,12 +32,34 @@ class protocol():
         self._numberOfEpochsStarted = 0
         self._numberOfEpochsCompleted = 0 #counts the number of epochs that have actually occured
         self._portName = '' #name of the TTL port if in use. Implemented 
-        self._timesTTLFlipped = 0 #counts the number of TTL flips, used for sustained mode only
-        self._timesTTLFlippedBookmark = 0 #counts the number of TTL flips during bookmark (sustained mode with bookmarking only)
+        self._timesTTLFlipped = 0 #counts the number of TTL flips (pulses in pulse mode), not including bookmarks and the pulse mode burst
+        self._timesTTLFlippedBookmark = 0 #counts the number of TTL flips during bookmark (sustained mode with bookmarking only), or the pulses of the burst in pulse mode
+        self._epochTTLLog = [] #[TTLs sent before the epoch started, TTLs sent before it ended] for every epoch (bookmarks and bursts not included). The second number is None if the epoch never ended. Used to split recorded TTLs into epochs (see analysis/ttlDecoder.py)
+        self._protocolIndex = None #index of this protocol in experiment.protocolList when it ran, assigned by the experiment. Binary bookmarks encode this index
         self._userPauseCount = 0 #counts the number of times the user initiated a pause in the middle of the stimulus
         self._userPauseDurations = [] #list of amount of time (in seconds) that each pause lasted for
         self._completed = -1 # -1 indicates stimulus never ran. 0 indicates stimulus started but ended early. 1 indicates stimulus ran to completion
         self._timingReport = False #bool, inhereted from experiment parameters. Indicates whether the user wants to print a timing report for each stimulus (usually to determine if frames are being dropped)
+        self._timeBasedAnimation = False #bool, inherited from experiment parameters. If True, motion is advanced according to the measured flip times rather than the frame count, so that dropped frames don't slow the stimulus down
+        self._compensatedFrameLog = [] #list of [epoch number, frame index, number of frames skipped] for every frame on which time-based animation skipped ahead to catch up with a dropped frame
+        self._stimulusPool = None #stimulusPool, assigned by the experiment before the protocol runs (see getStimulus). Removed before the protocol is logged
+        self._renderScale = 1.0 #fraction of the window resolution that the protocol was rendered at. Assigned by the experiment (see experiment.getRenderScale)
+        self._warmUpDuration = 0.0 #seconds spent drawing stimuli ahead of time (see warmUp) so that their textures and buffers are ready before the first timed frame
+        self._ttlFlipOffsetLog = [] #seconds between the buffer swap and the end of the TTL write for every TTL that was scheduled with sendTTLOnFlip
+        self._pendingFlipTTLs = 0 #number of TTLs scheduled with sendTTLOnFlip that are waiting for the next flip
+        self._ttlWriter = None #ttlWriter, assigned by the experiment if TTLs are written on a background thread. Removed before the protocol is logged
+        self._ttlQueueDelayLog = [] #seconds between queueing and writing each TTL when a ttlWriter is used
+        self._bookmarkCode = None #'binary' or 'legacy' if a TTL bookmark was sent before this protocol (see experiments/bookmarks.py), otherwise None
+        self._bookmarkDataBits = None #number of bits of the protocol index in a binary bookmark (see bookmarks.getDataBits)
+        self._syncPatch = None #psychopy Rect drawn in a corner of the window in 'Photodiode' TTL mode. Assigned by the experiment and removed before the protocol is logged
+        self._syncPatchLog = [] #[1 if the patch turned ON or 0 if it turned OFF, 1 if part of a bookmark else 0, psychopy time of the flip it first appeared on] for every change of the sync patch (Photodiode mode only)
+        self._preparedFor = None #{'geometry': see getGeometry, 'FR': frame rate, 'attributes': names of the attributes that prepare set} that prepare was last run for, or None if it hasn't been run
+        self._preparedData = {} #numpy arrays built by prepare that are needed to run but aren't saved with the protocol (e.g. noise sequences that can be rebuilt from randomSeed). Removed before the protocol is logged
+        self._prepareWaitTime = 0.0 #seconds that the experiment waited for this protocol to finish preparing in a worker process before it could run (see experiment.activate)
+        self._artifactCache = None #artifactCache that the result of prepare is loaded from or saved to, assigned by the experiment (see experiments/artifactCache.py). Removed before the protocol is logged
+        self._artifactCacheKey = None #key of the result of prepare in the artifact cache
+        self._artifactCacheHit = None #True if the result of prepare was loaded from the artifact cache, False if it was built and cached, None if no cache was used
+        self._journal = None #runJournal that epochs are written to as they finish, assigned by the experiment if epochs are journaled (see experiments/runJournal.py). Removed before the protocol is logged
         
 
     
@@ -162,6 +190,13 @@ class protocol():
             while self._FR is None and count < 1000:
                 self._FR = win.getActualFrameRate()
 
+        self.setFrameRate(self._FR)
+
+    def setFrameRate(self, FR):
+        '''
+        Set the frame rate and calculate the number of frames and total time for each segment of the stimulus
+        '''
+        self._FR = FR
         self._preTimeNumFrames = round(self._FR*self.preTime)
         self._stimTimeNumFrames = round(self._FR*self.stimTime)
         self._tailTimeNumFrames = round(self._FR*self.tailTime)
@@ -170,6 +205,121 @@ class protocol():
         self._actualStimTime = self._stimTimeNumFrames * 1/self._FR
         self._actualTailTime = self._tailTimeNumFrames * 1/self._FR
         
+    def getGeometry(self, win):
+        '''
+        Describe the parts of the stimulus window that prepare depends on. Works with an open window or anything with the same size and monitor attributes
+
+        returns: dictionary with 'size' (window size in pixels, [width, height]) and 'pixPerDeg'
+        '''
+        return {'size': [int(v) for v in win.size], 'pixPerDeg': self.getPixPerDeg(win.monitor)}
+
+    def prepare(self, geometry, FR):
+        '''
+        placeholder for the prepare function. Subclasses that build long sequences before they run (e.g. noise or position logs) override this so that the work can be done ahead of time, in parallel, before the stimulus window opens (see experiment.prepareProtocols).
+
+        Inputs:
+            - geometry: see getGeometry
+            - FR: frame rate of the stimulus window. The frame counts (self._stimTimeNumFrames, etc.) have already been set from it
+
+        Anything created here must be picklable, since prepare usually runs in a worker process
+        '''
+        return
+
+    def prepareFor(self, geometry, FR):
+        '''
+        Set the frame rate and run prepare for the given window geometry. Records what the protocol was prepared for, and which attributes prepare set, in self._preparedFor
+
+        If the experiment assigned an artifact cache (see experiments/artifactCache.py), the result of prepare is loaded from the cache if it is there and saved to it otherwise
+        '''
+        self._preparedData = {} #removed when the protocol is logged, so start from an empty one
+        cache = getattr(self, '_artifactCache', None)
+        if cache is None or type(self).prepare is protocol.prepare:
+            before = dict(vars(self))
+            self.setFrameRate(FR)
+            self.prepare(geometry, FR)
+            self._preparedFor = {'geometry': geometry, 'FR': FR, 'attributes': self.getChangedAttributes(before)}
+            return
+
+        key = cache.getKey(self, geometry, FR)
+        self._artifactCacheKey = key
+        cached = cache.load(key)
+        if cached is not None and abs(cached['_preparedFor']['FR'] - FR) <= 0.001*FR:
+            self.setFrameRate(cached['_preparedFor']['FR'])
+            vars(self).update(cached)
+            self._artifactCacheHit = True
+            return
+
+        before = dict(vars(self))
+        self.setFrameRate(FR)
+        self.prepare(geometry, FR)
+        self._preparedFor = {'geometry': geometry, 'FR': FR, 'attributes': self.getChangedAttributes(before)}
+        cache.save(key, self.getPreparedAttributes(before))
+        self._artifactCacheHit = False
+
+    def getChangedAttributes(self, before):
+        '''
+        returns: sorted names of the attributes that are new or were replaced since before (a copy of vars(self))
+        '''
+        return sorted(name for name, value in vars(self).items() if name not in before or before[name] is not value)
+
+    def getPreparedAttributes(self, before):
+        '''
+        Find the attributes that prepare set, so that they can be cached
+
+        Inputs:
+            - before: copy of vars(self) from before prepare ran
+
+        returns: dictionary of every attribute that is new or was replaced, plus attributes that a new protocol object doesn't have (prepare may have set them to a number or string that they already had)
+        '''
+        defaults = vars(type(self)())
+        prepared = {}
+        for name, value in vars(self).items():
+            if name in ['_artifactCache', '_artifactCacheKey', '_artifactCacheHit']:
+                continue
+            if name not in before or before[name] is not value:
+                prepared[name] = value
+            elif name not in defaults and isinstance(value, (int, float, str, bool, type(None))):
+                prepared[name] = value
+        return prepared
+
+    def ensurePrepared(self, win):
+        '''
+        Called from run after getFR. Keeps the results of prepare if they were made for this window and a frame rate within 0.1% of the measured one (the prepared frame rate is then used, so that the frame counts match the prepared sequences). Otherwise prepare is run now
+        '''
+        geometry = self.getGeometry(win)
+        if self.isPreparedFor(geometry, self._FR):
+            self.setFrameRate(self._preparedFor['FR'])
+            return
+
+        self.prepareFor(geometry, self._FR)
+
+    def isPreparedFor(self, geometry, FR):
+        '''
+        returns: True if prepare was run for this window geometry and a frame rate within 0.1% of FR, and everything it set (including self._preparedData, which is removed when the protocol is logged) is still there
+        '''
+        prepared = getattr(self, '_preparedFor', None) #protocols saved before prepare existed don't have this attribute
+        if prepared is None or prepared['geometry'] != geometry or abs(prepared['FR'] - FR) > 0.001*FR:
+            return False
+        return all(hasattr(self, name) for name in ['_preparedData'] + prepared.get('attributes', []))
+
+    def getMinimumFeatureSize(self, win):
+        '''
+        Size (in window pixels) of the smallest feature that this protocol draws, e.g. a bar width or half a grating cycle. This is used by the experiment to decide whether the protocol can be rendered at a reduced resolution without changing its content.
+
+        returns: None, which means the protocol is always rendered at full resolution. Override in the subclass to allow reduced resolution rendering
+        '''
+        return None
+
+    def getGratingFeatureSize(self, win):
+        '''
+        getMinimumFeatureSize for grating protocols (self.spatialFrequency in cycles per degree). The smallest feature of a grating is half of one cycle
+
+        returns: half a cycle in pixels, or None if the grating has no cycles
+        '''
+        if self.spatialFrequency <= 0:
+            return None
+        return 0.5/self.spatialFrequency * self.getPixPerDeg(win.monitor)
+
     def getPixPerDeg(self, stimMonitor):
         '''
         determine the pixels per degree for the stimulus monitor
@@ -181,6 +331,214 @@ class protocol():
         totalVisualDegrees = 2*math.degrees(math.atan((cmWide/2)/eyeDistance))
         return numPixelsWide/totalVisualDegrees
     
+    def createPhaseLog(self, numCyclesToShiftByFrame, numEpochs, numFrames):
+        '''
+        Precompute the absolute phase (in cycles) of a drifting pattern for every moving frame of every epoch
+        
+        inputs:
+            - numCyclesToShiftByFrame: number of cycles to shift the pattern by on each moving frame. Either a single number (constant speed) or a list/array with one value per moving frame
+            - numEpochs: number of epochs in the protocol
+            - numFrames: number of frames per epoch during which the pattern moves
+        
+        returns: numpy array of shape (numEpochs, numFrames+1). Column 0 is the phase at the start of the epoch (held during the pretime), column f+1 is the phase on moving frame f, and the last column is the phase held during the tail time.
+        Each epoch starts where the previous one ended, just like accumulating the phase frame by frame. Values are wrapped to [0, 1) since the pattern repeats every cycle.
+        '''
+        shifts = np.broadcast_to(np.asarray(numCyclesToShiftByFrame, dtype = float), (numFrames,))
+        phaseWithinEpoch = np.concatenate(([0.0], np.cumsum(shifts)))
+        epochStartPhase = np.arange(numEpochs) * phaseWithinEpoch[-1]
+        return np.mod(epochStartPhase[:, None] + phaseWithinEpoch[None, :], 1.0)
+
+    def getRandomGenerator(self):
+        '''
+        Create a numpy random number generator from self.randomSeed
+
+        Use this instead of the random module when a pseudorandom sequence is built with numpy. The same randomSeed always produces the same sequence.
+
+        returns: numpy.random.Generator
+        '''
+        return np.random.default_rng(int(abs(self.randomSeed) * 2**32))
+
+    def applyMeanIntensity(self, stim):
+        '''
+        Set up a full screen stimulus (e.g. a grating or noise pattern) so that its mean intensity is shifted by self.meanIntensity
+
+        Shifting the mean by m is the same as blending the stimulus with white (m > 0) or black (m < 0) at an opacity of |m|. Rather than drawing a second full screen rectangle on top of the stimulus, the stimulus is drawn with an opacity of 1-|m| over a window that is cleared to white or black. This gives the same image in a single pass.
+
+        inputs:
+            - stim: psychopy stimulus that covers the whole window
+
+        returns: the color the window must be cleared to while the stimulus is on the screen (pass it to self.setWindowColor)
+        '''
+        stim.opacity = 1 - abs(self.meanIntensity)
+        if self.meanIntensity > 0:
+            return [1.0, 1.0, 1.0]
+        elif self.meanIntensity < 0:
+            return [-1.0, -1.0, -1.0]
+
+        return self.backgroundColor #stimulus is fully opaque, so the window color is never seen
+
+    def getCoverSize(self, win, ori):
+        '''
+        Smallest size of a centered, rectangular stimulus rotated by ori that still covers the whole window
+
+        Making full screen patterns twice the size of the window covers it at any orientation, but most of the drawn pixels are then off screen. This is the bounding box of the window in the rotated frame of the stimulus (plus a 1 pixel margin on each side). The rendered image does not change, since the spatial frequency and phase of a pattern do not depend on its size.
+
+        inputs:
+            - win: psychopy window (units of pixels)
+            - ori: orientation of the stimulus in degrees, as it is set on the stimulus
+
+        returns: (width, height) in pixels
+        '''
+        theta = np.radians(ori)
+        cosTheta = abs(np.cos(theta))
+        sinTheta = abs(np.sin(theta))
+        return (win.size[0]*cosTheta + win.size[1]*sinTheta + 2, win.size[0]*sinTheta + win.size[1]*cosTheta + 2)
+
+    def setWindowColor(self, win, color):
+        '''
+        Change the window color, including the back buffer that is currently being drawn to (win.color alone only takes effect after the next flip)
+        '''
+        win.color = color
+        win.clearBuffer()
+
+    def getTime(self):
+        '''
+        Returns the current time on the experiment clock. The experiment sets this clock as psychopy's default clock, so it is the same clock that win.flip time stamps and the TTL logs use
+        '''
+        return logging.defaultClock.getTime()
+
+    def flip(self, win, clearBuffer = True):
+        '''
+        Flip the window and keep track of the flip time. Protocols should flip through this method so that epoch boundaries can be taken from the flip times (see markEpochStart and markEpochEnd)
+
+        returns: the time stamp of the flip on the experiment clock
+        '''
+        flipTime = win.flip(clearBuffer = clearBuffer)
+        self._lastFlipTime = flipTime
+        if self._epochStartPending:
+            self._stimulusStartLog.append(flipTime)
+            self._epochStartPending = False
+        return flipTime
+
+    def countTTLs(self):
+        '''
+        Returns the number of TTLs (other than bookmarks and bursts) this protocol has sent so far, including TTLs that are scheduled for the next flip
+        '''
+        if self.writeTTL in ('Pulse', 'Sustained'):
+            return self._timesTTLFlipped + self._pendingFlipTTLs #pulse and sustained TTLs scheduled with sendTTLOnFlip are counted when they are written
+        return self._timesTTLFlipped
+
+    def markEpochStart(self):
+        '''
+        Mark the start of an epoch. The time of the next flip (the first frame of the epoch) is added to self._stimulusStartLog
+        '''
+        self._epochStartPending = True
+        self._epochTTLLog.append([self.countTTLs(), None])
+
+    def markEpochEnd(self):
+        '''
+        Mark the end of an epoch after its last frame has been flipped. The time of that flip is added to self._stimulusEndLog
+        '''
+        if self._epochStartPending: #the epoch didn't have any frames
+            self._stimulusStartLog.append(self.getTime())
+            self._epochStartPending = False
+        if self._lastFlipTime is None:
+            self._stimulusEndLog.append(self.getTime())
+        else:
+            self._stimulusEndLog.append(self._lastFlipTime)
+        if self._epochTTLLog and self._epochTTLLog[-1][1] is None:
+            self._epochTTLLog[-1][1] = self.countTTLs()
+        if self._journal is not None:
+            self._journal.writeEpoch(len(self._stimulusEndLog) - 1, self._stimulusStartLog[-1], self._stimulusEndLog[-1])
+
+    def getStimulus(self, win, stimulusType, **kwargs):
+        '''
+        Create a psychopy stimulus, or borrow an identical one (same type and construction parameters) that an earlier protocol already built
+
+        Borrowed stimuli have their orientation, phase, position, size, opacity, contrast, element colors/opacities and mask reset to the values they were created with, so they can be used exactly like a new stimulus.
+
+        inputs:
+            - win: psychopy window
+            - stimulusType: psychopy stimulus class (e.g. visual.GratingStim)
+            - kwargs: keyword arguments for the stimulus constructor
+
+        returns: the stimulus
+        '''
+        if self._stimulusPool is None or self._stimulusPool.win is not win:
+            return stimulusType(win, **kwargs)
+
+        return self._stimulusPool.get(stimulusType, **kwargs)
+
+    def warmUp(self, win, *stimuli):
+        '''
+        Draw each stimulus once to the back buffer without flipping
+
+        The first time a stimulus is drawn, its textures, shaders and vertex buffers are created and uploaded to the GPU, which often causes the first frames of an epoch to be dropped. Call this before the first interstimulus interval so that this happens while nothing is being timed. The back buffer is cleared afterwards so none of it is shown. The time spent is added to self._warmUpDuration.
+
+        inputs:
+            - win: psychopy window
+            - stimuli: psychopy stimuli to prepare
+        '''
+        startTime = time.time()
+        for stim in stimuli:
+            stim.draw()
+        GL.glFinish() #wait until the GPU has actually finished the uploads
+        win.clearBuffer()
+        self._warmUpDuration += time.time() - startTime
+
+    def flipStaticFrames(self, win, numFrames, *stimuli):
+        '''
+        Present numFrames identical frames (e.g. the interstimulus interval, or the pretime and tail time of a static grating)
+
+        When the window renders to a framebuffer object (useFBO), the frame is only drawn once. It stays in the framebuffer because it is flipped without clearing, and it is cleared again on the last flip so the next segment starts from a blank frame. Without a framebuffer object the contents of the back buffer are undefined after a flip, so the stimuli are redrawn on every frame.
+
+        inputs:
+            - win: psychopy window
+            - numFrames: number of frames to present
+            - stimuli: psychopy stimuli to draw, in order. Leave empty to present the window color
+
+        returns: 1 if the user quit during these frames, 0 otherwise
+        '''
+        reuseFrame = getattr(win, 'useFBO', False)
+        for f in range(numFrames):
+            if f == 0 or not reuseFrame:
+                if reuseFrame:
+                    win.clearBuffer() #make sure the cached frame uses the current window color
+                for stim in stimuli:
+                    stim.draw()
+            self.flip(win, clearBuffer = (not reuseFrame) or f == numFrames - 1)
+            if self.checkQuitOrPause():
+                return 1
+
+        return 0
+
+    def getNextFrameIndex(self, frameIndex, flipTime, epochNum):
+        '''
+        Determine which frame of a precomputed motion trajectory (e.g. a phase or position log) should be drawn next
+        
+        In the default frame-based mode this is always frameIndex + 1. In time-based mode (experiment option), the index is calculated from the measured flip time relative to the first frame of the motion, so that the stimulus stays on its intended trajectory (in degrees per second) when frames are dropped. Skipped frames are logged in self._compensatedFrameLog.
+        
+        inputs:
+            - frameIndex: index of the frame that was just flipped. 0 must be the first frame of the motion segment
+            - flipTime: the time stamp returned by win.flip() for that frame
+            - epochNum: the current epoch number (used for logging only)
+        
+        returns: index of the next frame to draw
+        '''
+        if not self._timeBasedAnimation:
+            return frameIndex + 1
+        
+        if frameIndex == 0:
+            self._motionOnsetTime = flipTime
+            return 1
+        
+        expectedIndex = round((flipTime - self._motionOnsetTime)*self._FR) + 1
+        if expectedIndex > frameIndex + 1:
+            self._compensatedFrameLog.append([epochNum, frameIndex + 1, expectedIndex - frameIndex - 1])
+            return expectedIndex
+        
+        return frameIndex + 1
+    
     def showInformationText(self, stimWin, txt):
         '''
         update the information window
@@ -224,8 +582,17 @@ class protocol():
     def sendTTL(self, bookmark = False):
         '''
         sends ttl pulse during experiment if the setting is turned on TTL pulse or sustained can be selected. If pulse is turned on, this only executes during a protocol, but not before.
+        In Photodiode mode, the sync patch is toggled between white (ON) and black (OFF) just like the sustained TTL. The change shows up on the next flip.
         '''
         if self.writeTTL == 'Pulse':
+            if bookmark:
+                self._timesTTLFlippedBookmark += 1
+            else:
+                self._timesTTLFlipped += 1
+                
+            if self._ttlWriter is not None:
+                self._ttlWriter.write(0X4B) #returns immediately, the write happens on the writer's thread
+            else:
                 try:
                     self._portObj.write(0X4B)
                 except:
@@ -237,31 +604,100 @@ class protocol():
             else:
                 self._timesTTLFlipped += 1
                 
+            #the TTL state and counts are always updated here so they stay in step with the frames, even if the port itself is set on the writer's thread
             if self._TTLON: #IF TTL is ON, turn it OFF
-                self._portObj.rts = True #'True' turns TTL off on picolo
+                rts = True #'True' turns TTL off on picolo
                 self._TTLON = False
             else: # If TTL is OFF, turn it ON
-                self._portObj.rts = False #'False' turns TTL ON on picolo
+                rts = False #'False' turns TTL ON on picolo
                 self._TTLON = True
+                
+            if self._ttlWriter is not None:
+                self._ttlWriter.setRTS(rts)
+            else:
+                self._portObj.rts = rts
+        
+        elif self.writeTTL == 'Photodiode':
+            if bookmark:
+                self._timesTTLFlippedBookmark += 1
+            else:
+                self._timesTTLFlipped += 1
+            
+            self._TTLON = not self._TTLON
+            if self._TTLON:
+                self._syncPatch.fillColor = [1.0, 1.0, 1.0]
+            else:
+                self._syncPatch.fillColor = [-1.0, -1.0, -1.0]
+            self._syncPatchLog.append([int(self._TTLON), int(bookmark), None])
         return
     
     
+    def sendTTLOnFlip(self, win, bookmark = False):
+        '''
+        schedules sendTTL to run as soon as the next win.flip() swaps the buffers, so that the TTL is locked to the display update instead of to wherever it is called in the frame loop. Call this before the flip that the TTL should mark. The time between the buffer swap and the end of the write is added to self._ttlFlipOffsetLog
+        '''
+        if self.writeTTL == 'Photodiode':
+            #the sync patch is drawn as part of the next frame, so change it now and record the time of the flip that shows it
+            self.sendTTL(bookmark = bookmark)
+            self._pendingFlipTTLs += 1
+            win.callOnFlip(self._logSyncPatchFlip, win, len(self._syncPatchLog) - 1)
+            return
+        
+        if self.writeTTL not in ('Pulse', 'Sustained'):
+            return
+        
+        self._pendingFlipTTLs += 1
+        win.callOnFlip(self._sendTTLAtFlip, win, bookmark)
+        
+    
+    def _sendTTLAtFlip(self, win, bookmark):
+        '''
+        called by psychopy directly after the buffer swap for TTLs scheduled with sendTTLOnFlip
+        '''
+        flipTime = getattr(win, '_frameTime', None) #time stamp of the swap that was just completed. Use the time this function was called if psychopy doesn't provide it
+        if flipTime is None:
+            flipTime = logging.defaultClock.getTime()
+            
+        self.sendTTL(bookmark = bookmark)
+        self._ttlFlipOffsetLog.append(logging.defaultClock.getTime() - flipTime)
+        self._pendingFlipTTLs -= 1
+        
+    
+    def _logSyncPatchFlip(self, win, index):
+        '''
+        called by psychopy directly after the buffer swap that first shows a change of the sync patch (see sendTTLOnFlip)
+        '''
+        flipTime = getattr(win, '_frameTime', None)
+        if flipTime is None:
+            flipTime = logging.defaultClock.getTime()
+        self._syncPatchLog[index][2] = flipTime
+        self._pendingFlipTTLs -= 1
+        
+    
+    def flushTTL(self, win):
+        '''
+        flips the window once if TTLs scheduled with sendTTLOnFlip are still waiting (e.g. after the last epoch or if the protocol was quit early), so that they are written before the protocol ends
+        '''
+        if self._pendingFlipTTLs > 0:
+            self.flip(win)
+    
+    
     def burstTTL(self, win):
         '''
-        sends a burst of TTL pulses at the start of a stimulus when the the TTL port is in pulse mode. As of 10/29/2023 this appears to only be implemented for checkerboard receptive field and flash grid. The stereotyped burst is 20 TTL pulses at frame rate, wait 0.2 seconds, and 20 more TTL pulses at frame rate
+        sends a burst of TTL pulses at the start of a stimulus when the the TTL port is in pulse mode. The experiment sends it once before every protocol, so protocols should not call it themselves. The stereotyped burst is 20 TTL pulses at frame rate, wait 0.2 seconds, and 20 more TTL pulses at frame rate. Its pulses are counted like bookmarks (in self._timesTTLFlippedBookmark)
         '''
         if self.writeTTL != 'Pulse':
             return
         
         for i in range(20):
-            self.sendTTL()
-            win.flip()
+            self.sendTTLOnFlip(win, bookmark = True)
+            self.flip(win)
             
         core.wait(0.2)
         
         for i in range(20):
-            self.sendTTL()
-            win.flip()
+            self.sendTTLOnFlip(win, bookmark = True)
+            self.flip(win)
         
         return
     
@@ -293,6 +729,22 @@ class protocol():
             
         print('(note that reported epoch times typically do not include interstimulus intervals. See the script for the specific protocol for more information)\n')
         
+        #dropped frames at the start of the stimulus show up as a first epoch that is longer than the others
+        if len(allTimes) > 1:
+            laterEpochMean = np.mean(allTimes[1:])
+            print(f"First Epoch: {allTimes[0]:.3f} seconds. Mean of Later Epochs: {laterEpochMean:.3f} seconds (difference: {allTimes[0] - laterEpochMean:.3f} seconds)")
+        print(f"Time Spent Warming Up Stimuli Before Timed Frames: {self._warmUpDuration:.3f} seconds\n")
+        
+        #delay between the buffer swap and the TTL write for frame-locked TTLs
+        if self._ttlFlipOffsetLog:
+            offsets = 1000*np.array(self._ttlFlipOffsetLog)
+            print(f"Flip to TTL Offset ({len(offsets)} TTLs): mean {offsets.mean():.3f} ms, max {offsets.max():.3f} ms\n")
+        
+        #with a background writer, the offset above only covers queueing the TTL. This is the extra time until the port was written
+        if self._ttlQueueDelayLog:
+            delays = 1000*np.array(self._ttlQueueDelayLog)
+            print(f"TTL Queue to Write Delay ({len(delays)} TTLs): mean {delays.mean():.3f} ms, max {delays.max():.3f} ms\n")
+        
         #then, the total elapsed time for the stimulus is compared to the expected elapsed time
         print(f"Total Time Elapsed for this Stimulus: {totalTime:.2f} seconds")
         print(f"Expected Time Elapsed for this Stimulus: {self._estimatedTime:.2f} seconds")
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the texture render path of ScotomaMovingGrating
+(src/experiments/scotomaTexture.py) draws every scotoma in the same place
+and with the same opacity as the ElementArrayStim path.
+
+For several window and scotoma sizes this checks that:
+    - the texel of every scotoma is centered on its entry in _scotomaCoordinates
+    - after a random growth sequence, every texel holds the opacity of its scotoma in the element mask, and the padding stays transparent
+    - the rows that are uploaded cover every texel that changed
+
+No window is needed (uploads are recorded instead of sent to OpenGL).
+
+Usage (from the repository root):
+    python test/scotomaTextureCheck.py
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+from experiments.scotomaTexture import scotomaTexture
+
+
+def scotomaGrid(winWidthPix, winHeightPix, scotomaSizePix):
+    '''
+    The scotoma grid, built the same way as ScotomaMovingGrating.prepare
+    '''
+    xCoordinates = [x - winWidthPix/2 for x in range(-scotomaSizePix, winWidthPix+scotomaSizePix, scotomaSizePix)]
+    yCoordinates = [y - winHeightPix/2 for y in range(-scotomaSizePix, winHeightPix+scotomaSizePix, scotomaSizePix)]
+    coordinates = [[x, y] for x in xCoordinates for y in yCoordinates]
+    return xCoordinates, yCoordinates, np.array(coordinates)
+
+
+class recordingTexture(scotomaTexture):
+    '''
+    scotomaTexture that records the rows it would upload instead of calling OpenGL
+    '''
+    def upload(self, firstRow, lastRow):
+        self.uploads.append((firstRow, lastRow))
+
+
+def check(winWidthPix, winHeightPix, scotomaSizePix, opacity = 0.8, seed = 1):
+    failures = []
+    xCoordinates, yCoordinates, coordinates = scotomaGrid(winWidthPix, winHeightPix, scotomaSizePix)
+    texture = recordingTexture(xCoordinates, yCoordinates, scotomaSizePix)
+    texture.uploads = []
+
+    #texel centers against the element positions
+    rows, columns = texture.getTexels(np.arange(len(coordinates)))
+    left = texture.pos[0] - texture.size[0]/2
+    bottom = texture.pos[1] - texture.size[1]/2
+    centers = np.column_stack([left + (columns + 0.5)*scotomaSizePix, bottom + (rows + 0.5)*scotomaSizePix])
+    if not np.allclose(centers, coordinates):
+        failures.append('texel centers do not match the element positions')
+
+    #grow and shrink through a random permutation, as setScotomaCount does, and compare with the element mask
+    rng = np.random.default_rng(seed)
+    permutation = rng.permutation(len(coordinates))
+    mask = np.zeros(len(coordinates))
+    visibleCount = 0
+    for newCount in list(rng.integers(0, len(coordinates), 20)) + [len(coordinates), 0]:
+        if newCount > visibleCount:
+            changed, value = permutation[visibleCount:newCount], opacity
+        else:
+            changed, value = permutation[newCount:visibleCount], 0
+        before = texture.texture.copy()
+        mask[changed] = value
+        texture.uploads = []
+        texture.setOpacities(changed, value)
+        visibleCount = newCount
+
+        changedRows = np.flatnonzero((before != texture.texture).any(axis = 1))
+        if len(changedRows) and not any(first <= changedRows.min() and changedRows.max() <= last for first, last in texture.uploads):
+            failures.append(f'rows {changedRows.min()} to {changedRows.max()} changed but were not uploaded')
+
+        expected = -np.ones(texture.textureShape)
+        expected[rows, columns] = 2*mask - 1
+        if not np.allclose(texture.texture, expected):
+            failures.append(f'texture does not match the element mask with {visibleCount} scotomas visible')
+
+    return failures
+
+
+if __name__ == '__main__':
+    failed = False
+    for winSize, scotomaSizePix in [((1920, 1080), 40), ((1280, 1024), 7), ((800, 600), 600), ((1024, 768), 16)]:
+        failures = check(*winSize, scotomaSizePix)
+        print(f'{winSize[0]}x{winSize[1]}, {scotomaSizePix} pix scotomas: ' + ('OK' if not failures else 'FAILED'))
+        for f in failures:
+            print('    ' + f)
+        failed = failed or bool(failures)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Runs every protocol against a fake serial port (src/experiments/fakeSerial.py)
+on a mock window and reports how the TTLs line up with the frame flips.
+
+For each protocol and TTL mode this prints:
+    - the offset between each TTL and the flip before it (mean, standard deviation/jitter and max)
+    - TTL throughput (events per second while the protocol ran)
+    - missed TTLs (TTLs that the protocol sent but that never reached the port). Pulses are counted as sendTTL is called, independently of the callbacks that write them
+
+The script exits with status 1 if any run missed a TTL (or, with --maxOffset,
+if any TTL came later than that after its flip), so it can be used as a CI
+check.
+
+Stimuli are replaced with mock objects, so nothing is drawn and no display is
+needed (psychopy still has to be installed). By default the mock window flips
+as fast as possible, which measures the software overhead of the TTL path.
+Use --realtime to pace the flips at the frame rate.
+
+Usage (from the repository root):
+    python test/ttlBenchmark.py
+    python test/ttlBenchmark.py --modes Sustained --async --protocols MovingBar Flash
+    python test/ttlBenchmark.py --async --maxOffset 2
+"""
+import argparse
+import importlib
+import os
+import sys
+import time
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+srcDirectory = Path(__file__).resolve().parent.parent / 'src'
+sys.path.insert(0, str(srcDirectory))
+os.chdir(srcDirectory) #protocols and the experiment expect to run from src, like main.py
+
+from psychopy import logging, monitors
+import protocols.protocol
+from experiments.experiment import experiment
+from experiments.ttlWriter import ttlWriter
+
+skippedProtocols = ['PupilCalibration'] #waits for key presses between TTLs
+
+
+class mockWindow():
+    '''
+    Minimal stand-in for a psychopy window: flips run the callOnFlip callbacks like psychopy does and are time stamped
+    '''
+    def __init__(self, frameRate = 60.0, size = (1920, 1080), monitor = 'testMonitor', realTime = False):
+        self.frameRate = frameRate
+        self.size = list(size)
+        self.monitor = monitors.Monitor(monitor)
+        self.realTime = realTime
+        self.color = [-1, -1, -1]
+        self.units = 'pix'
+        self.useFBO = False
+        self.flipTimes = [] #perf_counter time stamp of every flip (same clock as the fake port)
+        self._frameTime = None #psychopy clock time stamp of the last flip (used by protocol.sendTTLOnFlip)
+        self._toCall = []
+        self._nextFlip = None
+
+    def getActualFrameRate(self):
+        return self.frameRate
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._toCall.append((function, args, kwargs))
+
+    def clearBuffer(self, color = True, depth = False, stencil = False):
+        pass
+
+    def flip(self, clearBuffer = True):
+        if self.realTime:
+            if self._nextFlip is None:
+                self._nextFlip = time.perf_counter()
+            while time.perf_counter() < self._nextFlip:
+                pass
+            self._nextFlip += 1/self.frameRate
+
+        self.flipTimes.append(time.perf_counter())
+        self._frameTime = logging.defaultClock.getTime()
+        for function, args, kwargs in self._toCall:
+            function(*args, **kwargs)
+        self._toCall = []
+        return self._frameTime
+
+
+def listProtocols():
+    names = [f[:-3] for f in os.listdir('protocols') if f.endswith('.py') and f not in ['protocol.py', '__init__.py']]
+    return sorted(n for n in names if n not in skippedProtocols)
+
+
+def runProtocol(name, mode, useWriter, args):
+    '''
+    Runs one protocol against a fake port and returns the fake port, mock window and protocol
+    '''
+    module = importlib.import_module('protocols.' + name)
+    module.visual = mock.MagicMock() #nothing is drawn
+    p = getattr(module, name)()
+    p.userInitiated = False
+    if hasattr(p, 'stimulusReps'):
+        p.stimulusReps = args.reps
+
+    #open the fake port the same way the experiment opens a real one (any port whose name starts with 'fake')
+    exp = experiment()
+    exp.writeTTL = mode
+    exp.establishPort('fake')
+    if not exp.ttlPortOpen:
+        raise RuntimeError('experiment.establishPort did not open the fake port')
+    port = exp.portObj
+    win = mockWindow(args.frameRate, monitor = args.monitor, realTime = args.realtime)
+    writer = ttlWriter(port) if useWriter else None
+
+    p.writeTTL = mode
+    p._portObj = port
+    p._TTLON = False
+    p._ttlWriter = writer
+
+    #count every pulse as it is sent, so that pulses are checked against something other than the callbacks that write them
+    p._benchmarkPulses = 0
+    sendTTL = p.sendTTL
+    def countingSendTTL(*args, **kwargs):
+        if p.writeTTL == 'Pulse':
+            p._benchmarkPulses += 1
+        return sendTTL(*args, **kwargs)
+    p.sendTTL = countingSendTTL
+
+    p.burstTTL(win)
+    p.run(win, (False, None))
+    p.flushTTL(win)
+    if mode == 'Sustained' and p._TTLON:
+        p.sendTTL()
+    if writer is not None:
+        writer.stop()
+    port.close() #the recorded events are kept
+
+    return port, win, p
+
+
+def summarize(port, win, p, mode):
+    '''
+    Returns a dictionary of timing metrics for one run
+    '''
+    eventType = 'rts' if mode == 'Sustained' else 'write'
+    eventTimes = np.array(port.getEventTimes(eventType))
+    flipTimes = np.array(win.flipTimes)
+
+    if mode == 'Sustained':
+        expected = p._timesTTLFlipped + p._timesTTLFlippedBookmark
+    else:
+        expected = p._benchmarkPulses
+
+    results = {'events': len(eventTimes), 'missed': expected - len(eventTimes), 'flips': len(flipTimes)}
+    if len(eventTimes) == 0 or len(flipTimes) == 0:
+        return results
+
+    previousFlip = np.searchsorted(flipTimes, eventTimes, side = 'right') - 1
+    valid = previousFlip >= 0
+    offsets = 1000*(eventTimes[valid] - flipTimes[previousFlip[valid]])
+    results['meanOffset'] = offsets.mean()
+    results['jitter'] = offsets.std()
+    results['maxOffset'] = offsets.max()
+    duration = eventTimes[-1] - eventTimes[0]
+    results['throughput'] = (len(eventTimes) - 1)/duration if duration > 0 else float('nan')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'TTL timing benchmark against a fake serial port')
+    parser.add_argument('--protocols', nargs = '+', default = None, help = 'protocols to run (default: all)')
+    parser.add_argument('--modes', nargs = '+', default = ['Pulse', 'Sustained'], choices = ['Pulse', 'Sustained'])
+    parser.add_argument('--async', dest = 'useWriter', action = 'store_true', help = 'also run with the background ttlWriter')
+    parser.add_argument('--reps', type = int, default = 1, help = 'stimulusReps for every protocol')
+    parser.add_argument('--frameRate', type = float, default = 60.0)
+    parser.add_argument('--monitor', default = 'testMonitor', help = 'psychopy monitor used to convert degrees to pixels')
+    parser.add_argument('--realtime', action = 'store_true', help = 'pace flips at the frame rate')
+    parser.add_argument('--maxOffset', type = float, default = None, help = 'fail if any TTL comes more than this many ms after its flip')
+    args = parser.parse_args()
+
+    protocols.protocol.GL = mock.MagicMock() #warmUp calls glFinish, which needs a GL context
+    writerOptions = [False, True] if args.useWriter else [False]
+
+    failures = []
+    print(f"{'Protocol':<26}{'Mode':<11}{'Writer':<8}{'TTLs':>7}{'Missed':>8}{'Offset ms':>11}{'Jitter ms':>11}{'Max ms':>9}{'TTL/s':>10}")
+    for name in (args.protocols or listProtocols()):
+        for mode in args.modes:
+            for useWriter in writerOptions:
+                try:
+                    port, win, p = runProtocol(name, mode, useWriter, args)
+                except Exception as e:
+                    print(f"{name:<26}{mode:<11}{str(useWriter):<8}  could not run: {e!r}")
+                    failures.append(f"{name} ({mode}, writer {useWriter}): could not run ({e!r})")
+                    continue
+
+                r = summarize(port, win, p, mode)
+                if r['missed'] != 0:
+                    failures.append(f"{name} ({mode}, writer {useWriter}): {r['missed']} TTLs missed")
+                if args.maxOffset is not None and r.get('maxOffset', 0) > args.maxOffset:
+                    failures.append(f"{name} ({mode}, writer {useWriter}): a TTL came {r['maxOffset']:.3f} ms after its flip")
+                if 'meanOffset' in r:
+                    print(f"{name:<26}{mode:<11}{str(useWriter):<8}{r['events']:>7}{r['missed']:>8}{r['meanOffset']:>11.4f}{r['jitter']:>11.4f}{r['maxOffset']:>9.3f}{r['throughput']:>10.1f}")
+                else:
+                    print(f"{name:<26}{mode:<11}{str(useWriter):<8}{r['events']:>7}{r['missed']:>8}")
+
+    if failures:
+        print('\nFAILED:')
+        for f in failures:
+            print('    ' + f)
+        sys.exit(1)
+    print('\nPASSED')